@@ -0,0 +1,214 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+User = get_user_model()
+
+# всё, что нужно вьюхам от request.user; остальные поля
+# (например, password) догружаются из БД при обращении
+SNAPSHOT_FIELDS = ('email', 'name', 'last_name', 'is_active', 'is_staff')
+
+
+class LocalCache:
+    """LRU с TTL в памяти процесса"""
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            item = self.data.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self.data[key]
+                return None
+            self.data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if self.maxsize <= 0 or self.ttl <= 0:
+            return
+        with self.lock:
+            self.data[key] = (time.monotonic() + self.ttl, value)
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.data.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+
+local_cache = LocalCache(
+    getattr(settings, 'AUTH_TOKEN_LOCAL_CACHE_SIZE', 10000),
+    getattr(settings, 'AUTH_TOKEN_LOCAL_CACHE_TTL', 5),
+)
+stats = {'local_hits': 0, 'cache_hits': 0, 'misses': 0}
+
+
+def get_cache_ttl():
+    return getattr(settings, 'AUTH_TOKEN_CACHE_TTL', 60 * 5)
+
+
+def get_cache_key(key):
+    # сам токен в общий кэш не кладём
+    return f'auth:token:{hashlib.sha256(key.encode()).hexdigest()}'
+
+
+def get_generation_key(user_pk):
+    digest = hashlib.sha256(str(user_pk).encode()).hexdigest()
+    return f'auth:user_generation:{digest}'
+
+
+def bump_generations(user_pks):
+    """
+    Поколение пользователя в общем кэше: записи LRU других процессов
+    с прежним поколением считаются отозванными. Если ключ вытеснен,
+    get вернёт None, запись LRU не совпадёт и пойдёт на промах.
+    """
+    for pk in user_pks:
+        key = get_generation_key(pk)
+        cache.add(key, 0, get_cache_ttl())
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, get_cache_ttl())
+
+
+def make_snapshot(user):
+    return {name: getattr(user, name) for name in SNAPSHOT_FIELDS}
+
+
+def user_from_snapshot(snapshot):
+    # как объект из БД, у которого загружены только эти поля
+    names = [field.attname for field in User._meta.concrete_fields
+             if field.attname in snapshot]
+    return User.from_db(DEFAULT_DB_ALIAS, names,
+                        [snapshot[name] for name in names])
+
+
+def cache_token(key, user):
+    snapshot = make_snapshot(user)
+    generation = cache.get(get_generation_key(user.pk))
+    cache.set(get_cache_key(key), snapshot, get_cache_ttl())
+    local_cache.set(key, (generation, snapshot))
+
+
+def get_user_token(user):
+    """
+    Ключ токена пользователя: один SELECT по user_id (сам ключ в
+    общий кэш не кладём). Заодно кладёт снимок пользователя в кэш:
+    первый запрос с новым токеном уже не идёт в БД.
+    """
+    key = Token.objects.filter(user=user) \
+        .values_list('key', flat=True).first()
+    if key is None:
+        key = Token.objects.get_or_create(user=user)[0].key
+    cache_token(key, user)
+    return key
+
+
+def _delete_tokens(keys, user_pks):
+    for key in keys:
+        local_cache.delete(key)
+    cache.delete_many([get_cache_key(key) for key in keys])
+    bump_generations(user_pks)
+
+
+def invalidate_tokens(keys, user_pks=()):
+    """
+    Сбрасывает токены в кэше Django и в LRU этого процесса; LRU
+    остальных процессов отзываются сменой поколения user_pks
+    """
+    keys = list(keys)
+    user_pks = list(user_pks)
+    if not keys and not user_pks:
+        return
+    _delete_tokens(keys, user_pks)
+    # повторно после коммита: параллельный запрос мог успеть
+    # положить в кэш данные, прочитанные до конца транзакции
+    transaction.on_commit(lambda: _delete_tokens(keys, user_pks))
+
+
+def invalidate_user_tokens(user):
+    invalidate_tokens(Token.objects.filter(user=user)
+                      .values_list('key', flat=True), [user.pk])
+
+
+def get_auth_cache_stats():
+    """Счётчики текущего процесса"""
+    hits = stats['local_hits'] + stats['cache_hits']
+    total = hits + stats['misses']
+    return {
+        **stats,
+        'local_size': len(local_cache.data),
+        'hit_rate': round(hits / total, 4) if total else 0,
+    }
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication без запроса Token + User на каждый запрос:
+    снимок пользователя ищется в LRU процесса, затем в кэше Django.
+    Кэш сбрасывается сигналами account.signals при удалении токена
+    (logout) и сохранении пользователя (смена пароля, деактивация).
+    Запись LRU действительна, пока не сменилось поколение
+    пользователя в кэше Django - это один короткий get, так что
+    отзыв виден всем процессам сразу.
+    """
+    def authenticate_credentials(self, key):
+        snapshot = self.get_local_snapshot(key)
+        if snapshot is not None:
+            stats['local_hits'] += 1
+        else:
+            snapshot = cache.get(get_cache_key(key))
+            if snapshot is not None:
+                stats['cache_hits'] += 1
+                pk = snapshot[User._meta.pk.attname]
+                local_cache.set(key, (cache.get(get_generation_key(pk)),
+                                      snapshot))
+            else:
+                stats['misses'] += 1
+                user, token = super().authenticate_credentials(key)
+                cache_token(key, user)
+                return user, token
+
+        if not snapshot['is_active']:
+            raise exceptions.AuthenticationFailed(
+                _('User inactive or deleted.')
+            )
+        user = user_from_snapshot(snapshot)
+        token = Token.from_db(DEFAULT_DB_ALIAS, ['key', 'user_id'],
+                              [key, user.pk])
+        token.user = user
+        return user, token
+
+    @staticmethod
+    def get_local_snapshot(key):
+        entry = local_cache.get(key)
+        if entry is None:
+            return None
+        generation, snapshot = entry
+        pk = snapshot[User._meta.pk.attname]
+        if cache.get(get_generation_key(pk)) != generation:
+            local_cache.delete(key)
+            return None
+        return snapshot
@@ -0,0 +1,167 @@
+import smtplib
+from datetime import timedelta
+from functools import partial
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.db.models import Count, F, Q
+from django.utils import timezone
+
+from account.models import DigestBatch, DigestRun
+from product.models import Product
+
+User = get_user_model()
+
+
+def get_batch_size():
+    return getattr(settings, 'DIGEST_BATCH_SIZE', 500)
+
+
+def get_lease():
+    return timedelta(seconds=getattr(settings, 'DIGEST_BATCH_LEASE', 600))
+
+
+def get_max_attempts():
+    return getattr(settings, 'DIGEST_BATCH_MAX_ATTEMPTS', 10)
+
+
+def is_digest_time():
+    return timezone.localtime().hour >= getattr(settings, 'DIGEST_HOUR', 20)
+
+
+def dispatch(batch_ids):
+    from account.tasks import send_digest_batch
+
+    for batch_id in batch_ids:
+        send_digest_batch.delay(batch_id)
+
+
+def redispatch_stale_batches(run):
+    """
+    Пачки, задача которых потерялась или упала, ставятся заново,
+    исчерпавшие DIGEST_BATCH_MAX_ATTEMPTS - бросаются
+    """
+    now = timezone.now()
+    stale = DigestBatch.objects.filter(run=run, status='pending').filter(
+        Q(locked_until__lt=now) |
+        Q(locked_until__isnull=True, created_at__lt=now - get_lease())
+    )
+    stale.filter(attempts__gte=get_max_attempts()) \
+        .update(status='failed', locked_until=None)
+    dispatch(list(stale.filter(attempts__lt=get_max_attempts())
+                  .values_list('pk', flat=True)))
+
+
+def start_digest(key=None, batch_size=None):
+    """
+    Координатор: режет активных пользователей на пачки по диапазонам
+    pk и ставит задачу на каждую. Каждая страница - своя транзакция
+    с блокировкой строки DigestRun, так что параллельные запуски
+    не создают одну пачку дважды. В памяти - не больше batch_size pk.
+    """
+    key = key or timezone.localdate().isoformat()
+    batch_size = batch_size or get_batch_size()
+    run, _ = DigestRun.objects.get_or_create(key=key)
+    redispatch_stale_batches(run)
+    while True:
+        with transaction.atomic():
+            run = DigestRun.objects.select_for_update().get(pk=run.pk)
+            if run.finished_at:
+                return run
+            users = User.objects.filter(is_active=True)
+            if run.checkpoint:
+                users = users.filter(pk__gt=run.checkpoint)
+            pks = list(users.order_by('pk')
+                       .values_list('pk', flat=True)[:batch_size])
+            if not pks:
+                run.finished_at = timezone.now()
+                run.save(update_fields=['finished_at'])
+                return run
+            batch = DigestBatch.objects.create(run=run, first_pk=pks[0],
+                                               last_pk=pks[-1])
+            run.checkpoint = pks[-1]
+            run.batches += 1
+            run.recipients += len(pks)
+            run.save(update_fields=['checkpoint', 'batches', 'recipients'])
+            transaction.on_commit(partial(dispatch, [batch.pk]))
+
+
+def get_digest_context():
+    """Общая для всех получателей часть, один запрос на пачку"""
+    since = timezone.now() - timedelta(days=1)
+    return {
+        'updated_products': Product.objects.filter(updated_at__gte=since)
+        .count(),
+    }
+
+
+def build_message(user, context, connection):
+    lines = [f'Привет, {user.name}!', '',
+             f'Новых и обновлённых товаров за сутки: '
+             f'{context["updated_products"]}']
+    if user.active_orders:
+        lines.append(f'Заказов в работе: {user.active_orders}')
+    return EmailMessage('Вечерний дайджест', '\n'.join(lines),
+                        'test@gmail.com', [user.email],
+                        connection=connection)
+
+
+def send_batch(batch_id):
+    """
+    Отправляет письма пачки через одно SMTP-соединение. Пачка
+    берётся в аренду условным UPDATE, поэтому повторно доставленная
+    задача её пропустит. Прогресс (last_sent_pk) сохраняется и при
+    ошибке, повтор задачи не шлёт письма второй раз. Адрес, который
+    сервер отклонил, пропускается и учитывается в failed_count.
+    Возвращает число отправленных писем.
+    """
+    now = timezone.now()
+    claimed = DigestBatch.objects.filter(
+        pk=batch_id, status='pending', attempts__lt=get_max_attempts()
+    ).filter(
+        Q(locked_until__isnull=True) | Q(locked_until__lt=now)
+    ).update(locked_until=now + get_lease(), attempts=F('attempts') + 1)
+    if not claimed:
+        return 0
+    batch = DigestBatch.objects.get(pk=batch_id)
+    users = User.objects.filter(is_active=True, pk__gte=batch.first_pk,
+                                pk__lte=batch.last_pk)
+    if batch.last_sent_pk:
+        users = users.filter(pk__gt=batch.last_sent_pk)
+    # всё, что нужно для писем пачки, - одним запросом
+    users = users.only('email', 'name').order_by('pk').annotate(
+        active_orders=Count('orders', filter=Q(
+            orders__status__in=('open', 'in_progress')
+        ))
+    )
+    context = get_digest_context()
+
+    sent = 0
+    connection = get_connection(fail_silently=False)
+    try:
+        connection.open()
+        for user in users:
+            try:
+                connection.send_messages([build_message(user, context,
+                                                        connection)])
+            except smtplib.SMTPRecipientsRefused:
+                batch.failed_count += 1
+            else:
+                sent += 1
+            batch.last_sent_pk = user.pk
+        batch.status = 'sent'
+        batch.sent_at = timezone.now()
+    except Exception:
+        if batch.attempts >= get_max_attempts():
+            batch.status = 'failed'
+        raise
+    finally:
+        connection.close()
+        batch.sent_count += sent
+        batch.locked_until = None
+        batch.save(update_fields=['last_sent_pk', 'sent_count',
+                                  'failed_count', 'status', 'sent_at',
+                                  'locked_until'])
+    return sent
@@ -0,0 +1,164 @@
+import smtplib
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from account.models import OutgoingEmail
+
+DRAIN_SCHEDULED_KEY = 'mail_outbox:drain_scheduled'
+# сервер ответил отказом на конкретное письмо - соединение живо
+MESSAGE_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused,
+                  smtplib.SMTPDataError)
+
+
+def get_batch_size():
+    return getattr(settings, 'MAIL_OUTBOX_BATCH_SIZE', 100)
+
+
+def get_max_attempts():
+    return getattr(settings, 'MAIL_OUTBOX_MAX_ATTEMPTS', 5)
+
+
+def get_retry_delay(attempts):
+    # 1, 2, 4, ... минуты, но не больше часа
+    base = getattr(settings, 'MAIL_OUTBOX_RETRY_DELAY', 60)
+    return timedelta(seconds=min(base * 2 ** (attempts - 1), 60 * 60))
+
+
+def enqueue_mail(subject, body, from_email, to):
+    """
+    Ставит письмо в очередь вместо отправки в запросе.
+    Задача drain_outbox запускается после коммита.
+    """
+    email = OutgoingEmail.objects.create(subject=subject, body=body,
+                                         from_email=from_email or '',
+                                         to=list(to))
+    transaction.on_commit(schedule_drain)
+    return email
+
+
+def schedule_drain():
+    from account.tasks import drain_outbox
+
+    # одна задача на письма, пришедшие за MAIL_OUTBOX_DRAIN_DELAY
+    delay = getattr(settings, 'MAIL_OUTBOX_DRAIN_DELAY', 1)
+    if cache.add(DRAIN_SCHEDULED_KEY, 1, delay + 60):
+        drain_outbox.apply_async(countdown=delay)
+
+
+def get_lease():
+    return timedelta(seconds=getattr(settings, 'MAIL_OUTBOX_LEASE', 60 * 5))
+
+
+def claim_batch(batch_size):
+    """
+    Берёт письма, которым пора, в аренду: next_attempt_at сдвигается
+    на MAIL_OUTBOX_LEASE, и параллельный drain их пропустит. Строки
+    заблокированы только на время этой транзакции, не на время
+    отправки; если процесс упадёт, письма вернутся в очередь после
+    аренды.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        batch = list(
+            OutgoingEmail.objects
+            .filter(status='pending', next_attempt_at__lte=now)
+            .select_for_update(skip_locked=True)
+            .order_by('next_attempt_at')[:batch_size]
+        )
+        if batch:
+            OutgoingEmail.objects.filter(pk__in=[e.pk for e in batch]) \
+                .update(next_attempt_at=now + get_lease())
+    return batch
+
+
+def release(batch):
+    """Возвращает неотправленные письма в очередь, не тратя попытку"""
+    OutgoingEmail.objects.filter(pk__in=[email.pk for email in batch]) \
+        .update(next_attempt_at=timezone.now() + get_retry_delay(1))
+
+
+def is_connection_error(error):
+    # SMTPException - тоже OSError: обрыв, таймаут, SMTPConnectError
+    return isinstance(error, OSError) and \
+        not isinstance(error, MESSAGE_ERRORS)
+
+
+def send_batch(connection, batch):
+    """
+    Отправляет пачку через уже открытое соединение. Результат каждого
+    письма сохраняется сразу после отправки, поэтому ошибка дальше по
+    пачке не вернёт отправленные письма в очередь. Ошибка одного письма
+    не прерывает остальные: оно уходит на повтор с отступом или, после
+    MAIL_OUTBOX_MAX_ATTEMPTS попыток, в failed. После ошибки соединения
+    оно открывается заново; если и новое не работает, остаток пачки
+    возвращается в очередь без траты попыток.
+    """
+    reconnected = False
+    for index, email in enumerate(batch):
+        message = EmailMessage(email.subject, email.body,
+                               email.from_email or None, email.to,
+                               connection=connection)
+        email.attempts += 1
+        try:
+            connection.send_messages([message])
+        except Exception as e:
+            if reconnected and is_connection_error(e):
+                # сервер недоступен: остальные письма - позже
+                release(batch[index:])
+                raise
+            email.last_error = repr(e)
+            if email.attempts >= get_max_attempts():
+                email.status = 'failed'
+            else:
+                email.next_attempt_at = timezone.now() + \
+                    get_retry_delay(email.attempts)
+            email.save(update_fields=['status', 'attempts',
+                                      'next_attempt_at', 'last_error'])
+            if is_connection_error(e):
+                # сессия оборвалась - открываем новую
+                connection.close()
+                try:
+                    connection.open()
+                except Exception:
+                    release(batch[index + 1:])
+                    raise
+                reconnected = True
+        else:
+            reconnected = False
+            email.status = 'sent'
+            email.sent_at = timezone.now()
+            email.save(update_fields=['status', 'attempts', 'sent_at'])
+
+
+def drain(batch_size=None):
+    """
+    Отправляет все письма, которым пора, пачками по batch_size
+    через одно SMTP-соединение. Соединение открывается только
+    при первой непустой пачке. Возвращает число обработанных писем.
+    """
+    batch_size = batch_size or get_batch_size()
+    cache.delete(DRAIN_SCHEDULED_KEY)
+    processed = 0
+    connection = None
+    try:
+        while True:
+            batch = claim_batch(batch_size)
+            if not batch:
+                return processed
+            if connection is None:
+                connection = get_connection(fail_silently=False)
+                try:
+                    connection.open()
+                except Exception:
+                    release(batch)
+                    raise
+            send_batch(connection, batch)
+            processed += len(batch)
+    finally:
+        if connection is not None:
+            connection.close()
@@ -0,0 +1,63 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import get_hasher, make_password
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIRequestFactory
+
+from account.authentication import invalidate_tokens
+from account.views import LoginView
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Пропускная способность входа через LoginView на текущем ' \
+           'хэшере паролей (пользователи откатываются, throttling выключен)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=20)
+        parser.add_argument('--logins', type=int, default=100)
+
+    def handle(self, *args, **options):
+        view = LoginView.as_view(throttle_classes=[])
+        factory = APIRequestFactory()
+        password = make_password('benchmark')
+        self.stdout.write(f'Хэшер: {get_hasher().algorithm}')
+        with transaction.atomic():
+            User.objects.bulk_create(
+                User(email=f'benchmark-{i}@example.com', name='Benchmark',
+                     password=password, is_active=True)
+                for i in range(options['users'])
+            )
+            for label, prefix in (('существующие email', 'benchmark'),
+                                  ('неизвестные email', 'unknown')):
+                self.run(view, factory, label, prefix, options)
+            users = list(User.objects.filter(email__startswith='benchmark-')
+                         .values_list('pk', flat=True))
+            keys = list(Token.objects.filter(user__in=users)
+                        .values_list('key', flat=True))
+            transaction.set_rollback(True)
+        # токены откатились - убираем их из кэша
+        invalidate_tokens(keys, users)
+
+    def run(self, view, factory, label, prefix, options):
+        users = options['users']
+        logins = options['logins']
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            for i in range(logins):
+                request = factory.post('/api/v1/login/', {
+                    'email': f'{prefix}-{i % users}@example.com',
+                    'password': 'benchmark',
+                }, format='json')
+                view(request)
+            elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f'{label}: {logins / elapsed:.1f} входов/с, '
+            f'{elapsed * 1000 / logins:.1f} мс и '
+            f'{len(queries) / logins:.2f} запросов на вход'
+        )
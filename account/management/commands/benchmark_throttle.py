@@ -0,0 +1,31 @@
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+
+from shop.throttling import check_rate, get_window_store
+
+
+class Command(BaseCommand):
+    help = 'Стоимость одной проверки throttling на текущем бэкенде кэша'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--checks', type=int, default=10000)
+        parser.add_argument('--keys', type=int, default=100)
+
+    def handle(self, *args, **options):
+        checks = options['checks']
+        prefix = f'throttle:benchmark:{uuid.uuid4().hex}'
+        keys = [f'{prefix}:{i}' for i in range(options['keys'])]
+        started = time.perf_counter()
+        rejected = 0
+        for i in range(checks):
+            # лимит заведомо больше числа проверок на ключ
+            if check_rate(keys[i % len(keys)], checks, 60) is not None:
+                rejected += 1
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f'{type(get_window_store()).__name__}: {checks} проверок, '
+            f'{elapsed * 1e6 / checks:.1f} мкс на проверку, '
+            f'отклонено {rejected}'
+        )
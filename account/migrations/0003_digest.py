@@ -0,0 +1,51 @@
+# Generated by Django 3.2 on 2026-10-18 11:15
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0002_outgoingemail'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DigestRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=50, unique=True)),
+                ('checkpoint', models.CharField(blank=True, max_length=254)),
+                ('batches', models.PositiveIntegerField(default=0)),
+                ('recipients', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(null=True)),
+            ],
+            options={
+                'db_table': 'digest_runs',
+            },
+        ),
+        migrations.CreateModel(
+            name='DigestBatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('first_pk', models.CharField(max_length=254)),
+                ('last_pk', models.CharField(max_length=254)),
+                ('last_sent_pk', models.CharField(blank=True, max_length=254)),
+                ('sent_count', models.PositiveIntegerField(default=0)),
+                ('status', models.CharField(choices=[('pending', 'В очереди'), ('sent', 'Отправлено')], default='pending', max_length=20)),
+                ('locked_until', models.DateTimeField(null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('sent_at', models.DateTimeField(null=True)),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='digest_batches', to='account.digestrun')),
+            ],
+            options={
+                'db_table': 'digest_batches',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='digestbatch',
+            constraint=models.UniqueConstraint(fields=('run', 'first_pk'), name='digest_batch_run_first_pk_uniq'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.2 on 2026-10-18 11:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0003_digest'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='digestbatch',
+            name='attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='digestbatch',
+            name='failed_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='digestbatch',
+            name='status',
+            field=models.CharField(choices=[('pending', 'В очереди'), ('sent', 'Отправлено'), ('failed', 'Не отправлено')], default='pending', max_length=20),
+        ),
+    ]
@@ -1,6 +1,6 @@
 from django.contrib.auth.base_user import AbstractBaseUser, BaseUserManager
-from django.core.mail import send_mail
 from django.db import models
+from django.utils import timezone
 from django.utils.crypto import get_random_string
 
 
@@ -58,8 +58,88 @@ class User(AbstractBaseUser):
         Благодарим Вас за регистрацию на нашем сайте.
         Ваш код активации: {self.activation_code}
         """
-        send_mail('Активация аккаунта',
-                  message,
-                  'test@gmail.com',
-                  [self.email],
-                  )
+        from account.mail import enqueue_mail
+
+        enqueue_mail('Активация аккаунта',
+                     message,
+                     'test@gmail.com',
+                     [self.email])
+
+
+MAIL_STATUS_CHOICES = (
+    ('pending', 'В очереди'),
+    ('sent', 'Отправлено'),
+    ('failed', 'Не отправлено')
+)
+
+
+class OutgoingEmail(models.Model):
+    """Письмо в очереди на отправку, см. account.mail"""
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=255, blank=True)
+    to = models.JSONField()
+    status = models.CharField(max_length=20,
+                              choices=MAIL_STATUS_CHOICES,
+                              default='pending')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    # до этого момента письмо не берётся (отступ после ошибки)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True)
+
+    class Meta:
+        db_table = 'outgoing_emails'
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'],
+                         name='outgoing_emails_queue_idx')
+        ]
+
+
+class DigestRun(models.Model):
+    """
+    Рассылка дайджеста за день (key - дата). Координатор идёт по
+    активным пользователям в порядке pk и сохраняет в checkpoint
+    последний поставленный в пачку pk, поэтому повторный запуск
+    продолжает с того же места, а не начинает заново.
+    """
+    key = models.CharField(max_length=50, unique=True)
+    checkpoint = models.CharField(max_length=254, blank=True)
+    batches = models.PositiveIntegerField(default=0)
+    recipients = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True)
+
+    class Meta:
+        db_table = 'digest_runs'
+
+
+class DigestBatch(models.Model):
+    """Пользователи с pk от first_pk до last_pk, одна задача отправки"""
+    run = models.ForeignKey(DigestRun,
+                            on_delete=models.CASCADE,
+                            related_name='digest_batches')
+    first_pk = models.CharField(max_length=254)
+    last_pk = models.CharField(max_length=254)
+    # до кого письма уже ушли - повтор задачи продолжает отсюда
+    last_sent_pk = models.CharField(max_length=254, blank=True)
+    sent_count = models.PositiveIntegerField(default=0)
+    # адреса, отклонённые сервером; на них пачка не останавливается
+    failed_count = models.PositiveIntegerField(default=0)
+    # после DIGEST_BATCH_MAX_ATTEMPTS пачка уходит в failed
+    attempts = models.PositiveSmallIntegerField(default=0)
+    status = models.CharField(max_length=20,
+                              choices=MAIL_STATUS_CHOICES,
+                              default='pending')
+    # задача, взявшая пачку, держит её до этого момента
+    locked_until = models.DateTimeField(null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True)
+
+    class Meta:
+        db_table = 'digest_batches'
+        constraints = [
+            models.UniqueConstraint(fields=['run', 'first_pk'],
+                                    name='digest_batch_run_first_pk_uniq')
+        ]
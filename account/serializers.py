@@ -1,8 +1,7 @@
-from django.contrib.auth import get_user_model, authenticate
-from django.core.mail import send_mail
+from django.contrib.auth import get_user_model
 # from django.utils.crypto import get_random_string
 from rest_framework import serializers
-from .tasks import send_activation_mail
+from .mail import enqueue_mail
 
 User = get_user_model()
 
@@ -29,8 +28,7 @@ class RegistrationSerializer(serializers.Serializer):
     def create(self, validated_data):
         user = User.objects.create_user(**validated_data)
         user.create_activation_code()
-        send_activation_mail.delay(user.email, user.activation_code)
-        # user.send_activation_email()
+        user.send_activation_email()
         return user
 
 
@@ -102,10 +100,10 @@ class ForgotPasswordSerializer(serializers.Serializer):
         email = self.validated_data.get('email')
         user = User.objects.get(email=email)
         user.create_activation_code()
-        send_mail('Восстановление пароля',
-                  f'Ваш код восстановления: {user.activation_code}',
-                  'test1@gmail.com',
-                  [user.email])
+        enqueue_mail('Восстановление пароля',
+                     f'Ваш код восстановления: {user.activation_code}',
+                     'test1@gmail.com',
+                     [user.email])
 
 
 class ForgotPassCompleteSerializer(serializers.Serializer):
@@ -138,23 +136,20 @@ class LoginSerializer(serializers.Serializer):
     email = serializers.EmailField(required=True)
     password = serializers.CharField(required=True)
 
-    def validate_email(self, email):
-        if not User.objects.filter(email=email).exists():
-            raise serializers.ValidationError('Пользователь не найден')
-        return email
-
     def validate(self, data):
-        request = self.context.get('request')
         email = data.get('email')
         password = data.get('password')
-        if email and password:
-            user = authenticate(username=email,
-                                password=password,
-                                request=request)
-            if not user:
-                raise serializers.ValidationError('Неверный email или пароль')
-        else:
-            raise serializers.ValidationError('Email и пароль обязательны')
+        # один SELECT вместо exists() + authenticate()
+        user = User.objects.filter(email=email).first()
+        if user is None:
+            # хэшируем впустую, чтобы по времени ответа нельзя было
+            # узнать, зарегистрирован ли email
+            User().set_password(password)
+            raise serializers.ValidationError('Неверный email или пароль')
+        # check_password пересчитывает устаревший хэш
+        # (см. PASSWORD_HASHER в settings)
+        if not user.check_password(password) or not user.is_active:
+            raise serializers.ValidationError('Неверный email или пароль')
         data['user'] = user
         return data
 
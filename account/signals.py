@@ -0,0 +1,19 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from account.authentication import invalidate_tokens, invalidate_user_tokens
+
+User = get_user_model()
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_deleted_token(sender, instance, **kwargs):
+    invalidate_tokens([instance.key], [instance.user_id])
+
+
+@receiver(post_save, sender=User)
+def invalidate_user_token_cache(sender, instance, raw=False, **kwargs):
+    if not raw:
+        invalidate_user_tokens(instance)
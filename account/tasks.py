@@ -1,24 +1,40 @@
 from celery import shared_task
-from django.core.mail import send_mail
+
+from account.digest import is_digest_time, send_batch, start_digest
+from account.mail import drain, enqueue_mail
 
 
 @shared_task
 def send_activation_mail(email, activation_code):
+    # оставлена для задач, поставленных до перехода на очередь писем
     message = f"""
             Благодарим Вас за регистрацию на нашем сайте.
             Ваш код активации: {activation_code}
             """
-    send_mail('Активация аккаунта',
-              message,
-              'test@gmail.com',
-              [email],
-              )
+    enqueue_mail('Активация аккаунта',
+                 message,
+                 'test@gmail.com',
+                 [email])
+
+
+@shared_task
+def drain_outbox():
+    return drain()
 
 
 @shared_task
 def notify_user():
-    send_mail('Вечерний дайджест',
-              'Привет!',
-              'test@gmail.com',
-              ['addirossi@gmail.com'])
+    # beat вызывает каждую минуту: до DIGEST_HOUR ничего не делаем,
+    # потом первый вызов за день запускает рассылку, следующие
+    # продолжают её с checkpoint, если координатор не дошёл до конца
+    if not is_digest_time():
+        return None
+    return start_digest().pk
+
 
+@shared_task(bind=True, max_retries=5)
+def send_digest_batch(self, batch_id):
+    try:
+        return send_batch(batch_id)
+    except OSError as e:  # в том числе smtplib.SMTPException
+        raise self.retry(exc=e, countdown=60 * 2 ** self.request.retries)
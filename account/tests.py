@@ -1,3 +1,511 @@
-from django.test import TestCase
+import smtplib
+import socket
+import unittest
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.cache import cache
+from django.db import connection
+from django.test import SimpleTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APITestCase
+
+from order.models import Order
+from shop.testing import LocalSMTPServer, eager_celery
+from shop.throttling import check_rate
+from .authentication import get_cache_key, local_cache
+from .hashers import TunedArgon2PasswordHasher
+from .digest import send_batch, start_digest
+from .mail import drain, enqueue_mail
+from .models import DigestBatch, DigestRun, OutgoingEmail
+from .tasks import notify_user
+
+try:
+    import argon2
+except ImportError:
+    argon2 = None
+
+User = get_user_model()
+
+# для LocalSMTPServer, порт - smtp.port
+SMTP_SETTINGS = {
+    'EMAIL_BACKEND': 'django.core.mail.backends.smtp.EmailBackend',
+    'EMAIL_HOST': '127.0.0.1',
+    'EMAIL_HOST_USER': '',
+    'EMAIL_HOST_PASSWORD': '',
+    'EMAIL_USE_TLS': False,
+}
+
+
+class TestCachedTokenAuthentication(APITestCase):
+    def setUp(self) -> None:
+        local_cache.clear()
+        self.user = User.objects.create_user('test1@gmail.com',
+                                             'qwerty',
+                                             name='User1',
+                                             is_active=True)
+        self.token = Token.objects.create(user=self.user)
+        self.url = reverse('order-list')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def token_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return [query for query in queries
+                if 'authtoken_token' in query['sql']]
+
+    def assertTokenRejected(self):
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+
+    def test_token_is_cached(self):
+        self.assertEqual(len(self.token_queries()), 1)
+        self.assertEqual(self.token_queries(), [])
+        # другой процесс: пусто в LRU, но есть в кэше Django
+        local_cache.clear()
+        self.assertEqual(self.token_queries(), [])
+
+    def test_logout_invalidates_cache(self):
+        self.token_queries()
+        response = self.client.post('/api/v1/logout/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(cache.get(get_cache_key(self.token.key)))
+        self.assertTokenRejected()
+
+    def test_revocation_reaches_other_processes(self):
+        self.token_queries()
+        # тёплая запись LRU другого процесса: logout там не выполнялся
+        entry = local_cache.get(self.token.key)
+        self.assertIsNotNone(entry)
+        response = self.client.post('/api/v1/logout/')
+        self.assertEqual(response.status_code, 200)
+        local_cache.set(self.token.key, entry)
+        self.assertTokenRejected()
+
+        token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        self.token_queries()
+        entry = local_cache.get(token.key)
+        self.user.is_active = False
+        self.user.save()
+        local_cache.set(token.key, entry)
+        self.assertTokenRejected()
+
+    def test_deactivation_invalidates_cache(self):
+        self.token_queries()
+        self.user.is_active = False
+        self.user.save()
+        self.assertTokenRejected()
+
+    def test_change_password_with_cached_user(self):
+        self.token_queries()
+        response = self.client.post('/api/v1/change_password/', {
+            'old_password': 'qwerty',
+            'new_password': 'qwerty2',
+            'new_password_confirm': 'qwerty2',
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(cache.get(get_cache_key(self.token.key)))
+        user = User.objects.get(pk=self.user.pk)
+        self.assertTrue(user.check_password('qwerty2'))
+        self.assertEqual((user.name, user.is_active), ('User1', True))
+
+    def test_forgot_password_complete_invalidates_cache(self):
+        self.token_queries()
+        User.objects.filter(pk=self.user.pk).update(activation_code='code')
+        self.assertIsNotNone(cache.get(get_cache_key(self.token.key)))
+        response = self.client.post('/api/v1/forgot_password_complete/', {
+            'email': self.user.email,
+            'code': 'code',
+            'password': 'qwerty2',
+            'password_confirm': 'qwerty2',
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(cache.get(get_cache_key(self.token.key)))
+
+    def test_stats(self):
+        url = '/api/v1/auth_cache_stats/'
+        self.assertEqual(self.client.get(url).status_code, 403)
+        admin = User.objects.create_superuser('admin@gmail.com', 'qwerty',
+                                              name='Admin1')
+        self.client.force_authenticate(admin)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('hit_rate', response.data)
+
+
+def throttle_rates(**rates):
+    return override_settings(REST_FRAMEWORK={
+        **settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': rates
+    })
+
+
+class TestSlidingWindow(SimpleTestCase):
+    def setUp(self) -> None:
+        cache.clear()
+
+    def test_check_rate(self):
+        for _ in range(10):
+            self.assertIsNone(check_rate('test', 10, 60, now=30))
+        self.assertEqual(check_rate('test', 10, 60, now=30), 30)
+        # предыдущее окно (11 запросов) учитывается с весом 0.5
+        self.assertIsNone(check_rate('test', 10, 60, now=90))
+        for _ in range(3):
+            check_rate('test', 10, 60, now=90)
+        # 5 + 11 * 0.5 > 10: ждём, пока вес не упадёт до 5/11
+        self.assertEqual(check_rate('test', 10, 60, now=90), 3)
+        self.assertIsNone(check_rate('test', 10, 60, now=150))
+
+
+@throttle_rates(login_ip='4/min', login_email='2/min')
+class TestAccountThrottling(APITestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        User.objects.create_user('test1@gmail.com', 'qwerty',
+                                 name='User1', is_active=True)
+
+    def login(self, email):
+        return self.client.post('/api/v1/login/', {'email': email,
+                                                   'password': 'wrong'})
+
+    def test_login_throttled_by_email_and_ip(self):
+        for _ in range(2):
+            self.assertEqual(self.login('test1@gmail.com').status_code, 400)
+        response = self.login('TEST1@gmail.com ')
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+
+        # отклонённые запросы тоже считаются
+        self.assertEqual(self.login('other@gmail.com').status_code, 400)
+        # лимит по IP исчерпан для любых email
+        self.assertEqual(self.login('third@gmail.com').status_code, 429)
+
+
+class TestForgotPasswordThrottling(APITestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.user = User.objects.create_user('test1@gmail.com', 'qwerty',
+                                             name='User1', is_active=True)
+
+    def test_complete_has_own_limit(self):
+        for _ in range(3):
+            response = self.client.post('/api/v1/forgot_password/',
+                                        {'email': self.user.email})
+            self.assertEqual(response.status_code, 200)
+        self.user.refresh_from_db()
+        url = '/api/v1/forgot_password_complete/'
+        data = {'email': self.user.email, 'password': 'qwerty2',
+                'password_confirm': 'qwerty2'}
+        # пара опечаток в коде после исчерпанного лимита запросов кода
+        for _ in range(2):
+            response = self.client.post(url, {**data, 'code': 'wrong'})
+            self.assertEqual(response.status_code, 400)
+        response = self.client.post(
+            url, {**data, 'code': self.user.activation_code}
+        )
+        self.assertEqual(response.status_code, 200)
+
+
+class TestLogin(APITestCase):
+    url = '/api/v1/login/'
+
+    def setUp(self) -> None:
+        cache.clear()
+        local_cache.clear()
+        self.user = User.objects.create_user('test1@gmail.com',
+                                             'qwerty',
+                                             name='User1',
+                                             is_active=True)
+
+    def login(self, email='test1@gmail.com', password='qwerty'):
+        return self.client.post(self.url, {'email': email,
+                                           'password': password})
+
+    def test_login_loads_user_once(self):
+        response = self.login()
+        self.assertEqual(response.status_code, 200)
+        token = response.data['token']
+        self.assertEqual(Token.objects.get(user=self.user).key, token)
+        with CaptureQueriesContext(connection) as queries, \
+                mock.patch.object(cache, 'set', wraps=cache.set) as set_, \
+                mock.patch.object(cache, 'set_many',
+                                  wraps=cache.set_many) as set_many:
+            response = self.login()
+        self.assertEqual(response.data['token'], token)
+        # пользователь и ключ его токена; сам ключ в кэш не кладётся
+        self.assertEqual(len(queries), 2)
+        self.assertTrue(set_.called)
+        self.assertNotIn(token, str(set_.call_args_list +
+                                    set_many.call_args_list))
+
+        # снимок пользователя уже в кэше
+        local_cache.clear()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token}')
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('order-list'))
+        self.assertFalse([query for query in queries
+                          if 'authtoken_token' in query['sql']])
+
+    def test_login_after_logout_creates_new_token(self):
+        token = self.login().data['token']
+        Token.objects.filter(user=self.user).delete()
+        response = self.login()
+        self.assertNotEqual(response.data['token'], token)
+        self.assertTrue(Token.objects.filter(key=response.data['token'])
+                        .exists())
+
+    def test_unknown_email_is_hashed_too(self):
+        wrong_password = self.login(password='wrong')
+        with mock.patch.object(User, 'set_password',
+                               autospec=True) as set_password:
+            unknown = self.login(email='nobody@gmail.com')
+        set_password.assert_called_once()
+        self.assertEqual(unknown.status_code, 400)
+        self.assertEqual(unknown.data, wrong_password.data)
+
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertEqual(self.login().data, wrong_password.data)
+
+    def test_password_rehashed_on_login(self):
+        with self.settings(PASSWORD_HASHERS=[
+            'django.contrib.auth.hashers.MD5PasswordHasher'
+        ]):
+            self.user.set_password('qwerty')
+            self.user.save()
+        with self.settings(PASSWORD_HASHERS=[
+            'django.contrib.auth.hashers.SHA1PasswordHasher',
+            'django.contrib.auth.hashers.MD5PasswordHasher',
+        ]):
+            self.assertEqual(self.login().status_code, 200)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith('sha1$'))
+
+
+class TestTunedArgon2(SimpleTestCase):
+    @unittest.skipUnless(argon2, 'нужен пакет argon2-cffi')
+    def test_rehash_when_parameters_change(self):
+        hasher = TunedArgon2PasswordHasher()
+        with self.settings(ARGON2_TIME_COST=1, ARGON2_MEMORY_COST=1024,
+                           ARGON2_PARALLELISM=1):
+            encoded = hasher.encode('qwerty', hasher.salt())
+            self.assertFalse(hasher.must_update(encoded))
+        with self.settings(ARGON2_TIME_COST=2, ARGON2_MEMORY_COST=1024,
+                           ARGON2_PARALLELISM=1):
+            self.assertTrue(hasher.verify('qwerty', encoded))
+            self.assertTrue(hasher.must_update(encoded))
+
+
+class TestMailOutbox(APITestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.user = User.objects.create_user('test1@gmail.com',
+                                             'qwerty',
+                                             name='User1',
+                                             is_active=True)
+
+    @eager_celery()
+    def test_forgot_password_mail_is_queued(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.post('/api/v1/forgot_password/',
+                                        {'email': self.user.email})
+        self.assertEqual(response.status_code, 200)
+        # в запросе письмо только ставится в очередь
+        self.assertEqual(mail.outbox, [])
+        email = OutgoingEmail.objects.get()
+        self.assertEqual((email.to, email.status),
+                         ([self.user.email], 'pending'))
+
+        for callback in callbacks:
+            callback()
+        self.assertEqual(len(mail.outbox), 1)
+        self.user.refresh_from_db()
+        self.assertIn(self.user.activation_code, mail.outbox[0].body)
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), ('sent', 1))
+
+    def test_smtp_connection_reuse_and_retry(self):
+        for address in ('a@example.com', 'retry@example.com',
+                        'b@example.com'):
+            enqueue_mail('Тема', 'Текст', 'shop@example.com', [address])
+        with LocalSMTPServer(reject={'retry@example.com'}) as smtp, \
+                self.settings(EMAIL_PORT=smtp.port, **SMTP_SETTINGS):
+            self.assertEqual(drain(batch_size=2), 3)
+            self.assertEqual(smtp.connections, 1)
+            self.assertEqual([to for to, _ in smtp.messages],
+                             [['a@example.com'], ['b@example.com']])
+
+            retry = OutgoingEmail.objects.get(to=['retry@example.com'])
+            self.assertEqual((retry.status, retry.attempts), ('pending', 1))
+            self.assertGreater(retry.next_attempt_at, timezone.now())
+            self.assertIn('451', retry.last_error)
+            # отступ ещё не прошёл
+            self.assertEqual(drain(), 0)
+
+            # последняя попытка
+            OutgoingEmail.objects.filter(pk=retry.pk).update(
+                attempts=4, next_attempt_at=timezone.now()
+            )
+            self.assertEqual(drain(), 1)
+            retry.refresh_from_db()
+            self.assertEqual((retry.status, retry.attempts), ('failed', 5))
+
+    def test_empty_outbox_opens_no_connection(self):
+        with LocalSMTPServer() as smtp, \
+                self.settings(EMAIL_PORT=smtp.port, **SMTP_SETTINGS):
+            self.assertEqual(drain(), 0)
+            self.assertEqual(smtp.connections, 0)
+
+    def test_failed_reconnect_keeps_sent_mail(self):
+        emails = [enqueue_mail('Тема', 'Текст', 'shop@example.com',
+                               [f'{name}@example.com'])
+                  for name in ('a', 'b', 'c')]
+        connection = mock.Mock()
+        connection.send_messages.side_effect = [
+            1, smtplib.SMTPServerDisconnected('closed')
+        ]
+        connection.open.side_effect = [True, ConnectionRefusedError()]
+        with mock.patch('account.mail.get_connection',
+                        return_value=connection):
+            with self.assertRaises(ConnectionRefusedError):
+                drain()
+        sent, disconnected, rest = [
+            OutgoingEmail.objects.get(pk=email.pk) for email in emails
+        ]
+        self.assertEqual((sent.status, sent.attempts), ('sent', 1))
+        self.assertEqual((disconnected.status, disconnected.attempts),
+                         ('pending', 1))
+        self.assertEqual((rest.status, rest.attempts), ('pending', 0))
+        self.assertGreater(rest.next_attempt_at, timezone.now())
+        connection.close.assert_called()
+
+    def test_connection_errors_reconnect_once(self):
+        emails = [enqueue_mail('Тема', 'Текст', 'shop@example.com',
+                               [f'{name}@example.com'])
+                  for name in ('a', 'b', 'c', 'd')]
+        connection = mock.Mock()
+        connection.send_messages.side_effect = [
+            socket.timeout(), 1, smtplib.SMTPConnectError(421, 'busy'),
+            OSError('reset'),
+        ]
+        with mock.patch('account.mail.get_connection',
+                        return_value=connection):
+            with self.assertRaises(OSError):
+                drain()
+        self.assertEqual(connection.open.call_count, 3)
+        statuses = [
+            OutgoingEmail.objects.values_list('status', 'attempts')
+            .get(pk=email.pk) for email in emails
+        ]
+        # после переподключения соединение снова не работает:
+        # последнее письмо возвращается в очередь без траты попытки
+        self.assertEqual(statuses, [('pending', 1), ('sent', 1),
+                                    ('pending', 1), ('pending', 0)])
+
+
+class TestDigest(APITestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.users = [
+            User.objects.create_user(f'user{i}@example.com', 'qwerty',
+                                     name=f'User{i}', is_active=True)
+            for i in range(7)
+        ]
+        User.objects.create_user('inactive@example.com', 'qwerty',
+                                 name='Inactive')
+        self.pks = sorted(user.pk for user in self.users)
+        Order.objects.create(user=self.users[0])
+
+    @eager_celery()
+    def test_fan_out(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            run = start_digest('2021-05-01', batch_size=3)
+        self.assertEqual((run.batches, run.recipients), (3, 7))
+        self.assertIsNotNone(run.finished_at)
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox),
+                         self.pks)
+        body = next(message.body for message in mail.outbox
+                    if message.to == [self.users[0].email])
+        self.assertIn('Привет, User0!', body)
+        self.assertIn('Заказов в работе: 1', body)
+
+        # повторный запуск за тот же день ничего не шлёт
+        with self.captureOnCommitCallbacks(execute=True):
+            start_digest('2021-05-01', batch_size=3)
+        self.assertEqual(len(mail.outbox), 7)
+        self.assertEqual(DigestBatch.objects.count(), 3)
+
+    def test_resume_from_checkpoint(self):
+        DigestRun.objects.create(key='2021-05-01', checkpoint=self.pks[3])
+        run = start_digest('2021-05-01', batch_size=10)
+        self.assertEqual(run.recipients, 3)
+        batch = DigestBatch.objects.get()
+        self.assertEqual((batch.first_pk, batch.last_pk),
+                         (self.pks[4], self.pks[6]))
+
+    def test_batch_over_one_smtp_connection(self):
+        start_digest('2021-05-01', batch_size=3)
+        batches = list(DigestBatch.objects.order_by('first_pk'))
+        with LocalSMTPServer(reject={self.pks[1]}) as smtp, \
+                self.settings(EMAIL_PORT=smtp.port, **SMTP_SETTINGS):
+            # отклонённый адрес пропускается, остальные получают письмо
+            self.assertEqual([send_batch(batch.pk) for batch in batches],
+                             [2, 3, 1])
+            self.assertEqual(send_batch(batches[0].pk), 0)
+            self.assertEqual(smtp.connections, 3)
+            self.assertEqual(sorted(to[0] for to, _ in smtp.messages),
+                             self.pks[:1] + self.pks[2:])
+        batches[0].refresh_from_db()
+        self.assertEqual((batches[0].status, batches[0].sent_count,
+                          batches[0].failed_count), ('sent', 2, 1))
+
+    def test_batch_resumes_and_gives_up(self):
+        start_digest('2021-05-01', batch_size=3)
+        batch = DigestBatch.objects.order_by('first_pk').first()
+        connection = mock.Mock()
+        connection.send_messages.side_effect = [
+            1, smtplib.SMTPServerDisconnected('closed')
+        ]
+        with mock.patch('account.digest.get_connection',
+                        return_value=connection):
+            # ошибка на втором письме: первое уже учтено
+            with self.assertRaises(OSError):
+                send_batch(batch.pk)
+        batch.refresh_from_db()
+        self.assertEqual((batch.status, batch.last_sent_pk, batch.attempts),
+                         ('pending', self.pks[0], 1))
+
+        connection.send_messages.side_effect = OSError('refused')
+        with self.settings(DIGEST_BATCH_MAX_ATTEMPTS=2), \
+                mock.patch('account.digest.get_connection',
+                           return_value=connection), \
+                mock.patch('account.digest.dispatch') as dispatch:
+            with self.assertRaises(OSError):
+                send_batch(batch.pk)
+            batch.refresh_from_db()
+            self.assertEqual((batch.status, batch.attempts), ('failed', 2))
+            self.assertEqual(send_batch(batch.pk), 0)
+
+            # исчерпавшую попытки пачку координатор больше не ставит
+            DigestBatch.objects.filter(pk=batch.pk).update(status='pending')
+            DigestBatch.objects.update(
+                created_at=timezone.now() - timedelta(hours=1)
+            )
+            start_digest('2021-05-01')
+        dispatch.assert_called_once()
+        self.assertNotIn(batch.pk, dispatch.call_args[0][0])
+        self.assertEqual(DigestBatch.objects.get(pk=batch.pk).status,
+                         'failed')
+
+    def test_notify_user_waits_for_digest_hour(self):
+        with self.settings(DIGEST_HOUR=24):
+            self.assertIsNone(notify_user())
+        self.assertFalse(DigestRun.objects.exists())
+        with self.settings(DIGEST_HOUR=0):
+            self.assertIsNotNone(notify_user())
+        self.assertEqual(DigestRun.objects.get().recipients, 7)
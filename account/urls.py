@@ -9,5 +9,6 @@ urlpatterns = [
     path('logout/', LogoutView.as_view()),
     path('change_password/', ChangePasswordView.as_view()),
     path('forgot_password/', ForgotPasswordView.as_view()),
-    path('forgot_password_complete/', ForgotPasswordCompleteView.as_view())
+    path('forgot_password_complete/', ForgotPasswordCompleteView.as_view()),
+    path('auth_cache_stats/', AuthCacheStatsView.as_view())
 ]
@@ -1,16 +1,25 @@
 from rest_framework.authtoken.models import Token
 from rest_framework.authtoken.views import ObtainAuthToken
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework import status
 
+from shop.throttling import (EmailSlidingWindowThrottle,
+                             SlidingWindowThrottle)
+from .authentication import get_auth_cache_stats, get_user_token
 from .serializers import (RegistrationSerializer, ActivationSerializer,
                           ChangePasswordSerializer, ForgotPasswordSerializer,
                           LoginSerializer, ForgotPassCompleteSerializer)
 
+# лимиты - в DEFAULT_THROTTLE_RATES по ключам '<scope>_ip' и '<scope>_email'
+ACCOUNT_THROTTLES = [SlidingWindowThrottle, EmailSlidingWindowThrottle]
+
 
 class RegistrationView(APIView):
+    throttle_scope = 'register'
+    throttle_classes = ACCOUNT_THROTTLES
+
     def post(self, request):
         data = request.data
         serializer = RegistrationSerializer(data=data)
@@ -20,6 +29,9 @@ class RegistrationView(APIView):
 
 
 class ActivationView(APIView):
+    throttle_scope = 'activation'
+    throttle_classes = ACCOUNT_THROTTLES
+
     def post(self, request):
         serializer = ActivationSerializer(data=request.data)
         if serializer.is_valid(raise_exception=True):
@@ -29,6 +41,14 @@ class ActivationView(APIView):
 
 class LoginView(ObtainAuthToken):
     serializer_class = LoginSerializer
+    throttle_scope = 'login'
+    throttle_classes = ACCOUNT_THROTTLES
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        user = serializer.validated_data['user']
+        return Response({'token': get_user_token(user)})
 
 
 class LogoutView(APIView):
@@ -52,6 +72,9 @@ class ChangePasswordView(APIView):
 
 
 class ForgotPasswordView(APIView):
+    throttle_scope = 'forgot_password'
+    throttle_classes = ACCOUNT_THROTTLES
+
     def post(self, request):
         serializer = ForgotPasswordSerializer(data=request.data)
         if serializer.is_valid(raise_exception=True):
@@ -60,8 +83,19 @@ class ForgotPasswordView(APIView):
 
 
 class ForgotPasswordCompleteView(APIView):
+    # свой лимит: ошибка в коде не должна блокировать сброс на час
+    throttle_scope = 'forgot_password_complete'
+    throttle_classes = ACCOUNT_THROTTLES
+
     def post(self, request):
         serializer = ForgotPassCompleteSerializer(data=request.data)
         if serializer.is_valid(raise_exception=True):
             serializer.set_new_password()
             return Response('Пароль успешно обновлён')
+
+
+class AuthCacheStatsView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(get_auth_cache_stats())
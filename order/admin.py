@@ -1,18 +1,73 @@
 from django import forms
 from django.contrib import admin
+from django.db.models import OuterRef, Subquery
 
 from order.models import Order, OrderItem
+from product.models import OutOfStock, Product
 
 
 class OrderAdminForm(forms.ModelForm):
     class Meta:
         model = Order
-        fields = ('status', 'user')
+        fields = ('user', )
+
+
+class OrderItemsFormSet(forms.BaseInlineFormSet):
+    """
+    Считает, на сколько изменится резерв каждого продукта
+    (stock_delta), и заранее проверяет остатки. Сам резерв
+    меняет OrderAdmin.save_formset.
+    """
+    def clean(self):
+        super().clean()
+        self.stock_delta = {}
+        if any(self.errors):
+            return
+        for form in self.forms:
+            if not form.has_changed():
+                continue
+            if form.instance.pk:
+                self.add_delta(form.initial['product'],
+                               -form.instance.reserved_quantity)
+            if not self._should_delete_form(form):
+                self.add_delta(form.cleaned_data['product'].pk,
+                               form.cleaned_data['quantity'])
+        needed = {pk: quantity for pk, quantity in self.stock_delta.items()
+                  if quantity > 0}
+        stock = dict(Product.objects.filter(pk__in=needed)
+                     .values_list('pk', 'stock'))
+        short = sorted(pk for pk, quantity in needed.items()
+                       if stock.get(pk) is not None and stock[pk] < quantity)
+        if short:
+            raise forms.ValidationError(str(OutOfStock(short)))
+
+    def add_delta(self, product_id, quantity):
+        self.stock_delta[product_id] = \
+            self.stock_delta.get(product_id, 0) + quantity
 
 
 class OrderItemsInline(admin.TabularInline):
     model = OrderItem
+    formset = OrderItemsFormSet
     extra = 1
+    readonly_fields = ['unit_price']
+
+    # у отменённых и завершённых заказов остатки уже не в резерве
+    def has_add_permission(self, request, obj=None):
+        return self.is_editable(obj) and \
+            super().has_add_permission(request, obj)
+
+    def has_change_permission(self, request, obj=None):
+        return self.is_editable(obj) and \
+            super().has_change_permission(request, obj)
+
+    def has_delete_permission(self, request, obj=None):
+        return self.is_editable(obj) and \
+            super().has_delete_permission(request, obj)
+
+    @staticmethod
+    def is_editable(obj):
+        return obj is None or obj.status in ('open', 'in_progress')
 
 
 class TotalSumFilter(admin.SimpleListFilter):
@@ -46,7 +101,9 @@ class OrderAdmin(admin.ModelAdmin):
     ]
     exclude = ('products', )
     form = OrderAdminForm
-    readonly_fields = ['user', 'total_sum', 'created_at']
+    # статус меняется только действиями ниже, см. Order.transition
+    readonly_fields = ['user', 'status', 'version', 'total_sum', 'created_at']
+    actions = ['mark_in_progress', 'mark_finished', 'mark_canceled']
     list_display = ['id', 'status', 'total_sum', 'created_at']
     list_filter = ['status', TotalSumFilter]
     search_fields = ['products__title']
@@ -58,19 +115,62 @@ class OrderAdmin(admin.ModelAdmin):
         super().save_model(request, obj, form, change)
 
     def save_formset(self, request, form, formset, change):
-        total = 0
-        for inline_form in formset:
-            if inline_form.cleaned_data:
-                price = inline_form.cleaned_data['product'].price
-                quantity = inline_form.cleaned_data['quantity']
-                total += price * quantity
-        form.instance.total_sum = total
-        form.instance.save()
+        # резерв по разнице количеств, как при оформлении и отмене
+        delta = getattr(formset, 'stock_delta', {})
+        tracked = set()
+        if delta:
+            tracked = {pk for pk, stock in Product.lock_stock(delta).items()
+                       if stock is not None}
+            released = {pk: -quantity for pk, quantity in delta.items()
+                        if quantity < 0}
+            if released:
+                Product.release_stock(released)
+            reserved = {pk: quantity for pk, quantity in delta.items()
+                        if quantity > 0}
+            if reserved:
+                # остатки проверены в clean; если их успели выкупить -
+                # OutOfStock, транзакция админки откатывается целиком
+                Product.reserve_stock(reserved)
+        for inline_form in formset.forms:
+            if not inline_form.has_changed() or \
+                    inline_form in formset.deleted_forms:
+                continue
+            item = inline_form.instance
+            # фиксируем цену у новых позиций и при смене продукта
+            if item.unit_price is None or \
+                    'product' in inline_form.changed_data:
+                item.unit_price = item.product.price
+            item.reserved_quantity = item.quantity \
+                if item.product_id in tracked else 0
         formset.save()
-
-
-
-#TODO: исправить сохранение total_sum
+        order = form.instance
+        # старые позиции без цены (до backfill_unit_prices) иначе
+        # выпадут из суммы
+        price = Product.objects.filter(pk=OuterRef('product_id')) \
+            .values('price')[:1]
+        OrderItem.objects.filter(order=order, unit_price__isnull=True) \
+            .update(unit_price=Subquery(price))
+        # удалённые позиции уже не попадут в сумму
+        order.total_sum = Order.objects.with_totals().get(pk=order.pk).total
+        order.save(update_fields=['total_sum', 'updated_at'])
+
+    def transition(self, request, queryset, status):
+        selected = queryset.count()
+        updated = queryset.transition(status)
+        self.message_user(request, f'Изменено заказов: {updated}, '
+                                   f'пропущено: {selected - updated}')
+
+    @admin.action(description='Перевести в "В обработке"')
+    def mark_in_progress(self, request, queryset):
+        self.transition(request, queryset, 'in_progress')
+
+    @admin.action(description='Завершить')
+    def mark_finished(self, request, queryset):
+        self.transition(request, queryset, 'finished')
+
+    @admin.action(description='Отменить (с возвратом остатков)')
+    def mark_canceled(self, request, queryset):
+        self.transition(request, queryset, 'canceled')
 
 
 admin.site.register(Order, OrderAdmin)
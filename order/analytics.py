@@ -0,0 +1,106 @@
+from datetime import datetime, time, timedelta
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from order.models import (DailySalesRollup, Order, OrderItem,
+                          ProductSalesRollup, RollupState)
+
+STATE_NAME = 'sales'
+
+
+def get_safety_lag():
+    # заказы, чья транзакция ещё не закоммичена, могут появиться
+    # с created_at/updated_at чуть в прошлом - отступаем от now
+    return timedelta(seconds=getattr(settings, 'SALES_ROLLUP_LAG', 60))
+
+
+def day_ranges(days):
+    tz = timezone.get_current_timezone()
+    for day in days:
+        start = timezone.make_aware(datetime.combine(day, time.min), tz)
+        yield start, start + timedelta(days=1)
+
+
+def aggregate_daily(orders):
+    return [
+        DailySalesRollup(day=row['day'], status=row['status'],
+                         orders_count=row['orders_count'],
+                         revenue=row['revenue'] or 0)
+        for row in orders.annotate(day=TruncDate('created_at'))
+        .values('day', 'status').order_by()
+        .annotate(orders_count=Count('pk'), revenue=Sum('total_sum'))
+    ]
+
+
+def aggregate_products(items):
+    return [
+        ProductSalesRollup(day=row['day'], product_id=row['product_id'],
+                           units=row['units'], revenue=row['revenue'] or 0)
+        for row in items.exclude(order__status='canceled')
+        .annotate(day=TruncDate('order__created_at'))
+        .values('day', 'product_id').order_by()
+        .annotate(units=Sum('quantity'),
+                  revenue=Sum(F('unit_price') * F('quantity')))
+    ]
+
+
+def rebuild_days(days):
+    """Пересчитывает агрегаты за указанные дни целиком"""
+    if not days:
+        return
+    created = reduce(or_, (Q(created_at__gte=start, created_at__lt=end)
+                           for start, end in day_ranges(days)))
+    orders = Order.objects.filter(created)
+    items = OrderItem.objects.filter(order__in=orders.values('pk'))
+    DailySalesRollup.objects.filter(day__in=days).delete()
+    ProductSalesRollup.objects.filter(day__in=days).delete()
+    DailySalesRollup.objects.bulk_create(aggregate_daily(orders))
+    ProductSalesRollup.objects.bulk_create(aggregate_products(items))
+
+
+@transaction.atomic
+def update_rollups():
+    """
+    Инкрементальное обновление: берутся заказы, созданные или
+    изменённые после high_water_mark, и пересчитываются только
+    их дни. Возвращает число пересчитанных дней.
+    """
+    mark = timezone.now() - get_safety_lag()
+    state = RollupState.objects.select_for_update() \
+        .filter(name=STATE_NAME).first()
+    if state is None:
+        rebuild_rollups(mark)
+        return None
+
+    window = (Q(created_at__gt=state.high_water_mark, created_at__lte=mark) |
+              Q(updated_at__gt=state.high_water_mark, updated_at__lte=mark))
+    days = set(Order.objects.filter(window)
+               .annotate(day=TruncDate('created_at'))
+               .values_list('day', flat=True).order_by().distinct())
+    rebuild_days(sorted(days))
+    state.high_water_mark = mark
+    state.save()
+    return len(days)
+
+
+@transaction.atomic
+def rebuild_rollups(mark=None):
+    """Полный пересчёт всех агрегатов"""
+    mark = mark or timezone.now() - get_safety_lag()
+    RollupState.objects.select_for_update().filter(name=STATE_NAME).first()
+    DailySalesRollup.objects.all().delete()
+    ProductSalesRollup.objects.all().delete()
+    DailySalesRollup.objects.bulk_create(aggregate_daily(Order.objects.all()),
+                                         batch_size=1000)
+    ProductSalesRollup.objects.bulk_create(
+        aggregate_products(OrderItem.objects.all()), batch_size=1000
+    )
+    RollupState.objects.update_or_create(
+        name=STATE_NAME, defaults={'high_water_mark': mark}
+    )
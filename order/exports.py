@@ -0,0 +1,21 @@
+from order.models import Order, OrderItem
+from shop.streaming import Export
+
+
+def orders_export():
+    return Export(Order.objects.all(),
+                  ('id', 'user_id', 'status', 'total_sum', 'created_at'),
+                  'orders')
+
+
+def order_items_export():
+    return Export(OrderItem.objects.all(),
+                  ('id', 'order_id', 'product_id', 'quantity', 'unit_price',
+                   'order__status', 'order__created_at'),
+                  'order_items')
+
+
+EXPORTS = {
+    'orders': orders_export,
+    'items': order_items_export,
+}
@@ -0,0 +1,115 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from order.models import Order, OrderIntake
+from product.models import OutOfStock, Product
+
+DRAIN_SCHEDULED_KEY = 'order_intake:drain_scheduled'
+
+
+class QueueFull(Exception):
+    def __init__(self, retry_after):
+        super().__init__('Очередь заказов переполнена, повторите позже')
+        self.retry_after = retry_after
+
+
+def get_intake_mode():
+    return getattr(settings, 'ORDER_INTAKE_MODE', 'sync')
+
+
+def get_batch_size():
+    return getattr(settings, 'ORDER_INTAKE_BATCH_SIZE', 100)
+
+
+def get_drain_delay():
+    return getattr(settings, 'ORDER_INTAKE_DRAIN_DELAY', 1)
+
+
+def get_retry_after():
+    return getattr(settings, 'ORDER_INTAKE_RETRY_AFTER', 5)
+
+
+def is_full(queryset, limit):
+    # COUNT по подзапросу с LIMIT - не считаем всю очередь
+    return queryset[:limit].count() >= limit
+
+
+def enqueue(user, items):
+    """
+    Ставит заказ в очередь. Если в очереди слишком много заказов
+    всего или от этого пользователя - QueueFull
+    """
+    max_pending = getattr(settings, 'ORDER_INTAKE_MAX_PENDING', 10000)
+    max_per_user = getattr(settings, 'ORDER_INTAKE_MAX_PENDING_PER_USER', 20)
+    pending = OrderIntake.objects.filter(status='pending')
+    if is_full(pending, max_pending) \
+            or is_full(pending.filter(user=user), max_per_user):
+        raise QueueFull(get_retry_after())
+    intake = OrderIntake.objects.create(user=user, items=[
+        {'product': getattr(item['product'], 'pk', item['product']),
+         'quantity': item.get('quantity', 1)}
+        for item in items
+    ])
+    transaction.on_commit(schedule_drain)
+    return intake
+
+
+def schedule_drain():
+    from order.tasks import drain_order_intake
+
+    # одна задача на все заказы, пришедшие за ORDER_INTAKE_DRAIN_DELAY,
+    # а не на каждый; если задача потеряется, ключ истечёт сам
+    delay = get_drain_delay()
+    if cache.add(DRAIN_SCHEDULED_KEY, 1, delay + 60):
+        drain_order_intake.apply_async(countdown=delay)
+
+
+def process_batch(batch):
+    """
+    Оформляет пачку заказов в текущей транзакции. Каждый заказ
+    в своей точке сохранения (Order.objects.place), поэтому отказ
+    по одному не откатывает остальные
+    """
+    ids = {item['product'] for intake in batch for item in intake.items}
+    products = Product.objects.only('id', 'price').in_bulk(ids)
+    now = timezone.now()
+    for intake in batch:
+        # ненайденные pk остаются как есть, place() сообщит о них
+        items = [{'product': products.get(item['product'], item['product']),
+                  'quantity': item['quantity']}
+                 for item in intake.items]
+        try:
+            intake.order = Order.objects.place(intake.user, items)
+            intake.status = 'done'
+        except (OutOfStock, Product.DoesNotExist) as e:
+            intake.status = 'failed'
+            intake.errors = {'items': [str(e)]}
+        intake.processed_at = now
+    OrderIntake.objects.bulk_update(
+        batch, ['status', 'order', 'errors', 'processed_at']
+    )
+
+
+def drain(batch_size=None):
+    """
+    Разбирает очередь пачками по batch_size заказов, пачка - одна
+    транзакция. Параллельные воркеры берут разные пачки (SKIP LOCKED).
+    Возвращает число обработанных заказов.
+    """
+    batch_size = batch_size or get_batch_size()
+    cache.delete(DRAIN_SCHEDULED_KEY)
+    processed = 0
+    while True:
+        with transaction.atomic():
+            batch = list(
+                OrderIntake.objects.filter(status='pending')
+                .select_related('user')
+                .select_for_update(skip_locked=True, of=('self', ))
+                .order_by('created_at')[:batch_size]
+            )
+            if not batch:
+                return processed
+            process_batch(batch)
+        processed += len(batch)
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+
+from order.models import OrderItem
+from product.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Заполняет OrderItem.unit_price у старых позиций текущей ценой ' \
+           'продукта, пачками по первичному ключу'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        price = Product.objects.filter(pk=OuterRef('product_id')) \
+            .values('price')[:1]
+        last_pk = 0
+        total = 0
+        while True:
+            ids = list(
+                OrderItem.objects.filter(unit_price__isnull=True,
+                                         pk__gt=last_pk)
+                .order_by('pk')
+                .values_list('pk', flat=True)[:options['batch_size']]
+            )
+            if not ids:
+                break
+            with transaction.atomic():
+                total += OrderItem.objects.filter(
+                    pk__in=ids, unit_price__isnull=True
+                ).update(unit_price=Subquery(price))
+            last_pk = ids[-1]
+        self.stdout.write(self.style.SUCCESS(f'Заполнено позиций: {total}'))
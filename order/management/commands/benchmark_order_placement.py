@@ -0,0 +1,41 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from order.models import Order
+from product.models import Product
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Число запросов и время оформления заказа в зависимости ' \
+           'от количества позиций (данные откатываются)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lines', type=int, nargs='+',
+                            default=[1, 10, 40, 200])
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            user = User.objects.create_user('benchmark@example.com',
+                                            'benchmark', name='Benchmark')
+            Product.objects.bulk_create(
+                Product(title=f'benchmark-{i}', description='Тест', price=100)
+                for i in range(max(options['lines']))
+            )
+            ids = list(Product.objects.filter(title__startswith='benchmark-')
+                       .values_list('id', flat=True))
+            for lines in options['lines']:
+                items = [{'product': pk, 'quantity': 2}
+                         for pk in ids[:lines]]
+                with CaptureQueriesContext(connection) as queries:
+                    started = time.perf_counter()
+                    Order.objects.place(user, items)
+                    elapsed = time.perf_counter() - started
+                self.stdout.write(f'{lines} позиций: {len(queries)} '
+                                  f'запросов, {elapsed * 1000:.1f} мс')
+            transaction.set_rollback(True)
@@ -0,0 +1,7 @@
+from order.exports import EXPORTS
+from shop.streaming import BaseExportCommand
+
+
+class Command(BaseExportCommand):
+    help = 'Потоковая выгрузка заказов или позиций заказов в CSV/NDJSON'
+    exports = EXPORTS
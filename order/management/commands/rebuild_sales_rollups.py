@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from order.analytics import rebuild_rollups
+from order.models import DailySalesRollup, ProductSalesRollup
+
+
+class Command(BaseCommand):
+    help = 'Полный пересчёт агрегатов продаж (нужен, например, ' \
+           'после backfill_unit_prices)'
+
+    def handle(self, *args, **options):
+        rebuild_rollups()
+        self.stdout.write(self.style.SUCCESS(
+            f'Строк по дням: {DailySalesRollup.objects.count()}, '
+            f'по продуктам: {ProductSalesRollup.objects.count()}'
+        ))
@@ -0,0 +1,18 @@
+# Generated by Django 3.2 on 2026-10-18 11:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('order', '0008_orderintake'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderitem',
+            name='reserved_quantity',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+    ]
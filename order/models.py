@@ -1,5 +1,11 @@
+import uuid
+
 from django.contrib.auth import get_user_model
-from django.db import models
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models, transaction
+from django.db.models import F, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 
 from product.models import Product
 
@@ -12,29 +18,162 @@ STATUS_CHOICES = (
     ('canceled', 'Отменённый'),
     ('finished', 'Завершённый')
 )
+INTAKE_STATUS_CHOICES = (
+    ('pending', 'В очереди'),
+    ('done', 'Оформлен'),
+    ('failed', 'Отклонён')
+)
+# допустимые переходы статусов
+TRANSITIONS = {
+    'open': ('in_progress', 'canceled'),
+    'in_progress': ('finished', 'canceled'),
+}
+
+
+class InvalidTransition(Exception):
+    pass
+
+
+class TransitionConflict(Exception):
+    pass
+
+
+def release_orders_stock(order_ids):
+    quantities = dict(
+        OrderItem.objects.filter(order_id__in=order_ids,
+                                 reserved_quantity__gt=0).order_by()
+        .values('product_id').annotate(quantity=Sum('reserved_quantity'))
+        .values_list('product_id', 'quantity')
+    )
+    if quantities:
+        Product.release_stock(quantities)
+
+
+class OrderQuerySet(models.QuerySet):
+    def with_totals(self):
+        """Сумма заказа по зафиксированным ценам позиций, в том же запросе"""
+        return self.annotate(total=Coalesce(
+            Sum(F('items__unit_price') * F('items__quantity')),
+            Value(0),
+            output_field=models.DecimalField(max_digits=12,
+                                             decimal_places=2)
+        ))
+
+    @transaction.atomic
+    def transition(self, status):
+        """
+        Массовый переход статуса одним UPDATE. Заказы, которые сейчас
+        меняет другая транзакция, пропускаются (SKIP LOCKED), а не ждут.
+        Возвращает число изменённых заказов.
+        """
+        sources = [source for source, targets in TRANSITIONS.items()
+                   if status in targets]
+        # блокируем по чистому запросу: исходный может быть с DISTINCT
+        # (поиск в админке по позициям), а DISTINCT ... FOR UPDATE
+        # PostgreSQL не допускает
+        ids = list(Order.objects.filter(pk__in=self.order_by().values('pk'),
+                                        status__in=sources)
+                   .select_for_update(skip_locked=True)
+                   .values_list('pk', flat=True))
+        if not ids:
+            return 0
+        updated = Order.objects.filter(pk__in=ids, status__in=sources) \
+            .update(status=status, version=F('version') + 1,
+                    updated_at=timezone.now())
+        if status == 'canceled':
+            release_orders_stock(ids)
+        return updated
+
+
+class OrderManager(models.Manager.from_queryset(OrderQuerySet)):
+    @transaction.atomic
+    def place(self, user, items):
+        """
+        Оформление заказа за постоянное число запросов:
+        SELECT продуктов (если переданы pk), резерв остатков
+        (Product.reserve_stock), INSERT заказа с готовой суммой
+        и один INSERT всех позиций. При нехватке товара - OutOfStock,
+        транзакция откатывается целиком.
+        items - [{'product': Product или pk, 'quantity': 1}, ...]
+        """
+        ids = {item['product'] for item in items
+               if not isinstance(item['product'], Product)}
+        products = Product.objects.only('id', 'price').in_bulk(ids) \
+            if ids else {}
+        missing = sorted(ids - set(products))
+        if missing:
+            raise Product.DoesNotExist(
+                f'Продукты не найдены: {", ".join(map(str, missing))}'
+            )
+
+        lines = []
+        quantities = {}
+        total = 0
+        for item in items:
+            product = item['product']
+            if not isinstance(product, Product):
+                product = products[product]
+            quantity = item.get('quantity', 1)
+            total += product.price * quantity
+            quantities[product.pk] = quantities.get(product.pk, 0) + quantity
+            lines.append(OrderItem(product=product, quantity=quantity,
+                                   unit_price=product.price))
+        tracked = Product.reserve_stock(quantities) if quantities else set()
+        for line in lines:
+            if line.product_id in tracked:
+                line.reserved_quantity = line.quantity
+        order = self.create(user=user, total_sum=total)
+        for line in lines:
+            line.order = order
+        OrderItem.objects.bulk_create(lines)
+        return order
 
 
 class Order(models.Model):
     total_sum = models.DecimalField(max_digits=10,
                                     decimal_places=2,
                                     default=0)
-    created_at = models.DateTimeField(auto_now_add=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    # по нему update_sales_rollups находит изменённые заказы
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
     user = models.ForeignKey(User,
                              on_delete=models.RESTRICT,
                              related_name='orders')
     status = models.CharField(max_length=20,
                               choices=STATUS_CHOICES,
                               default='open')
+    # увеличивается при каждой смене статуса
+    version = models.PositiveIntegerField(default=0)
     products = models.ManyToManyField(Product,
                                       through='OrderItem')
 
-    @property
-    def total(self):
-        items = self.items.values('product__price', 'quantity')
-        total = 0
-        for item in items:
-            total += item['product__price'] * item['quantity']
-        return total
+    objects = OrderManager()
+
+    @transaction.atomic
+    def transition(self, status):
+        """
+        Переход статуса условным UPDATE ... WHERE status = текущий
+        AND version = текущая. Если заказ успели изменить -
+        TransitionConflict, блокировки строк не берутся.
+        """
+        if status not in TRANSITIONS.get(self.status, ()):
+            raise InvalidTransition(
+                f'Нельзя перевести заказ из "{self.get_status_display()}" '
+                f'в "{dict(STATUS_CHOICES).get(status, status)}"'
+            )
+        updated = Order.objects.filter(
+            pk=self.pk, status=self.status, version=self.version
+        ).update(status=status, version=F('version') + 1,
+                 updated_at=timezone.now())
+        if not updated:
+            raise TransitionConflict('Заказ был изменён, обновите данные')
+        if status == 'canceled':
+            release_orders_stock([self.pk])
+        self.status = status
+        self.version += 1
+
+    def cancel(self):
+        self.transition('canceled')
 
     def __str__(self):
         return f'Заказ № {self.id} от {self.created_at.strftime("%d-%m-%Y %H:%M")}'
@@ -52,6 +191,117 @@ class OrderItem(models.Model):
                                 on_delete=models.RESTRICT,
                                 related_name='order_items')
     quantity = models.PositiveSmallIntegerField(default=1)
+    # цена на момент оформления; null у старых позиций до backfill_unit_prices
+    unit_price = models.DecimalField(max_digits=10,
+                                     decimal_places=2,
+                                     null=True,
+                                     blank=True)
+    # сколько списано с остатков; столько и вернётся при отмене.
+    # 0 у позиций без учёта остатков и оформленных до резервирования
+    reserved_quantity = models.PositiveSmallIntegerField(default=0,
+                                                         editable=False)
 
     class Meta:
         db_table = 'order_items'
+
+
+class IdempotencyRecord(models.Model):
+    """
+    Сохранённый ответ на запрос с Idempotency-Key
+    (см. shop.idempotency). Просроченные записи перезаписываются
+    при повторном использовании ключа и удаляются командой
+    purge_idempotency_keys.
+    """
+    user = models.ForeignKey(User,
+                             on_delete=models.CASCADE,
+                             related_name='+')
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField(null=True)
+    body = models.JSONField(null=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        db_table = 'idempotency_records'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'],
+                                    name='idempotency_user_key_uniq')
+        ]
+
+
+class DailySalesRollup(models.Model):
+    """Заказы и выручка за день по статусам, см. order.analytics"""
+    day = models.DateField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES)
+    orders_count = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14,
+                                  decimal_places=2,
+                                  default=0)
+
+    class Meta:
+        db_table = 'rollup_daily_sales'
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'status'],
+                                    name='rollup_daily_sales_uniq')
+        ]
+
+
+class ProductSalesRollup(models.Model):
+    """Продажи продукта за день без отменённых заказов"""
+    day = models.DateField()
+    product = models.ForeignKey(Product,
+                                on_delete=models.CASCADE,
+                                related_name='+')
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14,
+                                  decimal_places=2,
+                                  default=0)
+
+    class Meta:
+        db_table = 'rollup_product_sales'
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'product'],
+                                    name='rollup_product_sales_uniq')
+        ]
+
+
+class RollupState(models.Model):
+    """До какого момента заказы уже учтены в агрегатах"""
+    name = models.CharField(max_length=50, primary_key=True)
+    high_water_mark = models.DateTimeField()
+
+    class Meta:
+        db_table = 'rollup_state'
+
+
+class OrderIntake(models.Model):
+    """
+    Заказ, принятый в асинхронном режиме (ORDER_INTAKE_MODE='async'),
+    пока его не оформила задача drain_order_intake, см. order.intake
+    """
+    id = models.UUIDField(primary_key=True,
+                          default=uuid.uuid4,
+                          editable=False)
+    user = models.ForeignKey(User,
+                             on_delete=models.CASCADE,
+                             related_name='+')
+    # [{'product': pk, 'quantity': 1}, ...]
+    items = models.JSONField()
+    status = models.CharField(max_length=20,
+                              choices=INTAKE_STATUS_CHOICES,
+                              default='pending')
+    order = models.OneToOneField(Order,
+                                 on_delete=models.SET_NULL,
+                                 null=True,
+                                 related_name='+')
+    errors = models.JSONField(null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True)
+
+    class Meta:
+        db_table = 'order_intake'
+        indexes = [
+            models.Index(fields=['status', 'created_at'],
+                         name='order_intake_queue_idx')
+        ]
@@ -1,15 +1,63 @@
+from django.core.exceptions import ValidationError as DjangoValidationError
 from rest_framework import serializers
+from rest_framework.reverse import reverse
 
-from .models import Order, OrderItem
+from product.models import OutOfStock, Product
+from shop.fieldsets import DynamicFieldsMixin
+
+from .models import STATUS_CHOICES, Order, OrderIntake, OrderItem
+
+
+def _product_pk(value):
+    if isinstance(value, bool):
+        return None
+    try:
+        return Product._meta.pk.to_python(value)
+    except (DjangoValidationError, TypeError):
+        return None
+
+
+class ResolvedProductField(serializers.PrimaryKeyRelatedField):
+    """Берёт продукт, уже загруженный OrderItemListSerializer"""
+    def to_internal_value(self, data):
+        products = getattr(self.parent.parent, 'products', None)
+        if products is not None:
+            product = products.get(_product_pk(data))
+            if product is not None:
+                return product
+        return super().to_internal_value(data)
+
+
+class OrderItemListSerializer(serializers.ListSerializer):
+    """
+    Загружает продукты всех позиций одним in_bulk() вместо
+    отдельного SELECT на каждую позицию
+    """
+    def to_internal_value(self, data):
+        if isinstance(data, list):
+            ids = {_product_pk(item.get('product')) for item in data
+                   if isinstance(item, dict)}
+            ids.discard(None)
+            self.products = Product.objects.in_bulk(ids)
+            missing = sorted(ids - set(self.products))
+            if missing:
+                raise serializers.ValidationError(
+                    f'Продукты не найдены: {", ".join(map(str, missing))}'
+                )
+        return super().to_internal_value(data)
 
 
 class OrderItemSerializer(serializers.ModelSerializer):
+    product = ResolvedProductField(queryset=Product.objects.all())
+
     class Meta:
         model = OrderItem
-        exclude = ("id", "order")
+        exclude = ("id", "order", "reserved_quantity")
+        read_only_fields = ("unit_price", )
+        list_serializer_class = OrderItemListSerializer
 
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     items = OrderItemSerializer(many=True)
     created_at = serializers.DateTimeField(read_only=True)
     status = serializers.CharField(read_only=True)
@@ -17,18 +65,45 @@ class OrderSerializer(serializers.ModelSerializer):
     class Meta:
         model = Order
         exclude = ('user', 'products')
+        read_only_fields = ('version', )
 
     def create(self, validated_data):
         request = self.context.get("request")
-        items = validated_data.pop("items")
-        user = request.user
-        order = Order.objects.create(user=user)
-        total = 0
-        for item in items:
-            total += item['product'].price * item['quantity']
-            OrderItem.objects.create(order=order,
-                                     product=item["product"],
-                                     quantity=item['quantity'])
-        order.total_sum = total
-        order.save()
-        return order
+        try:
+            return Order.objects.place(request.user, validated_data["items"])
+        except OutOfStock as e:
+            raise serializers.ValidationError({"items": [str(e)]})
+
+
+class OrderIntakeSerializer(serializers.ModelSerializer):
+    url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = OrderIntake
+        fields = ('id', 'url', 'status', 'order', 'errors', 'created_at',
+                  'processed_at')
+
+    def get_url(self, obj):
+        return reverse('order-intake', args=(obj.pk, ),
+                       request=self.context.get('request'))
+
+
+class OrderTransitionSerializer(serializers.Serializer):
+    status = serializers.ChoiceField(choices=STATUS_CHOICES)
+    # ожидаемая версия заказа; если не указана - текущая
+    version = serializers.IntegerField(required=False, min_value=0)
+
+
+class SalesAnalyticsQuerySerializer(serializers.Serializer):
+    date_from = serializers.DateField(required=False)
+    date_to = serializers.DateField(required=False)
+    limit = serializers.IntegerField(required=False, min_value=1,
+                                     max_value=100, default=10)
+
+    def validate(self, attrs):
+        if attrs.get('date_from') and attrs.get('date_to') \
+                and attrs['date_from'] > attrs['date_to']:
+            raise serializers.ValidationError(
+                'date_from не может быть позже date_to'
+            )
+        return attrs
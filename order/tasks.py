@@ -0,0 +1,14 @@
+from celery import shared_task
+
+from order.analytics import update_rollups
+from order.intake import drain
+
+
+@shared_task
+def update_sales_rollups():
+    return update_rollups()
+
+
+@shared_task
+def drain_order_intake():
+    return drain()
@@ -1,3 +1,761 @@
-from django.test import TestCase
+import csv
+import random
+import threading
+import time
+import uuid
+from datetime import timedelta
+from io import StringIO
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.test import TransactionTestCase, override_settings, \
+    skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+from rest_framework.test import APITestCase
+
+from shop.idempotency import CacheIdempotencyStore, \
+    DatabaseIdempotencyStore
+from shop.testing import QueryBudgetMixin, eager_celery
+
+from product.models import OutOfStock, Product
+from .analytics import update_rollups
+from .intake import drain
+from .models import (DailySalesRollup, IdempotencyRecord, InvalidTransition,
+                     Order, OrderIntake, OrderItem, ProductSalesRollup)
+from .serializers import OrderSerializer
+from .views import OrderViewSet
+
+User = get_user_model()
+
+
+class TestOrders(QueryBudgetMixin, APITestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user('test1@gmail.com',
+                                             'qwerty',
+                                             name='User1',
+                                             is_active=True)
+        self.admin = User.objects.create_superuser('admin@gmail.com',
+                                                   'qwerty',
+                                                   name='Admin1')
+        self.user_token = Token.objects.create(user=self.user)
+        self.admin_token = Token.objects.create(user=self.admin)
+        self.product1 = Product.objects.create(title='Apple Iphone 12',
+                                               description='Крутой телефон',
+                                               price=100000)
+        self.product2 = Product.objects.create(title='Xiaomi Mi 11',
+                                               description='Норм телефон',
+                                               price=40000)
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Token {self.user_token.key}'
+        )
+
+    def create_order(self, *products):
+        order = Order.objects.create(user=self.user)
+        for product in products:
+            OrderItem.objects.create(order=order, product=product)
+        return order
+
+    def test_cursor_pagination(self):
+        orders = [self.create_order(self.product1) for _ in range(7)]
+        url = reverse('order-list')
+        response = self.client.get(url, data={'cursor': '', 'count': 0})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('count', response.data)
+        ids = [item['id'] for item in response.data['results']]
+        response = self.client.get(response.data['next'])
+        ids += [item['id'] for item in response.data['results']]
+        self.assertIsNone(response.data['next'])
+        expected = sorted(orders, key=lambda o: (o.created_at, o.id),
+                          reverse=True)
+        self.assertEqual(ids, [order.id for order in expected])
+
+    def test_export_order_items(self):
+        order = self.create_order(self.product1, self.product2)
+        url = reverse('order-export')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 403)
+
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Token {self.admin_token.key}'
+        )
+        response = self.client.get(url, {'dataset': 'items'})
+        self.assertEqual(response.status_code, 200)
+        rows = list(csv.DictReader(
+            b''.join(response.streaming_content).decode().splitlines()
+        ))
+        self.assertEqual([row['product_id'] for row in rows],
+                         [str(self.product1.id), str(self.product2.id)])
+        self.assertEqual(rows[0]['order_id'], str(order.id))
+        self.assertEqual(rows[0]['order__status'], 'open')
+
+    def test_fast_list_matches_serializer(self):
+        self.create_order(self.product1, self.product2)
+        self.create_order()
+        for _ in range(5):
+            self.create_order(self.product2)
+        url = reverse('order-list')
+        for params in ({}, {'cursor': ''}, {'page': 2}):
+            fast = self.client.get(url, params)
+            with mock.patch.object(OrderViewSet, 'fast_list', False):
+                slow = self.client.get(url, params)
+            self.assertEqual(fast.status_code, 200)
+            self.assertEqual(fast.content, slow.content)
+        self.assertEqual(fast.data['results'][-1]['items'],
+                         [{'quantity': 1, 'unit_price': None,
+                           'product': self.product1.id},
+                          {'quantity': 1, 'unit_price': None,
+                           'product': self.product2.id}])
+
+    def test_sparse_fieldsets(self):
+        order = self.create_order(self.product1)
+        url = reverse('order-list')
+        for fast_list in (True, False):
+            with mock.patch.object(OrderViewSet, 'fast_list', fast_list):
+                response = self.client.get(url, {'fields': 'id,status'})
+            self.assertEqual(response.data['results'],
+                             [{'id': order.id, 'status': 'open'}])
+        response = self.client.get(url, {'expand': 'user'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_create_order(self):
+        url = reverse('order-list')
+        payload = {'items': [{'product': self.product1.id, 'quantity': 2},
+                             {'product': self.product2.id, 'quantity': 1}]}
+        response = self.client.post(url, payload, format='json')
+        self.assertEqual(response.status_code, 201)
+        order = Order.objects.get(pk=response.data['id'])
+        self.assertEqual(order.user, self.user)
+        self.assertEqual(order.total_sum, 240000)
+        self.assertEqual(response.data['total_sum'], '240000.00')
+        self.assertEqual(order.items.count(), 2)
+
+    def test_place_order_queries_do_not_grow(self):
+        Product.objects.bulk_create(
+            Product(title=f'Product {i}', description='Тест', price=10)
+            for i in range(40)
+        )
+        ids = list(Product.objects.filter(title__startswith='Product')
+                   .values_list('id', flat=True))
+        counts = []
+        for lines in (1, 40):
+            items = [{'product': pk, 'quantity': 3} for pk in ids[:lines]]
+            with CaptureQueriesContext(connection) as queries:
+                order = Order.objects.place(self.user, items)
+            counts.append(len(queries))
+            self.assertEqual(order.items.count(), lines)
+        self.assertEqual(counts[0], counts[1])
+        self.assertEqual(order.total_sum, 40 * 3 * 10)
+
+    def test_place_order_with_missing_products(self):
+        items = [{'product': 0}, {'product': self.product1.id}]
+        with self.assertRaises(Product.DoesNotExist):
+            Order.objects.place(self.user, items)
+        self.assertFalse(Order.objects.exists())
+
+    def test_create_order_resolves_products_in_one_query(self):
+        Product.objects.bulk_create(
+            Product(title=f'Product {i}', description='Тест', price=10)
+            for i in range(40)
+        )
+        ids = list(Product.objects.filter(title__startswith='Product')
+                   .values_list('id', flat=True))
+        url = reverse('order-list')
+        # токен попадает в кэш на первом запросе
+        self.client.get(url)
+        counts = []
+        for lines in (1, 40):
+            payload = {'items': [{'product': pk, 'quantity': 1}
+                                 for pk in ids[:lines]]}
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post(url, payload, format='json')
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(len(response.data['items']), lines)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_create_order_with_missing_products(self):
+        url = reverse('order-list')
+        payload = {'items': [{'product': 0}, {'product': self.product1.id},
+                             {'product': 999999}]}
+        response = self.client.post(url, payload, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['items'],
+                         ['Продукты не найдены: 0, 999999'])
+        payload = {'items': [{'product': 'abc'}]}
+        response = self.client.post(url, payload, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Order.objects.exists())
+
+    def test_unit_price_snapshot(self):
+        order = Order.objects.place(self.user, [
+            {'product': self.product1, 'quantity': 2},
+            {'product': self.product2.id, 'quantity': 1},
+        ])
+        Product.objects.filter(pk=self.product1.pk).update(price=1)
+        self.create_order(self.product2)
+
+        with CaptureQueriesContext(connection) as queries:
+            totals = {o.id: o.total for o in Order.objects.with_totals()}
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(totals[order.id], 240000)
+        self.assertEqual(len(totals), 2)
+
+        response = self.client.get(reverse('order-detail', args=(order.id, )))
+        self.assertEqual(response.data['items'][0]['unit_price'], '100000.00')
+
+    def test_backfill_unit_prices(self):
+        order = self.create_order(self.product1, self.product2)
+        self.create_order(self.product2)
+        out = StringIO()
+        call_command('backfill_unit_prices', batch_size=2, stdout=out)
+        self.assertIn('3', out.getvalue())
+        self.assertFalse(OrderItem.objects.filter(unit_price=None).exists())
+        self.assertEqual(Order.objects.with_totals().get(pk=order.pk).total,
+                         140000)
+
+    def change_in_admin(self, order, rows):
+        """rows - [(OrderItem или None, product, quantity, delete)]"""
+        data = {
+            'items-TOTAL_FORMS': len(rows),
+            'items-INITIAL_FORMS': sum(1 for row in rows if row[0]),
+            'items-MIN_NUM_FORMS': 0,
+            'items-MAX_NUM_FORMS': 1000,
+        }
+        for i, (item, product, quantity, delete) in enumerate(rows):
+            data.update({f'items-{i}-id': item.id if item else '',
+                         f'items-{i}-order': order.id,
+                         f'items-{i}-product': product.id,
+                         f'items-{i}-quantity': quantity})
+            if delete:
+                data[f'items-{i}-DELETE'] = 'on'
+        self.client.force_login(self.admin)
+        url = reverse('admin:order_order_change', args=(order.id, ))
+        return self.client.post(url, data)
+
+    def test_admin_keeps_legacy_items_in_total(self):
+        order = self.create_order(self.product1, self.product2)
+        first, second = order.items.order_by('id')
+        response = self.change_in_admin(order, [
+            (first, self.product1, 1, False),
+            (second, self.product2, 2, False),
+        ])
+        self.assertEqual(response.status_code, 302)
+        order.refresh_from_db()
+        self.assertEqual(order.total_sum, 180000)
+        self.assertFalse(order.items.filter(unit_price=None).exists())
+
+    def test_admin_items_reserve_stock(self):
+        Product.objects.filter(pk=self.product1.pk).update(stock=10)
+        order = Order.objects.place(self.user, [{'product': self.product1,
+                                                 'quantity': 2}])
+        item = order.items.get()
+
+        def stock():
+            return Product.objects.get(pk=self.product1.pk).stock
+
+        response = self.change_in_admin(order, [
+            (item, self.product1, 5, False),
+            (None, self.product1, 1, False),
+        ])
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(stock(), 4)
+
+        second = order.items.exclude(pk=item.pk).get()
+        response = self.change_in_admin(order, [
+            (item, self.product1, 5, False),
+            (second, self.product1, 1, True),
+        ])
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(stock(), 5)
+
+        response = self.change_in_admin(order, [
+            (item, self.product1, 11, False),
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Недостаточно товара')
+        self.assertEqual((stock(), order.items.get().quantity), (5, 5))
+
+        order.refresh_from_db()
+        order.cancel()
+        self.assertEqual(stock(), 10)
+        # у отменённого заказа позиции не редактируются
+        self.change_in_admin(order, [(item, self.product1, 1, False)])
+        self.assertEqual((stock(), order.items.get().quantity), (10, 5))
+
+    def test_list_query_budget(self):
+        def create(n):
+            for _ in range(n):
+                self.create_order(self.product1, self.product2)
+
+        url = reverse('order-list')
+        for fast_list in (True, False):
+            OrderItem.objects.all().delete()
+            Order.objects.all().delete()
+            with mock.patch.object(OrderViewSet, 'fast_list', fast_list):
+                self.assertQueryBudget(self.client, url, create,
+                                       max_queries=5)
+
+    def test_retrieve_query_budget(self):
+        order = self.create_order()
+        Product.objects.bulk_create(
+            Product(title=f'Product {i}', description='Тест', price=10)
+            for i in range(20)
+        )
+        products = Product.objects.filter(title__startswith='Product')
+
+        def create(n):
+            OrderItem.objects.bulk_create(
+                OrderItem(order=order, product=product, unit_price=10)
+                for product in products[:n]
+            )
+
+        url = reverse('order-detail', args=(order.id, ))
+        self.assertQueryBudget(self.client, url, create, sizes=(1, 20),
+                               max_queries=4)
+
+    def test_idempotent_create(self):
+        url = reverse('order-list')
+        payload = {'items': [{'product': self.product1.id, 'quantity': 1}]}
+        for backend in ('db', 'cache'):
+            key = str(uuid.uuid4())
+            with override_settings(IDEMPOTENCY_BACKEND=backend):
+                first = self.client.post(url, payload, format='json',
+                                         HTTP_IDEMPOTENCY_KEY=key)
+                second = self.client.post(url, payload, format='json',
+                                          HTTP_IDEMPOTENCY_KEY=key)
+                self.assertEqual(first.status_code, 201)
+                self.assertEqual(second.status_code, 201)
+                self.assertEqual(second.data, first.data)
+                self.assertEqual(second['Idempotent-Replayed'], 'true')
+                self.assertEqual(Order.objects.filter(
+                    pk=first.data['id']).count(), 1)
+
+                payload2 = {'items': [{'product': self.product2.id}]}
+                response = self.client.post(url, payload2, format='json',
+                                            HTTP_IDEMPOTENCY_KEY=key)
+                self.assertEqual(response.status_code, 422)
+        self.assertEqual(Order.objects.count(), 2)
+        self.assertEqual(IdempotencyRecord.objects.count(), 1)
+
+    def test_idempotent_cache_store_serializes_concurrent_requests(self):
+        calls = []
+
+        def handler():
+            calls.append(1)
+            time.sleep(0.05)
+            return Response({'id': len(calls)}, status=201)
+
+        store = CacheIdempotencyStore()
+        key = str(uuid.uuid4())
+        responses = []
+
+        def worker():
+            responses.append(store.run(self.user.pk, key, 'fp', handler))
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([r.data for r in responses], [{'id': 1}] * 8)
+        replayed = [r for r in responses
+                    if r.has_header('Idempotent-Replayed')]
+        self.assertEqual(len(replayed), 7)
+
+    def test_stock_reservation(self):
+        Product.objects.filter(pk=self.product1.pk).update(stock=3)
+        Product.objects.filter(pk=self.product2.pk).update(stock=1)
+        order = Order.objects.place(self.user, [
+            {'product': self.product1, 'quantity': 1},
+            {'product': self.product2, 'quantity': 1},
+            {'product': self.product1, 'quantity': 1},
+        ])
+        self.product1.refresh_from_db()
+        self.product2.refresh_from_db()
+        self.assertEqual((self.product1.stock, self.product2.stock), (1, 0))
+
+        url = reverse('order-list')
+        payload = {'items': [{'product': self.product1.id, 'quantity': 1},
+                             {'product': self.product2.id, 'quantity': 1}]}
+        response = self.client.post(url, payload, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(str(self.product2.id), response.data['items'][0])
+        self.product1.refresh_from_db()
+        self.assertEqual(self.product1.stock, 1)
+        self.assertEqual(Order.objects.count(), 1)
+
+        order.cancel()
+        with self.assertRaises(InvalidTransition):
+            order.cancel()
+        self.product1.refresh_from_db()
+        self.product2.refresh_from_db()
+        self.assertEqual((self.product1.stock, self.product2.stock), (3, 1))
+        self.assertEqual(Order.objects.get(pk=order.pk).status, 'canceled')
+
+    def test_untracked_stock(self):
+        with self.assertRaises(OutOfStock):
+            Product.reserve_stock({self.product1.id: 1, 0: 1})
+        Product.reserve_stock({self.product1.id: 1000})
+        self.product1.refresh_from_db()
+        self.assertIsNone(self.product1.stock)
+
+    def test_cancel_releases_only_reserved(self):
+        Product.objects.filter(pk=self.product2.pk).update(stock=5)
+        # product1 без учёта остатков, старый заказ - без резерва
+        placed = Order.objects.place(self.user, [
+            {'product': self.product1, 'quantity': 2},
+            {'product': self.product2, 'quantity': 1},
+        ])
+        self.assertEqual(
+            sorted(placed.items.values_list('quantity', 'reserved_quantity')),
+            [(1, 1), (2, 0)]
+        )
+        legacy = self.create_order(self.product2)
+        Product.objects.filter(pk=self.product1.pk).update(stock=10)
+
+        legacy.cancel()
+        placed.cancel()
+        self.product1.refresh_from_db()
+        self.product2.refresh_from_db()
+        self.assertEqual((self.product1.stock, self.product2.stock), (10, 5))
+
+    def test_transition(self):
+        order = self.create_order(self.product1)
+        url = reverse('order-transition', args=(order.id, ))
+        response = self.client.post(url, {'status': 'finished'})
+        self.assertEqual(response.status_code, 403)
+
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Token {self.admin_token.key}'
+        )
+        response = self.client.post(url, {'status': 'finished'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(url, {'status': 'in_progress',
+                                          'version': 0})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['status'], 'in_progress')
+        self.assertEqual(response.data['version'], 1)
+        # клиент с устаревшей версией получает конфликт
+        response = self.client.post(url, {'status': 'canceled',
+                                          'version': 0})
+        self.assertEqual(response.status_code, 409)
+        order.refresh_from_db()
+        self.assertEqual((order.status, order.version), ('in_progress', 1))
+
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Token {self.user_token.key}'
+        )
+        response = self.client.post(url, {'status': 'canceled'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['version'], 2)
+
+    def test_bulk_transition(self):
+        Product.objects.filter(pk=self.product1.pk).update(stock=10)
+        orders = [Order.objects.place(self.user, [{'product': self.product1,
+                                                   'quantity': 2}])
+                  for _ in range(3)]
+        orders[0].transition('in_progress')
+        orders[0].transition('finished')
+
+        self.client.force_login(self.admin)
+        url = reverse('admin:order_order_changelist')
+        response = self.client.post(url, {
+            'action': 'mark_canceled',
+            '_selected_action': [order.id for order in orders],
+        })
+        self.assertEqual(response.status_code, 302)
+        statuses = dict(Order.objects.values_list('id', 'status'))
+        self.assertEqual([statuses[order.id] for order in orders],
+                         ['finished', 'canceled', 'canceled'])
+        self.product1.refresh_from_db()
+        self.assertEqual(self.product1.stock, 8)
+        self.assertEqual(Order.objects.filter(status='open')
+                         .transition('in_progress'), 0)
+
+    def test_bulk_transition_after_search(self):
+        orders = [self.create_order(self.product1, self.product2)
+                  for _ in range(2)]
+        self.create_order(self.product2)
+        self.client.force_login(self.admin)
+        url = reverse('admin:order_order_changelist')
+        # поиск по products__title добавляет DISTINCT
+        response = self.client.post(f'{url}?q=Iphone', {
+            'action': 'mark_in_progress',
+            'select_across': 1,
+            'index': 0,
+            '_selected_action': [order.id for order in orders],
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(
+            sorted(Order.objects.filter(status='in_progress')
+                   .values_list('id', flat=True)),
+            sorted(order.id for order in orders)
+        )
+
+    @override_settings(ORDER_INTAKE_MODE='async')
+    @eager_celery()
+    def test_async_intake(self):
+        Product.objects.filter(pk=self.product1.pk).update(stock=3)
+
+        url = reverse('order-list')
+        payload = {'items': [{'product': self.product1.id, 'quantity': 2},
+                             {'product': self.product2.id}]}
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url, payload, format='json')
+            self.assertEqual(response.status_code, 202)
+            self.assertEqual(response.data['status'], 'pending')
+            self.assertEqual(response['Location'], response.data['url'])
+            self.assertFalse(Order.objects.exists())
+
+        response = self.client.get(response.data['url'])
+        self.assertEqual(response.data['status'], 'done')
+        order = Order.objects.get(pk=response.data['order'])
+        self.assertEqual((order.user, order.total_sum),
+                         (self.user, 240000))
+
+        # на второй заказ товара уже не хватает
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url, payload, format='json')
+        response = self.client.get(response.data['url'])
+        self.assertEqual(response.data['status'], 'failed')
+        self.assertIn('items', response.data['errors'])
+
+        # чужой заказ не виден
+        self.client.force_authenticate(self.admin)
+        self.assertEqual(self.client.get(response.data['url']).status_code,
+                         404)
+        response = self.client.post(url, {'items': [{'product': 0}]},
+                                    format='json')
+        self.assertEqual(response.status_code, 400)
+
+    @override_settings(ORDER_INTAKE_MODE='async',
+                       ORDER_INTAKE_MAX_PENDING_PER_USER=2,
+                       ORDER_INTAKE_RETRY_AFTER=7)
+    def test_async_intake_back_pressure(self):
+        url = reverse('order-list')
+        payload = {'items': [{'product': self.product1.id}]}
+        for _ in range(2):
+            response = self.client.post(url, payload, format='json')
+            self.assertEqual(response.status_code, 202)
+        response = self.client.post(url, payload, format='json')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '7')
+        self.assertEqual(OrderIntake.objects.count(), 2)
+
+    def test_drain_order_intake_in_batches(self):
+        Product.objects.filter(pk=self.product1.pk).update(stock=4)
+        intakes = [
+            OrderIntake.objects.create(user=self.user, items=[
+                {'product': self.product1.id, 'quantity': 1},
+                {'product': self.product2.id, 'quantity': 1},
+            ])
+            for _ in range(5)
+        ]
+        OrderIntake.objects.create(user=self.user, items=[
+            {'product': 0, 'quantity': 1}
+        ])
+        self.assertEqual(drain(batch_size=2), 6)
+        statuses = dict(OrderIntake.objects.values_list('id', 'status'))
+        self.assertEqual([statuses[intake.id] for intake in intakes],
+                         ['done'] * 4 + ['failed'])
+        self.assertEqual(OrderIntake.objects.get(status='failed',
+                                                 items__0__product=0)
+                         .errors, {'items': ['Продукты не найдены: 0']})
+        self.product1.refresh_from_db()
+        self.assertEqual(self.product1.stock, 0)
+        self.assertEqual(drain(), 0)
+
+
+@override_settings(SALES_ROLLUP_LAG=0)
+class TestSalesRollups(APITestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user('test1@gmail.com',
+                                             'qwerty',
+                                             name='User1',
+                                             is_active=True)
+        self.admin = User.objects.create_superuser('admin@gmail.com',
+                                                   'qwerty',
+                                                   name='Admin1')
+        self.phone = Product.objects.create(title='Apple Iphone 12',
+                                            description='Крутой телефон',
+                                            price=100000)
+        self.case = Product.objects.create(title='Чехол',
+                                           description='Просто чехол',
+                                           price=500)
+
+    def place(self, days_ago, *items):
+        order = Order.objects.place(self.user, [
+            {'product': product, 'quantity': quantity}
+            for product, quantity in items
+        ])
+        Order.objects.filter(pk=order.pk).update(
+            created_at=timezone.now() - timedelta(days=days_ago)
+        )
+        return order
+
+    def snapshot(self):
+        return (
+            sorted(DailySalesRollup.objects
+                   .values_list('day', 'status', 'orders_count', 'revenue')),
+            sorted(ProductSalesRollup.objects
+                   .values_list('day', 'product', 'units', 'revenue')),
+        )
+
+    def test_incremental_update_matches_rebuild(self):
+        self.place(2, (self.phone, 1), (self.case, 2))
+        self.place(1, (self.case, 1))
+        self.assertIsNone(update_rollups())
+        self.assertEqual(DailySalesRollup.objects.count(), 2)
+
+        # новые заказы и смена статуса старого
+        old = self.place(2, (self.phone, 2))
+        Order.objects.filter(pk=old.pk).update(
+            updated_at=timezone.now() - timedelta(seconds=1)
+        )
+        Order.objects.get(pk=old.pk).cancel()
+        self.place(0, (self.case, 3))
+        self.assertEqual(update_rollups(), 2)
+        incremental = self.snapshot()
+
+        call_command('rebuild_sales_rollups', stdout=StringIO())
+        self.assertEqual(self.snapshot(), incremental)
+        canceled = DailySalesRollup.objects.get(status='canceled')
+        self.assertEqual((canceled.orders_count, canceled.revenue),
+                         (1, 200000))
+        self.assertEqual(ProductSalesRollup.objects
+                         .filter(product=self.phone).get().units, 1)
+
+    def test_analytics_endpoints(self):
+        self.place(1, (self.phone, 1), (self.case, 2))
+        self.place(0, (self.case, 4))
+        self.place(0, (self.phone, 1)).cancel()
+        update_rollups()
+
+        url = reverse('analytics-daily')
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+        self.client.force_authenticate(self.admin)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(
+            [(row['orders_count'], row['revenue']) for row in response.data],
+            [(1, 101000), (1, 2000)]
+        )
+
+        today = timezone.localdate()
+        response = self.client.get(reverse('analytics-statuses'),
+                                   {'date_from': today})
+        self.assertEqual(
+            {row['status']: row['orders_count'] for row in response.data},
+            {'open': 1, 'canceled': 1}
+        )
+
+        response = self.client.get(reverse('analytics-products'),
+                                   {'limit': 1})
+        self.assertEqual([(row['title'], row['units'])
+                          for row in response.data], [('Чехол', 6)])
+
+        response = self.client.get(url, {'date_from': today,
+                                         'date_to': today - timedelta(1)})
+        self.assertEqual(response.status_code, 400)
+
+
+class TestIdempotencyDatabaseStore(TransactionTestCase):
+    @skipUnlessDBFeature('has_select_for_update')
+    def test_concurrent_requests(self):
+        user = User.objects.create_user('test1@gmail.com', 'qwerty',
+                                        name='User1', is_active=True)
+        calls = []
+        responses = []
+
+        def handler():
+            calls.append(1)
+            time.sleep(0.1)
+            return Response({'id': len(calls)}, status=201)
+
+        def worker():
+            try:
+                responses.append(DatabaseIdempotencyStore().run(
+                    user.pk, 'key', 'fp', handler
+                ))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([r.data for r in responses], [{'id': 1}] * 6)
+        self.assertEqual(IdempotencyRecord.objects.get().status_code, 201)
+
+
+class TestStockContention(TransactionTestCase):
+    @skipUnlessDBFeature('has_select_for_update')
+    def test_concurrent_orders_never_oversell(self):
+        user = User.objects.create_user('test1@gmail.com', 'qwerty',
+                                        name='User1', is_active=True)
+        products = [Product.objects.create(title=f'Product {i}',
+                                           description='Тест', price=10,
+                                           stock=100)
+                    for i in range(3)]
+        request = SimpleNamespace(user=user, method='POST')
+        results = []
+        errors = []
+
+        def worker(seed):
+            rnd = random.Random(seed)
+            try:
+                for _ in range(15):
+                    lines = rnd.sample(products, 2)
+                    items = [{'product': product.id,
+                              'quantity': rnd.randint(1, 3)}
+                             for product in lines]
+                    serializer = OrderSerializer(data={'items': items},
+                                                 context={'request': request})
+                    serializer.is_valid(raise_exception=True)
+                    try:
+                        serializer.save()
+                        results.append(items)
+                    except ValidationError:
+                        pass
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        started = time.monotonic()
+        threads = [threading.Thread(target=worker, args=(i, ))
+                   for i in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - started
+        self.assertEqual(errors, [])
+        # часть заказов прошла, остальным не хватило товара
+        self.assertTrue(0 < len(results) < 300)
+
+        reserved = {product.id: 0 for product in products}
+        for items in results:
+            for item in items:
+                reserved[item['product']] += item['quantity']
+        for product in products:
+            product.refresh_from_db()
+            self.assertGreaterEqual(product.stock, 0)
+            self.assertEqual(product.stock, 100 - reserved[product.id])
+        self.assertEqual(Order.objects.count(), len(results))
+        # 300 заказов из 20 потоков
+        self.assertLess(elapsed, 30)
@@ -1,10 +1,11 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 
-from .views import OrderViewSet
+from .views import OrderViewSet, SalesAnalyticsViewSet
 
 router = DefaultRouter()
 router.register("orders", OrderViewSet)
+router.register("analytics", SalesAnalyticsViewSet, basename="analytics")
 
 urlpatterns = [
     path("", include(router.urls))
@@ -1,12 +1,67 @@
+from django.db.models import F, Prefetch, Sum
 from django_filters import rest_framework as filters
 from rest_framework import viewsets, mixins, permissions
+from rest_framework.decorators import action
+from rest_framework.exceptions import (APIException, PermissionDenied,
+                                       ValidationError)
+from rest_framework.generics import get_object_or_404
+from rest_framework.response import Response
 
+from shop.fastpath import FastListMixin
+from shop.fieldsets import SparseFieldsMixin
+from shop.idempotency import IdempotentCreateMixin
+from shop.streaming import export_from_request
+from .exports import EXPORTS
 from .filters import OrderFilter
-from .models import Order
-from .serializers import OrderSerializer
+from .intake import QueueFull, enqueue, get_intake_mode
+from .models import (DailySalesRollup, InvalidTransition, Order, OrderIntake,
+                     OrderItem, ProductSalesRollup, TransitionConflict)
+from .serializers import (OrderIntakeSerializer, OrderSerializer,
+                          OrderTransitionSerializer,
+                          SalesAnalyticsQuerySerializer)
 
 
-class OrderViewSet(mixins.CreateModelMixin, mixins.ListModelMixin,
+class Conflict(APIException):
+    status_code = 409
+    default_detail = 'Конфликт изменений'
+    default_code = 'conflict'
+
+
+class ServiceUnavailable(APIException):
+    status_code = 503
+    default_detail = 'Сервис временно недоступен'
+    default_code = 'service_unavailable'
+
+    def __init__(self, detail=None, wait=None):
+        super().__init__(detail)
+        # DRF отдаёт его в заголовке Retry-After
+        self.wait = wait
+
+
+class OrderIntakeMixin:
+    """
+    При ORDER_INTAKE_MODE='async' create() только проверяет данные,
+    ставит заказ в очередь и отвечает 202 со ссылкой на его статус
+    """
+    def create(self, request, *args, **kwargs):
+        if get_intake_mode() != 'async':
+            return super().create(request, *args, **kwargs)
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            intake = enqueue(request.user,
+                             serializer.validated_data['items'])
+        except QueueFull as e:
+            raise ServiceUnavailable(str(e), wait=e.retry_after)
+        context = self.get_serializer_context()
+        data = OrderIntakeSerializer(intake, context=context).data
+        return Response(data, status=202,
+                        headers={'Location': data['url']})
+
+
+class OrderViewSet(IdempotentCreateMixin, OrderIntakeMixin, FastListMixin,
+                   SparseFieldsMixin,
+                   mixins.CreateModelMixin, mixins.ListModelMixin,
                    mixins.RetrieveModelMixin, viewsets.GenericViewSet):
     queryset = Order.objects.all()
     permission_classes = [permissions.IsAuthenticated]
@@ -16,4 +71,107 @@ class OrderViewSet(mixins.CreateModelMixin, mixins.ListModelMixin,
 
     def get_queryset(self):
         user = self.request.user
-        return Order.objects.filter(user=user)
+        # позиции всех заказов страницы - одним запросом
+        items = Prefetch('items',
+                         queryset=OrderItem.objects.select_related('product')
+                         .only('id', 'order', 'product__id', 'quantity',
+                               'unit_price').order_by('pk'))
+        queryset = Order.objects.prefetch_related(items)
+        # сотрудники меняют статусы любых заказов
+        if self.action == 'transition' and user.is_staff:
+            return queryset
+        return queryset.filter(user=user)
+
+    def get_permissions(self):
+        if self.action == 'export':
+            return [permissions.IsAdminUser()]
+        return super().get_permissions()
+
+    # api/v1/orders/1/transition/ {"status": "canceled", "version": 0}
+    @action(['POST'], detail=True)
+    def transition(self, request, pk=None):
+        order = self.get_object()
+        serializer = OrderTransitionSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        status = serializer.validated_data['status']
+        # покупатель может только отменить заказ
+        if status != 'canceled' and not request.user.is_staff:
+            raise PermissionDenied()
+        order.version = serializer.validated_data.get('version',
+                                                      order.version)
+        try:
+            order.transition(status)
+        except InvalidTransition as e:
+            raise ValidationError({'status': [str(e)]})
+        except TransitionConflict as e:
+            raise Conflict(str(e))
+        return Response(self.get_serializer(order).data)
+
+    # api/v1/orders/intake/<id>/ - статус заказа, принятого в очередь
+    @action(['GET'], detail=False, url_name='intake',
+            url_path=r'intake/(?P<intake_id>[0-9a-f-]{32,36})')
+    def intake(self, request, intake_id=None):
+        intake = get_object_or_404(OrderIntake, pk=intake_id,
+                                   user=request.user)
+        return Response(OrderIntakeSerializer(
+            intake, context=self.get_serializer_context()
+        ).data)
+
+    # api/v1/orders/export/?dataset=items&type=ndjson&gzip=1
+    @action(['GET'], detail=False)
+    def export(self, request):
+        return export_from_request(request, EXPORTS)
+
+
+class SalesAnalyticsViewSet(viewsets.ViewSet):
+    """
+    Отчёты по продажам. Читают только таблицы агрегатов,
+    которые обновляет задача update_sales_rollups
+    """
+    permission_classes = [permissions.IsAdminUser]
+
+    def get_params(self):
+        serializer = SalesAnalyticsQuerySerializer(
+            data=self.request.query_params
+        )
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data
+
+    def filter_days(self, queryset, params):
+        if params.get('date_from'):
+            queryset = queryset.filter(day__gte=params['date_from'])
+        if params.get('date_to'):
+            queryset = queryset.filter(day__lte=params['date_to'])
+        return queryset
+
+    # api/v1/analytics/daily/?date_from=2021-05-01&date_to=2021-05-31
+    @action(['GET'], detail=False)
+    def daily(self, request):
+        params = self.get_params()
+        rows = self.filter_days(DailySalesRollup.objects.all(), params) \
+            .exclude(status='canceled') \
+            .values('day').order_by('day') \
+            .annotate(orders_count=Sum('orders_count'),
+                      revenue=Sum('revenue'))
+        return Response(list(rows))
+
+    # api/v1/analytics/statuses/
+    @action(['GET'], detail=False)
+    def statuses(self, request):
+        params = self.get_params()
+        rows = self.filter_days(DailySalesRollup.objects.all(), params) \
+            .values('status').order_by('status') \
+            .annotate(orders_count=Sum('orders_count'),
+                      revenue=Sum('revenue'))
+        return Response(list(rows))
+
+    # api/v1/analytics/products/?limit=10
+    @action(['GET'], detail=False)
+    def products(self, request):
+        params = self.get_params()
+        rows = self.filter_days(ProductSalesRollup.objects.all(), params) \
+            .values('product_id') \
+            .annotate(title=F('product__title'), units=Sum('units'),
+                      revenue=Sum('revenue')) \
+            .order_by('-units', 'product_id')[:params['limit']]
+        return Response(list(rows))
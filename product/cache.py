@@ -0,0 +1,162 @@
+import hashlib
+import time
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, urlencode
+from rest_framework.response import Response
+
+VERSION_KEY = 'catalog:version'
+MODIFIED_KEY = 'catalog:modified'
+HITS_KEY = 'catalog:hits'
+MISSES_KEY = 'catalog:misses'
+
+
+def _initial_version():
+    # если ключ версии вытеснен из кэша, новая версия не должна
+    # совпасть со старыми записями, поэтому берём текущее время
+    return int(time.time() * 1000)
+
+
+def _incr(key):
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.add(key, 1, None)
+        return 1
+
+
+def get_catalog_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, _initial_version(), None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def get_catalog_modified():
+    """Время последнего изменения каталога (unix time) или None"""
+    return cache.get(MODIFIED_KEY)
+
+
+def bump_catalog_version():
+    """Сбрасывает весь кэш каталога за O(1): старые ключи просто
+    перестают использоваться и вытесняются по таймауту"""
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.add(VERSION_KEY, _initial_version(), None)
+    cache.set(MODIFIED_KEY, int(time.time()), None)
+
+
+def invalidate_catalog():
+    bump_catalog_version()
+    # повторно после коммита, чтобы не оставить в кэше данные,
+    # прочитанные до завершения транзакции
+    transaction.on_commit(bump_catalog_version)
+
+
+def get_request_fingerprint(request):
+    params = sorted((key, sorted(values))
+                    for key, values in request.query_params.lists())
+    renderer = getattr(request, 'accepted_renderer', None)
+    fmt = getattr(renderer, 'format', '')
+    # хост входит в ссылки next/previous пагинации
+    value = f'{request.get_host()}|{urlencode(params, doseq=True)}|{fmt}'
+    return hashlib.md5(value.encode()).hexdigest()
+
+
+def get_cache_key(request, action, pk=None):
+    fingerprint = get_request_fingerprint(request)
+    return f'catalog:{get_catalog_version()}:{action}:{pk}:{fingerprint}'
+
+
+def get_cache_stats():
+    hits = cache.get(HITS_KEY, 0)
+    misses = cache.get(MISSES_KEY, 0)
+    total = hits + misses
+    return {
+        'version': get_catalog_version(),
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': round(hits / total, 4) if total else 0,
+    }
+
+
+class CatalogCacheMixin:
+    """
+    Кэширует ответы list и retrieve в кэше Django и отдаёт
+    ETag/Last-Modified, отвечая 304 без сериализации.
+    Для retrieve валидаторы берутся из Product.updated_at,
+    для остальных действий - из версии каталога.
+    """
+    cache_timeout = getattr(settings, 'CATALOG_CACHE_TIMEOUT', 60 * 15)
+
+    def list(self, request, *args, **kwargs):
+        handler = partial(self.cached_response, super().list)
+        return self.conditional_response(handler, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        handler = partial(self.cached_response, super().retrieve)
+        return self.conditional_response(handler, request, *args, **kwargs)
+
+    def get_lookup_value(self):
+        return self.kwargs.get(self.lookup_url_kwarg or self.lookup_field)
+
+    def get_validators(self, request):
+        fingerprint = get_request_fingerprint(request)
+        if self.action == 'retrieve':
+            lookup = self.get_lookup_value()
+            try:
+                updated_at = self.get_queryset().filter(
+                    **{self.lookup_field: lookup}
+                ).values_list('updated_at', flat=True).first()
+            except (ValueError, TypeError, ValidationError):
+                updated_at = None
+            if updated_at is None:
+                return None, None
+            value = f'{lookup}:{updated_at.isoformat()}:{fingerprint}'
+            last_modified = int(updated_at.timestamp())
+        else:
+            version = get_catalog_version()
+            value = f'{version}:{self.action}:{self.get_lookup_value()}:' \
+                    f'{fingerprint}'
+            last_modified = get_catalog_modified()
+        etag = '"%s"' % hashlib.md5(value.encode()).hexdigest()
+        return etag, last_modified
+
+    def conditional_response(self, handler, request, *args, **kwargs):
+        etag, last_modified = self.get_validators(request)
+        response = None
+        if etag is not None:
+            response = get_conditional_response(request, etag=etag,
+                                                last_modified=last_modified)
+        if response is None:
+            response = handler(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+        if etag is not None:
+            response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+        return response
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        key = get_cache_key(request, self.action, self.get_lookup_value())
+        data = cache.get(key)
+        if data is not None:
+            _incr(HITS_KEY)
+            response = Response(data)
+            response['X-Cache'] = 'HIT'
+            return response
+
+        _incr(MISSES_KEY)
+        response = handler(request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(key, response.data, self.cache_timeout)
+        response['X-Cache'] = 'MISS'
+        return response
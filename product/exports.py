@@ -0,0 +1,22 @@
+from product.models import Product, ProductReview
+from shop.streaming import Export
+
+
+def products_export():
+    return Export(Product.objects.all(),
+                  ('id', 'title', 'description', 'price', 'image',
+                   'avg_rating', 'reviews_count', 'updated_at'),
+                  'products')
+
+
+def reviews_export():
+    return Export(ProductReview.objects.all(),
+                  ('id', 'product_id', 'author_id', 'text', 'rating',
+                   'created_at', 'updated_at'),
+                  'reviews')
+
+
+EXPORTS = {
+    'products': products_export,
+    'reviews': reviews_export,
+}
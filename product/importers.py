@@ -0,0 +1,150 @@
+import csv
+import json
+import time
+
+from django.db import transaction
+from django.utils import timezone
+
+from product.cache import invalidate_catalog
+from product.models import Product
+from product.search import get_search_backend
+from product.serializers import ImportProductSerializer
+
+
+def read_csv(lines):
+    reader = csv.DictReader(lines)
+    for row in reader:
+        yield reader.line_num, row
+
+
+def read_jsonl(lines):
+    for line_num, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield line_num, row
+
+
+READERS = {
+    'csv': read_csv,
+    'jsonl': read_jsonl,
+}
+
+
+class ImportReport:
+    def __init__(self, max_errors=1000):
+        self.max_errors = max_errors
+        self.created = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.failed = 0
+        self.errors = []
+        self.started = time.monotonic()
+        self.elapsed = 0
+
+    @property
+    def rows(self):
+        return self.created + self.updated + self.unchanged + self.failed
+
+    @property
+    def rows_per_second(self):
+        return round(self.rows / self.elapsed) if self.elapsed else 0
+
+    def add_error(self, line, errors):
+        self.failed += 1
+        # храним только первые ошибки, чтобы память не росла с файлом
+        if len(self.errors) < self.max_errors:
+            self.errors.append({'line': line, 'errors': errors})
+
+    def finish(self):
+        self.elapsed = time.monotonic() - self.started
+
+    def as_dict(self):
+        return {
+            'rows': self.rows,
+            'created': self.created,
+            'updated': self.updated,
+            'unchanged': self.unchanged,
+            'failed': self.failed,
+            'elapsed': round(self.elapsed, 3),
+            'rows_per_second': self.rows_per_second,
+            'errors': self.errors,
+        }
+
+
+class ProductImporter:
+    """
+    Потоковый импорт продуктов: строки читаются по одной,
+    пишутся пачками по batch_size через bulk_create/bulk_update,
+    каждая пачка - в своей транзакции. Ключ - уникальный title.
+    """
+    update_fields = ('description', 'price')
+
+    def __init__(self, batch_size=1000, max_errors=1000):
+        self.batch_size = batch_size
+        self.max_errors = max_errors
+
+    def run(self, rows):
+        report = ImportReport(self.max_errors)
+        batch = {}
+        for line, row in rows:
+            if not isinstance(row, dict):
+                report.add_error(line, ['Некорректная строка'])
+                continue
+            serializer = ImportProductSerializer(data=row)
+            if not serializer.is_valid():
+                report.add_error(line, serializer.errors)
+                continue
+            data = serializer.validated_data
+            # при повторе title в пачке побеждает последняя строка
+            batch[data['title']] = data
+            if len(batch) >= self.batch_size:
+                self.write(batch, report)
+                batch = {}
+        if batch:
+            self.write(batch, report)
+        if report.created or report.updated:
+            invalidate_catalog()
+        report.finish()
+        return report
+
+    @transaction.atomic
+    def write(self, batch, report):
+        existing = Product.objects.only(
+            'id', 'title', *self.update_fields
+        ).in_bulk(list(batch), field_name='title')
+        now = timezone.now()
+        to_create = []
+        to_update = []
+        for title, data in batch.items():
+            product = existing.get(title)
+            if product is None:
+                to_create.append(Product(**data))
+                continue
+            changed = False
+            for field in self.update_fields:
+                if getattr(product, field) != data[field]:
+                    setattr(product, field, data[field])
+                    changed = True
+            if changed:
+                product.updated_at = now
+                to_update.append(product)
+            else:
+                report.unchanged += 1
+
+        Product.objects.bulk_create(to_create, batch_size=self.batch_size)
+        Product.objects.bulk_update(to_update,
+                                    [*self.update_fields, 'updated_at'],
+                                    batch_size=self.batch_size)
+        # bulk-операции не вызывают сигналы, индекс обновляем сами
+        titles = [product.title for product in to_create + to_update]
+        if titles:
+            get_search_backend().index(
+                Product.objects.filter(title__in=titles)
+            )
+        report.created += len(to_create)
+        report.updated += len(to_update)
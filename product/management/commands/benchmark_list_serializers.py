@@ -0,0 +1,86 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+from order.models import Order, OrderItem
+from order.serializers import OrderSerializer
+from product.models import Product
+from product.serializers import ProductSerializer
+from shop.fastpath import CompiledSerializer
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Сравнение обычной сериализации списков и CompiledSerializer ' \
+           '(данные создаются во временной транзакции и откатываются)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000)
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        with transaction.atomic():
+            products, orders = self.create_data(rows)
+            self.compare('products', ProductSerializer, products,
+                         options['repeat'])
+            self.compare('orders', OrderSerializer,
+                         orders.prefetch_related('items'), options['repeat'])
+            transaction.set_rollback(True)
+
+    def create_data(self, rows):
+        Product.objects.bulk_create(
+            Product(title=f'benchmark-{i}', description='Тест',
+                    price=f'{i}.{i % 100:02d}')
+            for i in range(rows)
+        )
+        products = Product.objects.filter(title__startswith='benchmark-')
+        product_ids = list(products.values_list('id', flat=True))
+        user = User.objects.create_user('benchmark@example.com', 'benchmark',
+                                        name='Benchmark')
+        Order.objects.bulk_create(Order(user=user, total_sum=i)
+                                  for i in range(rows))
+        orders = Order.objects.filter(user=user)
+        OrderItem.objects.bulk_create(
+            OrderItem(order_id=order_id, product_id=product_ids[i % rows],
+                      quantity=i % 5 + 1)
+            for i, order_id in enumerate(orders.values_list('id', flat=True))
+            for _ in range(2)
+        )
+        return products.order_by('pk'), orders.order_by('pk')
+
+    def measure(self, func, repeat):
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            content = func()
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return content, best
+
+    def compare(self, name, serializer_class, queryset, repeat):
+        renderer = JSONRenderer()
+
+        def standard():
+            serializer = serializer_class(queryset.all(), many=True)
+            return renderer.render(serializer.data)
+
+        def fast():
+            compiled = CompiledSerializer(serializer_class())
+            return renderer.render(
+                compiled.render(compiled.values_list(queryset.all()))
+            )
+
+        expected, standard_time = self.measure(standard, repeat)
+        content, fast_time = self.measure(fast, repeat)
+        if content != expected:
+            raise CommandError(f'{name}: ответы различаются')
+        self.stdout.write(
+            f'{name}: {queryset.count()} строк, сериализатор '
+            f'{standard_time:.3f} с, values_list {fast_time:.3f} с, '
+            f'быстрее в {standard_time / fast_time:.1f} раз'
+        )
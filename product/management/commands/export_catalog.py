@@ -0,0 +1,7 @@
+from product.exports import EXPORTS
+from shop.streaming import BaseExportCommand
+
+
+class Command(BaseExportCommand):
+    help = 'Потоковая выгрузка продуктов или отзывов в CSV/NDJSON'
+    exports = EXPORTS
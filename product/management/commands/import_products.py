@@ -0,0 +1,34 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from product.importers import READERS, ProductImporter
+
+
+class Command(BaseCommand):
+    help = 'Импорт продуктов из CSV или JSONL (upsert по title)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=list(READERS))
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--encoding', default='utf-8-sig')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or os.path.splitext(path)[1].lstrip('.')
+        if fmt not in READERS:
+            raise CommandError('Укажите --format: csv или jsonl')
+
+        importer = ProductImporter(batch_size=options['batch_size'])
+        with open(path, newline='', encoding=options['encoding']) as file:
+            report = importer.run(READERS[fmt](file))
+
+        for error in report.errors:
+            self.stderr.write(f'Строка {error["line"]}: {error["errors"]}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано: {report.created}, обновлено: {report.updated}, '
+            f'без изменений: {report.unchanged}, ошибок: {report.failed}. '
+            f'{report.rows} строк за {report.elapsed:.2f} с '
+            f'({report.rows_per_second} строк/с)'
+        ))
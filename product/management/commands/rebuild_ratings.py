@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max, Min
+
+from product.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает avg_rating и reviews_count продуктов по отзывам'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        bounds = Product.objects.aggregate(start=Min('pk'), end=Max('pk'))
+        if bounds['start'] is None:
+            return
+        updated = 0
+        for start in range(bounds['start'], bounds['end'] + 1, batch_size):
+            queryset = Product.objects.filter(pk__gte=start,
+                                              pk__lt=start + batch_size)
+            with transaction.atomic():
+                updated += Product.rebuild_ratings(queryset)
+        self.stdout.write(self.style.SUCCESS(
+            f'Пересчитано продуктов: {updated}'
+        ))
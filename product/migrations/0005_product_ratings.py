@@ -0,0 +1,51 @@
+# Generated by Django 3.2 on 2026-10-18 10:39
+
+from django.db import migrations, models
+from django.db.models import Avg, Count, FloatField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Cast, Coalesce
+
+
+def fill_ratings(apps, schema_editor):
+    Product = apps.get_model('product', 'Product')
+    ProductReview = apps.get_model('product', 'ProductReview')
+    reviews = ProductReview.objects.filter(
+        product=OuterRef('pk')
+    ).order_by().values('product')
+    Product.objects.update(
+        reviews_count=Coalesce(Subquery(
+            reviews.annotate(value=Count('pk')).values('value')
+        ), 0),
+        ratings_sum=Coalesce(Subquery(
+            reviews.annotate(value=Sum('rating')).values('value')
+        ), 0),
+        avg_rating=Coalesce(Subquery(
+            reviews.annotate(value=Avg(Cast('rating', FloatField()))).values('value'),
+            output_field=FloatField()
+        ), Value(0.0)),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0004_product_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='avg_rating',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=3),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='ratings_sum',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='reviews_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_ratings, migrations.RunPython.noop),
+    ]
@@ -1,10 +1,22 @@
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
+from django.db.models import (Avg, Case, Count, F, FloatField,
+                              IntegerField, OuterRef, Q, Subquery, Sum,
+                              Value, When)
+from django.db.models.functions import Cast, Coalesce, Now
 
 
 User = get_user_model()
 
 
+class OutOfStock(Exception):
+    def __init__(self, product_ids):
+        self.product_ids = product_ids
+        super().__init__(f'Недостаточно товара: '
+                         f'{", ".join(map(str, product_ids))}')
+
+
 class Product(models.Model):
     title = models.CharField(max_length=100, unique=True)
     description = models.TextField()
@@ -12,6 +24,23 @@ class Product(models.Model):
     image = models.ImageField(upload_to='products',
                               null=True,
                               blank=True)
+    # пути к уменьшенным копиям image, заполняет generate_image_variants:
+    # {'thumb': {'jpeg': 'products/variants/...', 'webp': ...}, ...}
+    image_variants = models.JSONField(default=dict,
+                                      blank=True,
+                                      editable=False)
+    # заполняется PostgresSearchBackend, GIN-индекс создаётся в миграции
+    search_vector = SearchVectorField(null=True, editable=False)
+    # агрегаты по отзывам, обновляются в update_rating()
+    avg_rating = models.DecimalField(max_digits=3,
+                                     decimal_places=2,
+                                     default=0,
+                                     editable=False)
+    reviews_count = models.PositiveIntegerField(default=0, editable=False)
+    ratings_sum = models.PositiveIntegerField(default=0, editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
+    # остаток на складе; null - остаток не учитывается
+    stock = models.PositiveIntegerField(null=True, blank=True)
 
     class Meta:
         ordering = ['title', 'price']
@@ -19,6 +48,94 @@ class Product(models.Model):
     def __str__(self):
         return self.title
 
+    @classmethod
+    def update_rating(cls, product_id, count_delta, sum_delta):
+        """
+        Изменяет агрегаты одним UPDATE без чтения отзывов:
+        count_delta = 1 при создании отзыва, -1 при удалении,
+        sum_delta - изменение суммы оценок.
+        """
+        count = F('reviews_count') + count_delta
+        total = F('ratings_sum') + sum_delta
+        cls.objects.filter(pk=product_id).update(
+            reviews_count=count,
+            ratings_sum=total,
+            avg_rating=Case(
+                When(reviews_count__lte=-count_delta, then=Value(0.0)),
+                default=Cast(total, FloatField()) / count,
+                output_field=FloatField()
+            ),
+            updated_at=Now()
+        )
+
+    @classmethod
+    def lock_stock(cls, product_ids):
+        """
+        Блокирует строки в порядке id: параллельные заказы с теми же
+        продуктами ждут друг друга, а не попадают в deadlock
+        """
+        return dict(cls.objects.select_for_update()
+                    .filter(pk__in=product_ids).order_by('pk')
+                    .values_list('pk', 'stock'))
+
+    @staticmethod
+    def _quantity_case(quantities):
+        return Case(*[When(pk=pk, then=Value(quantity))
+                      for pk, quantity in quantities.items()],
+                    output_field=IntegerField())
+
+    @classmethod
+    def reserve_stock(cls, quantities):
+        """
+        Списывает остатки {product_id: количество} одним условным
+        UPDATE ... SET stock = stock - n WHERE stock >= n.
+        Вызывать внутри транзакции: при OutOfStock её нужно откатить.
+        Возвращает id продуктов с учётом остатков (stock не NULL) -
+        только у них что-то списано.
+        """
+        stock = cls.lock_stock(quantities)
+        short = sorted(pk for pk, quantity in quantities.items()
+                       if pk not in stock or
+                       stock[pk] is not None and stock[pk] < quantity)
+        if short:
+            raise OutOfStock(short)
+        condition = Q(stock__isnull=True)
+        for pk, quantity in quantities.items():
+            condition |= Q(pk=pk, stock__gte=quantity)
+        updated = cls.objects.filter(condition, pk__in=quantities).update(
+            stock=F('stock') - cls._quantity_case(quantities)
+        )
+        if updated != len(quantities):
+            raise OutOfStock(sorted(quantities))
+        return {pk for pk, value in stock.items() if value is not None}
+
+    @classmethod
+    def release_stock(cls, quantities):
+        """Возвращает остатки отменённого заказа"""
+        cls.lock_stock(quantities)
+        cls.objects.filter(pk__in=quantities).update(
+            stock=F('stock') + cls._quantity_case(quantities)
+        )
+
+    @classmethod
+    def rebuild_ratings(cls, queryset):
+        """Пересчитывает агрегаты заново по таблице отзывов"""
+        reviews = ProductReview.objects.filter(
+            product=OuterRef('pk')
+        ).order_by().values('product')
+        count = reviews.annotate(value=Count('pk')).values('value')
+        total = reviews.annotate(value=Sum('rating')).values('value')
+        avg = reviews.annotate(
+            value=Avg(Cast('rating', FloatField()))
+        ).values('value')
+        return queryset.update(
+            reviews_count=Coalesce(Subquery(count), 0),
+            ratings_sum=Coalesce(Subquery(total), 0),
+            avg_rating=Coalesce(Subquery(avg, output_field=FloatField()),
+                                Value(0.0)),
+            updated_at=Now()
+        )
+
 
 class ProductReview(models.Model):
     product = models.ForeignKey(Product,
@@ -30,3 +147,10 @@ class ProductReview(models.Model):
     text = models.TextField()
     rating = models.SmallIntegerField(default=1)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['product', 'created_at'],
+                         name='review_product_created_idx')
+        ]
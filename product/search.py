@@ -0,0 +1,145 @@
+import re
+
+from django.conf import settings
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            SearchVector)
+from django.db import connection
+from django.db.models import F, FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Cast
+from django.utils.module_loading import import_string
+from rest_framework import filters as rest_filters
+
+from product.models import Product
+
+TERM_RE = re.compile(r'\w+')
+
+
+def get_terms(text):
+    return TERM_RE.findall(text.lower())
+
+
+class BaseSearchBackend:
+    """
+    Поиск по title и description. search() фильтрует queryset
+    и добавляет аннотацию search_rank (чем больше, тем релевантнее),
+    index()/remove() поддерживают индекс в актуальном состоянии.
+    """
+    def search(self, queryset, terms):
+        raise NotImplementedError
+
+    def index(self, queryset):
+        pass
+
+    def remove(self, pks):
+        pass
+
+    def rebuild(self):
+        self.index(Product.objects.all())
+
+
+class PostgresSearchBackend(BaseSearchBackend):
+    """tsvector в Product.search_vector с GIN-индексом"""
+    def __init__(self):
+        self.config = getattr(settings, 'PRODUCT_SEARCH_CONFIG', 'simple')
+
+    def get_vector(self):
+        return (SearchVector('title', weight='A', config=self.config) +
+                SearchVector('description', weight='B', config=self.config))
+
+    def search(self, queryset, terms):
+        # поиск по префиксу, все слова должны встречаться: apple:* & iph:*
+        raw = ' & '.join(f'{term}:*' for term in terms)
+        query = SearchQuery(raw, search_type='raw', config=self.config)
+        # ts_rank возвращает real; double точно переживает
+        # сериализацию в курсор пагинации
+        rank = Cast(SearchRank(F('search_vector'), query), FloatField())
+        return queryset.filter(search_vector=query).annotate(search_rank=rank)
+
+    def index(self, queryset):
+        queryset.update(search_vector=self.get_vector())
+
+
+class SQLiteFTSSearchBackend(BaseSearchBackend):
+    """Виртуальная таблица FTS5 product_fts, rowid = Product.id"""
+    table = 'product_fts'
+    chunk_size = 2000
+
+    def search(self, queryset, terms):
+        match = ' '.join(f'"{term}"*' for term in terms)
+        # bm25 отрицательный, меньше - лучше, поэтому меняем знак
+        rank = RawSQL(
+            f'SELECT -bm25({self.table}, 10.0, 1.0) FROM {self.table} '
+            f'WHERE {self.table} MATCH %s '
+            f'AND rowid = {Product._meta.db_table}.id',
+            (match, ),
+            output_field=FloatField()
+        )
+        return queryset.annotate(search_rank=rank).filter(
+            search_rank__isnull=False
+        )
+
+    def index(self, queryset):
+        rows = queryset.order_by().values_list('id', 'title', 'description')
+        chunk = []
+        with connection.cursor() as cursor:
+            for row in rows.iterator(chunk_size=self.chunk_size):
+                chunk.append(row)
+                if len(chunk) >= self.chunk_size:
+                    self._write(cursor, chunk)
+                    chunk = []
+            if chunk:
+                self._write(cursor, chunk)
+
+    def _write(self, cursor, rows):
+        cursor.executemany(
+            f'INSERT OR REPLACE INTO {self.table}(rowid, title, description) '
+            f'VALUES (%s, %s, %s)',
+            rows
+        )
+
+    def remove(self, pks):
+        with connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {self.table} WHERE rowid = %s',
+                               [(pk, ) for pk in pks])
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table}')
+        super().rebuild()
+
+
+class LikeSearchBackend(BaseSearchBackend):
+    """ILIKE '%term%' для остальных БД, без индекса и ранжирования"""
+    def search(self, queryset, terms):
+        for term in terms:
+            queryset = queryset.filter(Q(title__icontains=term) |
+                                       Q(description__icontains=term))
+        return queryset.annotate(search_rank=Value(0.0,
+                                                   output_field=FloatField()))
+
+
+BACKENDS = {
+    'postgresql': PostgresSearchBackend,
+    'sqlite': SQLiteFTSSearchBackend,
+}
+
+
+def get_search_backend():
+    path = getattr(settings, 'PRODUCT_SEARCH_BACKEND', None)
+    if path:
+        return import_string(path)()
+    return BACKENDS.get(connection.vendor, LikeSearchBackend)()
+
+
+class ProductSearchFilter(rest_filters.SearchFilter):
+    """
+    ?search= через индексированный поиск. Результаты упорядочены
+    по релевантности, если не передан ?ordering=.
+    """
+    def filter_queryset(self, request, queryset, view):
+        terms = get_terms(' '.join(self.get_search_terms(request)))
+        if not terms:
+            return queryset
+        queryset = get_search_backend().search(queryset, terms)
+        return queryset.order_by('-search_rank', 'pk')
@@ -1,23 +1,51 @@
+from django.core.files.storage import default_storage
+from django.db import transaction
 from rest_framework import serializers
+
+from shop.fieldsets import DynamicFieldsMixin
 from .models import Product, ProductReview
 
 
-class ProductSerializer(serializers.ModelSerializer):
+class ImageVariantsField(serializers.ReadOnlyField):
+    """Превращает пути из Product.image_variants в URL"""
+    def to_representation(self, value):
+        request = self.context.get('request')
+        variants = {}
+        for name, formats in (value or {}).items():
+            variants[name] = {}
+            for fmt, path in formats.items():
+                url = default_storage.url(path)
+                if request is not None:
+                    url = request.build_absolute_uri(url)
+                variants[name][fmt] = url
+        return variants
+
+
+class ProductSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    image_variants = ImageVariantsField()
+
     class Meta:
         model = Product
-        fields = ('id', 'title', 'price')
+        fields = ('id', 'title', 'description', 'price', 'image',
+                  'image_variants', 'avg_rating', 'reviews_count')
+        # в списке только по ?expand=description,image
+        expandable_fields = ('description', 'image', 'image_variants')
+
 
+class ProductDetailsSerializer(DynamicFieldsMixin,
+                               serializers.ModelSerializer):
+    image_variants = ImageVariantsField()
 
-class ProductDetailsSerializer(serializers.ModelSerializer):
     class Meta:
         model = Product
-        fields = ('id', 'title', 'description', 'price', 'image')
+        fields = ('id', 'title', 'description', 'price', 'image',
+                  'image_variants', 'avg_rating', 'reviews_count')
 
 
 class CreateProductSerializer(serializers.ModelSerializer):
     class Meta:
         model = Product
-        fields = '__all__'
+        exclude = ('search_vector', 'ratings_sum', 'image_variants')
 
     def validate_price(self, price):
         if price < 0:
@@ -25,7 +53,18 @@ class CreateProductSerializer(serializers.ModelSerializer):
         return price
 
 
-class ReviewSerializer(serializers.ModelSerializer):
+class ImportProductSerializer(serializers.ModelSerializer):
+    """Проверка строки массового импорта"""
+    class Meta:
+        model = Product
+        fields = ('title', 'description', 'price')
+        # одинаковый title означает обновление, а не ошибку
+        extra_kwargs = {'title': {'validators': []}}
+
+    validate_price = CreateProductSerializer.validate_price
+
+
+class ReviewSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     author = serializers.PrimaryKeyRelatedField(read_only=True)
 
     class Meta:
@@ -45,7 +84,23 @@ class ReviewSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError('Рейтинг может быть от 1 до 5')
         return rating
 
+    @transaction.atomic
     def create(self, validated_data):
         request = self.context.get('request')
         validated_data['author'] = request.user
-        return super().create(validated_data)
+        review = super().create(validated_data)
+        Product.update_rating(review.product_id, 1, review.rating)
+        return review
+
+    @transaction.atomic
+    def update(self, instance, validated_data):
+        old_product_id = instance.product_id
+        old_rating = instance.rating
+        review = super().update(instance, validated_data)
+        if review.product_id != old_product_id:
+            Product.update_rating(old_product_id, -1, -old_rating)
+            Product.update_rating(review.product_id, 1, review.rating)
+        elif review.rating != old_rating:
+            Product.update_rating(review.product_id, 0,
+                                  review.rating - old_rating)
+        return review
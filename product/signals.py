@@ -0,0 +1,54 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from product.cache import invalidate_catalog
+from product.models import Product, ProductReview
+from product.search import get_search_backend
+from product.tasks import generate_image_variants
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, **kwargs):
+    get_search_backend().index(Product.objects.filter(pk=instance.pk))
+
+
+@receiver(post_delete, sender=Product)
+def remove_product_from_index(sender, instance, **kwargs):
+    get_search_backend().remove([instance.pk])
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=ProductReview)
+@receiver(post_delete, sender=ProductReview)
+def invalidate_catalog_cache(sender, **kwargs):
+    invalidate_catalog()
+
+
+def _image_name(instance):
+    # не трогаем instance.image, чтобы не загружать отложенное поле
+    value = instance.__dict__.get('image')
+    return getattr(value, 'name', value) or ''
+
+
+@receiver(post_init, sender=Product)
+def remember_image(sender, instance, **kwargs):
+    if 'image' in instance.__dict__:
+        instance._original_image = _image_name(instance)
+
+
+@receiver(post_save, sender=Product)
+def schedule_image_variants(sender, instance, raw=False, **kwargs):
+    if raw or 'image' not in instance.__dict__:
+        return
+    name = _image_name(instance)
+    if name == getattr(instance, '_original_image', ''):
+        return
+    instance._original_image = name
+    Product.objects.filter(pk=instance.pk).update(image_variants={})
+    if name:
+        transaction.on_commit(partial(generate_image_variants.delay,
+                                      instance.pk))
@@ -0,0 +1,63 @@
+import hashlib
+from io import BytesIO
+
+from celery import shared_task
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db.models.functions import Now
+from PIL import Image, ImageOps
+
+from product.cache import invalidate_catalog
+from product.models import Product
+
+# название: максимальная сторона в пикселях
+IMAGE_SIZES = getattr(settings, 'PRODUCT_IMAGE_SIZES',
+                      {'thumb': 200, 'medium': 800})
+IMAGE_FORMATS = {
+    'jpeg': ('JPEG', 'jpg', {'quality': 85, 'optimize': True}),
+    'webp': ('WEBP', 'webp', {'quality': 80, 'method': 4}),
+}
+
+
+def save_content_addressed(content, extension):
+    """Сохраняет файл под именем из sha256 содержимого,
+    одинаковые картинки хранятся один раз"""
+    digest = hashlib.sha256(content).hexdigest()
+    path = f'products/variants/{digest[:2]}/{digest}.{extension}'
+    if not default_storage.exists(path):
+        path = default_storage.save(path, ContentFile(content))
+    return path
+
+
+def build_image_variants(fileobj):
+    image = ImageOps.exif_transpose(Image.open(fileobj))
+    variants = {}
+    for name, size in IMAGE_SIZES.items():
+        resized = image.copy()
+        resized.thumbnail((size, size), Image.LANCZOS)
+        variants[name] = {}
+        for fmt, (pil_format, extension, options) in IMAGE_FORMATS.items():
+            converted = resized
+            if pil_format == 'JPEG' and resized.mode != 'RGB':
+                converted = resized.convert('RGB')
+            buffer = BytesIO()
+            converted.save(buffer, pil_format, **options)
+            variants[name][fmt] = save_content_addressed(buffer.getvalue(),
+                                                         extension)
+    return variants
+
+
+@shared_task
+def generate_image_variants(product_id):
+    product = Product.objects.filter(pk=product_id).only('image').first()
+    if product is None or not product.image:
+        return
+    with product.image.open('rb') as image:
+        variants = build_image_variants(image)
+    # картинку могли заменить, пока шла обработка
+    updated = Product.objects.filter(
+        pk=product_id, image=product.image.name
+    ).update(image_variants=variants, updated_at=Now())
+    if updated:
+        invalidate_catalog()
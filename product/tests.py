@@ -20,16 +20,37 @@ from django.test import TestCase
 # assert factorial(num1) == expected_value
 # assert factorial(9) == 326880
 
+import csv
+import gzip
+import json
+import os
+import shutil
+import tempfile
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from PIL import Image
 from rest_framework.authtoken.models import Token
 from rest_framework.test import APIClient, APITestCase
+from shop.pagination import KeysetPagination
+from shop.testing import QueryBudgetMixin, eager_celery
 from .models import Product, ProductReview
+from .views import ProductViewSet
 
 User = get_user_model()
 
 
-class TestProducts(TestCase):
+class TestProducts(QueryBudgetMixin, TestCase):
     def setUp(self) -> None:
         self.user = User.objects.create_user('test1@gmail.com',
                                              'qwerty',
@@ -66,6 +87,25 @@ class TestProducts(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(len(response.data['results']), 4)
 
+    def test_catalog_throttling(self):
+        cache.clear()
+        rates = {'catalog_user': '2/min'}
+        url = reverse('product-list')
+        client = APIClient()
+        with override_settings(REST_FRAMEWORK={
+            **settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': rates
+        }):
+            for _ in range(2):
+                self.assertEqual(client.get(url).status_code, 200)
+            response = client.get(url)
+            self.assertEqual(response.status_code, 429)
+            self.assertIn('Retry-After', response)
+            # у пользователя свой счётчик
+            client.credentials(
+                HTTP_AUTHORIZATION=f'Token {self.user_token.key}'
+            )
+            self.assertEqual(client.get(url).status_code, 200)
+
     def test_create_product_as_anonymous_user(self):
         client = APIClient()
         url = reverse('product-list')
@@ -171,6 +211,37 @@ class TestProducts(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(len(response.data['results']), 2)
 
+    def test_search_ranking(self):
+        Product.objects.create(title='Чехол', description='Для Samsung',
+                               price=1000)
+        client = APIClient()
+        url = reverse('product-list')
+        response = client.get(url, data={'search': 'samsung'})
+        self.assertEqual(response.status_code, 200)
+        titles = [item['title'] for item in response.data['results']]
+        self.assertEqual(titles, ['Samsung Galaxy S21', 'Чехол'])
+
+    def test_search_by_prefix_and_description(self):
+        client = APIClient()
+        url = reverse('product-list')
+        response = client.get(url, data={'search': 'крут iph'})
+        self.assertEqual(response.status_code, 200)
+        ids = [item['id'] for item in response.data['results']]
+        self.assertEqual(ids, [self.product1.id])
+
+    def test_search_index_is_updated(self):
+        self.product4.title = 'Redmi Note 10'
+        self.product4.save()
+        self.product1.delete()
+        client = APIClient()
+        url = reverse('product-list')
+        response = client.get(url, data={'search': 'redmi'})
+        self.assertEqual(len(response.data['results']), 1)
+        response = client.get(url, data={'search': 'xiaomi'})
+        self.assertEqual(len(response.data['results']), 0)
+        response = client.get(url, data={'search': 'apple'})
+        self.assertEqual(len(response.data['results']), 1)
+
     def test_ordering(self):
         client = APIClient()
         url = reverse('product-list')
@@ -180,8 +251,302 @@ class TestProducts(TestCase):
         first_id = response.data['results'][0]['id']
         self.assertEqual(first_id, self.product2.id)
 
+    def test_response_cache(self):
+        client = APIClient()
+        url = reverse('product-detail', args=(self.product2.id, ))
+        response = client.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        response = client.get(url)
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual(response.data['title'], self.product2.title)
+
+        list_url = reverse('product-list')
+        client.get(list_url, {'ordering': 'price', 'price_from': 1})
+        response = client.get(list_url, {'price_from': 1, 'ordering': 'price'})
+        self.assertEqual(response['X-Cache'], 'HIT')
+
+        client.credentials(HTTP_AUTHORIZATION=f'Token {self.admin_token.key}')
+        client.patch(url, {'price': '170000.00'})
+        response = client.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['price'], '170000.00')
+
+    def test_cache_stats(self):
+        client = APIClient()
+        url = reverse('product-cache-stats')
+        response = client.get(url)
+        self.assertEqual(response.status_code, 401)
+        client.credentials(HTTP_AUTHORIZATION=f'Token {self.admin_token.key}')
+        stats = client.get(url).data
+        client.get(reverse('product-list'))
+        client.get(reverse('product-list'))
+        new_stats = client.get(url).data
+        self.assertEqual(new_stats['hits'] - stats['hits'], 1)
+        self.assertEqual(new_stats['misses'] - stats['misses'], 1)
+
+    def test_conditional_get_details(self):
+        client = APIClient()
+        url = reverse('product-detail', args=(self.product1.id, ))
+        response = client.get(url)
+        etag = response['ETag']
+        self.assertIn('Last-Modified', response)
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(response.content, b'')
+
+        self.product1.price = 90000
+        self.product1.save()
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_conditional_get_list(self):
+        client = APIClient()
+        url = reverse('product-list')
+        response = client.get(url)
+        last_modified = response['Last-Modified']
+        response = client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+        response = client.get(url, {'ordering': 'price'},
+                              HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+
+        etag = response['ETag']
+        Product.objects.create(title='Nokia 3310', description='Кирпич',
+                               price=3000)
+        response = client.get(url, {'ordering': 'price'},
+                              HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    @eager_celery()
+    def test_image_variants(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+
+        buffer = BytesIO()
+        Image.new('RGB', (1600, 1200), 'red').save(buffer, 'JPEG')
+        image = SimpleUploadedFile('phone.jpg', buffer.getvalue(),
+                                   content_type='image/jpeg')
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {self.admin_token.key}')
+        url = reverse('product-detail', args=(self.product1.id, ))
+        with override_settings(MEDIA_ROOT=media_root), \
+                self.captureOnCommitCallbacks(execute=True):
+            response = client.patch(url, {'image': image},
+                                    format='multipart')
+        self.assertEqual(response.status_code, 200)
+
+        self.product1.refresh_from_db()
+        thumb = self.product1.image_variants['thumb']
+        self.assertTrue(thumb['webp'].endswith('.webp'))
+        with override_settings(MEDIA_ROOT=media_root):
+            with Image.open(f'{media_root}/{thumb["jpeg"]}') as variant:
+                self.assertEqual(variant.size, (200, 150))
+            response = client.get(url)
+        self.assertTrue(
+            response.data['image_variants']['medium']['webp'].startswith(
+                'http://testserver/media/products/variants/'
+            )
+        )
+
+    def test_import_products(self):
+        content = (
+            'title,description,price\n'
+            'Acer Aspire E15,Бюджетный ноутбук,18000\n'
+            'Apple Iphone 12,Крутой телефон,95000\n'
+            'Xiaomi Mi 11,Норм телефон,40000\n'
+            'Broken,Цена,-5\n'
+            ',Без названия,100\n'
+        ).encode()
+        file = SimpleUploadedFile('products.csv', content)
+        client = APIClient()
+        url = reverse('product-import-products')
+        response = client.post(url, {'file': file}, format='multipart')
+        self.assertEqual(response.status_code, 401)
+
+        client.credentials(HTTP_AUTHORIZATION=f'Token {self.admin_token.key}')
+        file.seek(0)
+        response = client.post(url, {'file': file}, format='multipart')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['created'], 1)
+        self.assertEqual(response.data['updated'], 1)
+        self.assertEqual(response.data['unchanged'], 1)
+        self.assertEqual(response.data['failed'], 2)
+        self.assertEqual([error['line'] for error in response.data['errors']],
+                         [5, 6])
+        self.assertIn('price', response.data['errors'][0]['errors'])
+        self.product1.refresh_from_db()
+        self.assertEqual(self.product1.price, 95000)
+
+        response = client.get(reverse('product-list'), {'search': 'aspire'})
+        self.assertEqual(len(response.data['results']), 1)
+
+    def test_import_products_command(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl',
+                                         delete=False) as file:
+            for i in range(7):
+                file.write(json.dumps({'title': f'Product {i}',
+                                       'description': 'Описание',
+                                       'price': f'{i}.50'}) + '\n')
+            file.write('{not json\n')
+        self.addCleanup(os.remove, file.name)
+        stdout, stderr = StringIO(), StringIO()
+        call_command('import_products', file.name, batch_size=3,
+                     stdout=stdout, stderr=stderr)
+        self.assertIn('Создано: 7', stdout.getvalue())
+        self.assertIn('Строка 8', stderr.getvalue())
+        self.assertEqual(Product.objects.get(title='Product 6').price,
+                         Decimal('6.50'))
+
+    def test_export_products(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {self.user_token.key}')
+        url = reverse('product-export')
+        self.assertEqual(client.get(url).status_code, 403)
+
+        client.credentials(HTTP_AUTHORIZATION=f'Token {self.admin_token.key}')
+        response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        rows = list(csv.DictReader(
+            b''.join(response.streaming_content).decode().splitlines()
+        ))
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(rows[0]['title'], self.product1.title)
+        self.assertEqual(rows[0]['price'], '100000.00')
+
+        response = client.get(url, {'type': 'ndjson', 'gzip': 1})
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        content = gzip.decompress(b''.join(response.streaming_content))
+        rows = [json.loads(line) for line in content.decode().splitlines()]
+        self.assertEqual([row['id'] for row in rows],
+                         [self.product1.id, self.product2.id,
+                          self.product3.id, self.product4.id])
+
+        response = client.get(url, {'type': 'xml'})
+        self.assertEqual(response.status_code, 400)
 
-class TestReviews(APITestCase):
+    def test_cursor_pagination(self):
+        for i in range(8):
+            Product.objects.create(title=f'Product {i}',
+                                   description='Телефон',
+                                   price=60000)
+        client = APIClient()
+        url = reverse('product-list')
+        response = client.get(url, data={'cursor': '', 'ordering': '-price'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 12)
+        self.assertIsNone(response.data['previous'])
+        ids = [item['id'] for item in response.data['results']]
+        pages = [ids]
+        while response.data['next']:
+            response = client.get(response.data['next'])
+            pages.append([item['id'] for item in response.data['results']])
+            ids += pages[-1]
+        expected = list(Product.objects.order_by('-price', '-id')
+                        .values_list('id', flat=True))
+        self.assertEqual(ids, expected)
+
+        response = client.get(response.data['previous'])
+        self.assertEqual([item['id'] for item in response.data['results']],
+                         pages[-2])
+
+    def test_cursor_pagination_without_count(self):
+        client = APIClient()
+        url = reverse('product-list')
+        response = client.get(url, data={'cursor': '', 'count': 0})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('count', response.data)
+        self.assertEqual(len(response.data['results']), 4)
+
+    def test_fast_list_matches_serializer(self):
+        Product.objects.create(title='Дробная цена', description='Тест',
+                               price=Decimal('99.9'))
+        Product.objects.filter(pk=self.product1.pk).update(
+            avg_rating=Decimal('4.67'), reviews_count=3
+        )
+        client = APIClient()
+        url = reverse('product-list')
+        for params in ({}, {'ordering': '-price'}, {'search': 'телефон'},
+                       {'cursor': '', 'ordering': 'avg_rating'}):
+            cache.clear()
+            fast = client.get(url, params)
+            cache.clear()
+            with mock.patch.object(ProductViewSet, 'fast_list', False):
+                slow = client.get(url, params)
+            self.assertEqual(fast.status_code, 200)
+            self.assertEqual(fast.content, slow.content)
+            if fast.data.get('next'):
+                cache.clear()
+                fast = client.get(fast.data['next'])
+                cache.clear()
+                with mock.patch.object(ProductViewSet, 'fast_list', False):
+                    slow = client.get(slow.data['next'])
+                self.assertEqual(fast.content, slow.content)
+
+    def test_sparse_fieldsets(self):
+        client = APIClient()
+        url = reverse('product-list')
+        response = client.get(url, {'fields': 'id,price'})
+        self.assertEqual(set(response.data['results'][0]), {'id', 'price'})
+
+        response = client.get(url, {'expand': 'description,image'})
+        self.assertEqual(set(response.data['results'][0]),
+                         {'id', 'title', 'price', 'avg_rating',
+                          'reviews_count', 'description', 'image'})
+        cache.clear()
+        with mock.patch.object(ProductViewSet, 'fast_list', False):
+            slow = client.get(url, {'expand': 'description,image'})
+        self.assertEqual(response.content, slow.content)
+
+        response = client.get(url, {'fields': 'id,secret'})
+        self.assertEqual(response.status_code, 400)
+
+        detail_url = reverse('product-detail', args=(self.product1.id, ))
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(detail_url, {'fields': 'id,price'})
+        self.assertEqual(response.data, {'id': self.product1.id,
+                                         'price': '100000.00'})
+        selects = [query['sql'] for query in queries
+                   if 'product_product' in query['sql']]
+        self.assertTrue(selects)
+        for sql in selects:
+            self.assertNotIn('description', sql)
+
+    def test_list_query_budget(self):
+        def create(n):
+            for _ in range(n):
+                title = f'Budget {Product.objects.count()}'
+                Product.objects.create(title=title, description='Тест',
+                                       price=2000000)
+
+        url = reverse('product-list')
+        params = {'price_from': 1000000, 'expand': 'image,image_variants'}
+        for fast_list in (True, False):
+            Product.objects.filter(price__gte=1000000).delete()
+            with mock.patch.object(ProductViewSet, 'fast_list', fast_list):
+                self.assertQueryBudget(APIClient(), url, create,
+                                       max_queries=2, params=params)
+
+    def test_invalid_cursor(self):
+        client = APIClient()
+        url = reverse('product-list')
+        response = client.get(url, data={'cursor': 'qwerty'})
+        self.assertEqual(response.status_code, 404)
+        # курсор декодируется, но значения не того типа
+        for position in (['100', 'zz'], ['abc', 1], [[], 1]):
+            cursor = KeysetPagination().encode_cursor(position, False)
+            response = client.get(url, data={'cursor': cursor,
+                                             'ordering': 'price'})
+            self.assertEqual(response.status_code, 404)
+        cursor = KeysetPagination().encode_cursor(['100', 1], False)
+        response = client.get(url, data={'cursor': cursor,
+                                         'ordering': 'price'})
+        self.assertEqual(response.status_code, 200)
+
+
+class TestReviews(QueryBudgetMixin, APITestCase):
     def setUp(self) -> None:
         self.user = User.objects.create_user('test1@gmail.com',
                                              'qwerty',
@@ -287,6 +652,21 @@ class TestReviews(APITestCase):
         self.assertEqual(response.status_code, 201)
         self.assertIn('rating', response.data)
 
+    def test_create_with_idempotency_key(self):
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Token {self.user2_token.key}'
+        )
+        url = reverse('productreview-list')
+        first = self.client.post(url, self.payload,
+                                 HTTP_IDEMPOTENCY_KEY='review-1')
+        second = self.client.post(url, self.payload,
+                                  HTTP_IDEMPOTENCY_KEY='review-1')
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(second.status_code, 201)
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(ProductReview.objects.filter(author=self.user2)
+                         .count(), 1)
+
     def test_update_as_anonymous_user(self):
         client = self.client_class()
         url = reverse('productreview-detail', args=(self.review1.id, ))
@@ -320,6 +700,130 @@ class TestReviews(APITestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual('new_text', response.data['text'])
 
+    def test_rating_aggregates(self):
+        client = self.client_class()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {self.user_token.key}')
+        response = client.post(reverse('productreview-list'), self.payload)
+        self.assertEqual(response.status_code, 201)
+        client.credentials(HTTP_AUTHORIZATION=f'Token {self.user2_token.key}')
+        data = self.payload.copy()
+        data['rating'] = 5
+        response = client.post(reverse('productreview-list'), data)
+        review_id = response.data['id']
+        self.product3.refresh_from_db()
+        self.assertEqual(self.product3.reviews_count, 2)
+        self.assertEqual(str(self.product3.avg_rating), '4.50')
+
+        url = reverse('productreview-detail', args=(review_id, ))
+        client.patch(url, {'rating': 1})
+        self.product3.refresh_from_db()
+        self.assertEqual(str(self.product3.avg_rating), '2.50')
+
+        client.delete(url)
+        self.product3.refresh_from_db()
+        self.assertEqual(self.product3.reviews_count, 1)
+        self.assertEqual(str(self.product3.avg_rating), '4.00')
+
+        url = reverse('product-detail', args=(self.product3.id, ))
+        response = client.get(url)
+        self.assertEqual(response.data['avg_rating'], '4.00')
+        self.assertEqual(response.data['reviews_count'], 1)
+
+    def test_delete_last_review(self):
+        client = self.client_class()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {self.user_token.key}')
+        response = client.post(reverse('productreview-list'), self.payload)
+        url = reverse('productreview-detail', args=(response.data['id'], ))
+        client.delete(url)
+        self.product3.refresh_from_db()
+        self.assertEqual(self.product3.reviews_count, 0)
+        self.assertEqual(str(self.product3.avg_rating), '0.00')
+
+    def test_product_reviews_pagination(self):
+        users = [User.objects.create_user(f'user{i}@gmail.com', 'qwerty',
+                                          name=f'User{i}', is_active=True)
+                 for i in range(6)]
+        for i, user in enumerate(users):
+            ProductReview.objects.create(product=self.product1, author=user,
+                                         text='text', rating=i % 2 + 4)
+        url = reverse('product-reviews', args=(self.product1.id, ))
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('count', response.data)
+        ids = [item['id'] for item in response.data['results']]
+        self.assertEqual(len(ids), 5)
+        response = self.client.get(response.data['next'])
+        ids += [item['id'] for item in response.data['results']]
+        self.assertIsNone(response.data['next'])
+        expected = self.product1.reviews.order_by('-created_at', '-id')
+        self.assertEqual(ids, [review.id for review in expected])
+
+        response = self.client.get(url, {'rating': 5})
+        ratings = {item['rating'] for item in response.data['results']}
+        self.assertEqual(ratings, {5})
+        self.assertEqual(len(response.data['results']), 3)
+
+    def test_product_reviews_sparse_fieldsets(self):
+        url = reverse('product-reviews', args=(self.product1.id, ))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {'fields': 'id,rating'})
+        self.assertEqual(response.data['results'],
+                         [{'id': self.review1.id, 'rating': 3}])
+        sql = queries[-1]['sql']
+        self.assertIn('product_productreview', sql)
+        self.assertNotIn('text', sql)
+
+    def test_product_reviews_query_budget(self):
+        def create(n):
+            for _ in range(n):
+                user = User.objects.create_user(
+                    f'budget{User.objects.count()}@gmail.com', 'qwerty',
+                    name='Budget', is_active=True
+                )
+                ProductReview.objects.create(product=self.product3,
+                                             author=user, text='text',
+                                             rating=5)
+
+        url = reverse('product-reviews', args=(self.product3.id, ))
+        self.assertQueryBudget(self.client, url, create, max_queries=3)
+
+    def test_product_reviews_conditional_get(self):
+        url = reverse('product-reviews', args=(self.product1.id, ))
+        response = self.client.get(url)
+        etag = response['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.review1.text = 'new_text'
+        self.review1.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_product_reviews_invalid_rating_filter(self):
+        url = reverse('product-reviews', args=(self.product1.id, ))
+        response = self.client.get(url, {'rating': 'abc'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_export_reviews_command(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'reviews.ndjson')
+            call_command('export_catalog', 'reviews', type='ndjson',
+                         output=path)
+            with open(path) as file:
+                rows = [json.loads(line) for line in file]
+        self.assertEqual([row['rating'] for row in rows], [3, 5])
+        self.assertEqual(rows[0]['author_id'], self.user.email)
+
+    def test_rebuild_ratings_and_ordering(self):
+        # отзывы из setUp созданы в обход API, агрегаты не заполнены
+        call_command('rebuild_ratings', batch_size=2, stdout=StringIO())
+        self.product2.refresh_from_db()
+        self.assertEqual(self.product2.reviews_count, 1)
+        self.assertEqual(str(self.product2.avg_rating), '5.00')
+        response = self.client.get(reverse('product-list'),
+                                   {'ordering': '-avg_rating'})
+        ids = [item['id'] for item in response.data['results'][:2]]
+        self.assertEqual(ids, [self.product2.id, self.product1.id])
+
 
 
 
@@ -1,7 +1,13 @@
+import codecs
+import os
+
+from django.db import transaction
 from django.http import HttpResponse
 from django.views import View
 from rest_framework import viewsets, mixins
 from rest_framework.decorators import api_view, action
+from rest_framework.parsers import MultiPartParser
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.generics import ListAPIView, RetrieveAPIView, \
@@ -10,8 +16,18 @@ from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from django_filters import rest_framework as filters
 from rest_framework import filters as rest_filters
 
+from product.cache import CatalogCacheMixin, get_cache_stats
+from product.exports import products_export, reviews_export
+from product.importers import READERS, ProductImporter
 from product.models import Product, ProductReview
 from product.permissions import IsAuthorOrIsAdmin
+from product.search import ProductSearchFilter
+from shop.fastpath import FastListMixin
+from shop.fieldsets import SparseFieldsMixin, only_serializer_fields
+from shop.idempotency import IdempotentCreateMixin
+from shop.pagination import KeysetPagination
+from shop.streaming import export_from_request
+from shop.throttling import UserSlidingWindowThrottle
 from product.serializers import (ProductSerializer, ProductDetailsSerializer,
                                  CreateProductSerializer, ReviewSerializer)
 
@@ -66,15 +82,29 @@ class ProductFilter(filters.FilterSet):
         fields = ('price_from', 'price_to')
 
 
-class ProductViewSet(viewsets.ModelViewSet):
+class ReviewFilter(filters.FilterSet):
+    class Meta:
+        model = ProductReview
+        fields = ('rating', )
+
+
+class ReviewPagination(KeysetPagination):
+    keyset_only = True
+    include_count = False
+
+
+class ProductViewSet(CatalogCacheMixin, FastListMixin, SparseFieldsMixin,
+                     viewsets.ModelViewSet):
     queryset = Product.objects.all()
     filter_backends = [filters.DjangoFilterBackend,
-                       rest_filters.SearchFilter,
+                       ProductSearchFilter,
                        rest_filters.OrderingFilter]
     # filterset_fields = ('price')
     filterset_class = ProductFilter
     search_fields = ['title', 'description']
-    ordering_fields = ['title', 'price']
+    ordering_fields = ['title', 'price', 'avg_rating', 'reviews_count']
+    throttle_scope = 'catalog'
+    throttle_classes = [UserSlidingWindowThrottle]
 
     # api/v1/products/
     # api/v1/products/?price_from=10000&price_to=15000
@@ -96,41 +126,95 @@ class ProductViewSet(viewsets.ModelViewSet):
         return CreateProductSerializer
 
     def get_permissions(self):
-        if self.action in ['create', 'update', 'partial_update', 'destroy']:
+        if self.action in ['create', 'update', 'partial_update', 'destroy',
+                           'cache_stats', 'import_products', 'export']:
             return [IsAdminUser()]
         return []
 
+    @action(['GET'], detail=False)
+    def cache_stats(self, request):
+        return Response(get_cache_stats())
+
+    # api/v1/products/export/?type=ndjson&gzip=1
+    @action(['GET'], detail=False)
+    def export(self, request):
+        return export_from_request(request, {'products': products_export})
+
+    # api/v1/products/import/ (multipart: file, format=csv|jsonl)
+    @action(['POST'], detail=False, url_path='import',
+            parser_classes=[MultiPartParser])
+    def import_products(self, request):
+        file = request.FILES.get('file')
+        if file is None:
+            raise ValidationError({'file': 'Файл обязателен'})
+        fmt = request.data.get('format') or \
+            os.path.splitext(file.name)[1].lstrip('.')
+        if fmt not in READERS:
+            raise ValidationError({'format': 'Поддерживаются csv и jsonl'})
+        # UploadedFile читается построчно, весь файл в память не грузится
+        lines = codecs.iterdecode(file, 'utf-8-sig')
+        report = ProductImporter().run(READERS[fmt](lines))
+        return Response(report.as_dict(), status=200)
+
+    # api/v1/products/1/reviews/?rating=5&cursor=...
     @action(['GET'], detail=True)
     def reviews(self, request, pk=None):
+        return self.conditional_response(self.get_reviews_response,
+                                         request, pk=pk)
+
+    def get_reviews_response(self, request, pk=None):
         product = self.get_object()
-        # reviews = ProductReview.objects.filter(product=product)
-        reviews = product.reviews.all()
+        # не product.reviews: related manager читает product_id у каждой
+        # строки, а с ?fields= эта колонка может быть не загружена
+        reviews = ProductReview.objects.filter(product=product)
+        reviews = reviews.order_by('-created_at')
+        filterset = ReviewFilter(request.query_params, queryset=reviews)
+        if not filterset.is_valid():
+            raise ValidationError(filterset.errors)
+        context = self.get_serializer_context()
+        queryset = only_serializer_fields(filterset.qs,
+                                          ReviewSerializer(context=context))
+        paginator = ReviewPagination()
+        page = paginator.paginate_queryset(queryset, request, view=self)
         # [review1, review2]
-        serializer = ReviewSerializer(reviews, many=True)
+        serializer = ReviewSerializer(page, many=True, context=context)
         # [{}, {}]
-        return Response(serializer.data, status=200)
+        return paginator.get_paginated_response(serializer.data)
 
 
 # CRUD(Create,  Retrieve,    Update,     Delete)
 #        POST     GET      PUT, PATCH    DELETE
 
 
-class ReviewViewSet(mixins.CreateModelMixin,
+class ReviewViewSet(IdempotentCreateMixin,
+                    mixins.CreateModelMixin,
                     mixins.UpdateModelMixin,
                     mixins.DestroyModelMixin,
                     viewsets.GenericViewSet):
     queryset = ProductReview.objects.all()
     serializer_class = ReviewSerializer
+    throttle_scope = 'catalog'
+    throttle_classes = [UserSlidingWindowThrottle]
 
     def get_permissions(self):
         if self.action == 'create':
             return [IsAuthenticated()]
         elif self.action in ['update', 'partial_update', 'destroy']:
             return [IsAuthenticated(), IsAuthorOrIsAdmin()]
+        elif self.action == 'export':
+            return [IsAdminUser()]
         return []
 
+    @action(['GET'], detail=False)
+    def export(self, request):
+        return export_from_request(request, {'reviews': reviews_export})
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        instance.delete()
+        Product.update_rating(instance.product_id, -1, -instance.rating)
+
 
-#TODO: ограничение количества запросов
 #TODO: тесты
 #TODO: документация
 #TODO: README
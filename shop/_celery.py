@@ -13,6 +13,20 @@ app.conf.beat_schedule = {
     'notify_user': {
         'task': 'account.tasks.notify_user',
         'schedule': crontab()
+    },
+    'update_sales_rollups': {
+        'task': 'order.tasks.update_sales_rollups',
+        'schedule': crontab(minute='*/5')
+    },
+    # подбирает заказы, если задача после POST не дошла до воркера
+    'drain_order_intake': {
+        'task': 'order.tasks.drain_order_intake',
+        'schedule': crontab()
+    },
+    # повторные попытки писем, отложенных после ошибки
+    'drain_outbox': {
+        'task': 'account.tasks.drain_outbox',
+        'schedule': crontab()
     }
 }
 app.conf.timezone = 'UTC'
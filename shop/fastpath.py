@@ -0,0 +1,223 @@
+import decimal
+from datetime import datetime
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import F, OrderBy
+from rest_framework import ISO_8601, serializers
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+
+
+class NotCompilable(Exception):
+    pass
+
+
+def _decimal_converter(field, model_field):
+    coerce_to_string = getattr(field, 'coerce_to_string',
+                               api_settings.COERCE_DECIMAL_TO_STRING)
+    if not coerce_to_string or field.localize or field.decimal_places is None \
+            or getattr(field, 'normalize_output', False):
+        return field.to_representation
+    exponent = decimal.Decimal('.1') ** field.decimal_places
+    rounding = field.rounding
+    context = decimal.getcontext().copy()
+    if field.max_digits is not None:
+        context.prec = field.max_digits
+
+    def convert(value):
+        if value.__class__ is not decimal.Decimal:
+            value = decimal.Decimal(str(value).strip())
+        return '{:f}'.format(value.quantize(exponent, rounding=rounding,
+                                            context=context))
+    return convert
+
+
+def _datetime_converter(field, model_field):
+    output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+    field_timezone = getattr(field, 'timezone', None) or \
+        field.default_timezone()
+    if output_format is None or output_format.lower() != ISO_8601 \
+            or field_timezone is None:
+        return field.to_representation
+
+    def convert(value):
+        if value.__class__ is not datetime or value.tzinfo is None:
+            return field.to_representation(value)
+        value = value.astimezone(field_timezone).isoformat()
+        if value.endswith('+00:00'):
+            value = value[:-6] + 'Z'
+        return value
+    return convert
+
+
+def _file_converter(field, model_field):
+    if not getattr(field, 'use_url', api_settings.UPLOADED_FILES_USE_URL):
+        return lambda name: name or None
+    storage = model_field.storage
+    request = field.context.get('request')
+
+    def convert(name):
+        if not name:
+            return None
+        url = storage.url(name)
+        if request is not None:
+            return request.build_absolute_uri(url)
+        return url
+    return convert
+
+
+# только точные типы: у наследников может быть свой to_representation
+CONVERTERS = {
+    serializers.IntegerField: lambda field, model_field: int,
+    serializers.CharField: lambda field, model_field: str,
+    serializers.ReadOnlyField: lambda field, model_field: None,
+    serializers.DecimalField: _decimal_converter,
+    serializers.DateTimeField: _datetime_converter,
+    serializers.FileField: _file_converter,
+    serializers.ImageField: _file_converter,
+}
+
+
+def get_ordering_columns(queryset):
+    order_by = queryset.query.order_by
+    if not order_by and queryset.query.default_ordering:
+        order_by = queryset.model._meta.ordering
+    columns = []
+    for item in order_by:
+        if isinstance(item, OrderBy) and isinstance(item.expression, F):
+            item = item.expression.name
+        if isinstance(item, str) and item.lstrip('-') not in ('?', 'pk'):
+            columns.append(item.lstrip('-'))
+    return columns
+
+
+class CompiledSerializer:
+    """
+    Сериализатор для чтения списков без объектов модели:
+    строки берутся через values_list(), каждое поле превращается
+    заранее подготовленной функцией. Результат совпадает с обычным
+    сериализатором; если поле не поддерживается - NotCompilable.
+    """
+    def __init__(self, serializer):
+        self.model = serializer.Meta.model
+        self.columns = [self.model._meta.pk.attname]
+        # (имя, номер колонки, функция или вложенный CompiledSerializer)
+        self.fields = []
+        self.nested = []
+        for name, field in serializer.fields.items():
+            if not field.write_only:
+                self.fields.append(self.compile_field(name, field))
+
+    def add_column(self, column):
+        if column not in self.columns:
+            self.columns.append(column)
+        return self.columns.index(column)
+
+    def get_model_field(self, field):
+        if field.source == 'pk':
+            return self.model._meta.pk
+        if len(field.source_attrs) != 1:
+            raise NotCompilable(field.source)
+        try:
+            return self.model._meta.get_field(field.source)
+        except FieldDoesNotExist:
+            raise NotCompilable(field.source)
+
+    def compile_field(self, name, field):
+        model_field = self.get_model_field(field)
+        if isinstance(field, serializers.ListSerializer):
+            if not (model_field.one_to_many and model_field.auto_created):
+                raise NotCompilable(field.source)
+            compiled = CompiledSerializer(field.child)
+            self.nested.append((name, compiled, model_field.field))
+            return name, 0, compiled
+        if isinstance(field, serializers.BaseSerializer) or \
+                not model_field.concrete or model_field.many_to_many:
+            raise NotCompilable(field.source)
+
+        if isinstance(field, serializers.PrimaryKeyRelatedField):
+            if not model_field.is_relation:
+                raise NotCompilable(field.source)
+            convert = field.pk_field.to_representation \
+                if field.pk_field is not None else None
+        elif isinstance(field, (serializers.RelatedField,
+                                serializers.ManyRelatedField)):
+            raise NotCompilable(field.source)
+        elif type(field) in CONVERTERS:
+            convert = CONVERTERS[type(field)](field, model_field)
+        else:
+            convert = field.to_representation
+        return name, self.add_column(model_field.attname), convert
+
+    def values_list(self, queryset):
+        # колонки сортировки нужны keyset-пагинации для курсора
+        for column in get_ordering_columns(queryset):
+            self.add_column(column)
+        return queryset.prefetch_related(None).values_list(*self.columns,
+                                                           named=True)
+
+    def render_related(self, relation, ids):
+        queryset = self.model._default_manager.filter(
+            **{f'{relation.name}__in': ids}
+        )
+        queryset = queryset.order_by(*(self.model._meta.ordering or ['pk']))
+        index = self.add_column(relation.attname)
+        rows = list(queryset.values_list(*self.columns))
+        groups = {}
+        for row, item in zip(rows, self.render(rows)):
+            groups.setdefault(row[index], []).append(item)
+        return groups
+
+    def render(self, rows):
+        rows = list(rows)
+        groups = {}
+        if self.nested and rows:
+            ids = [row[0] for row in rows]
+            for name, compiled, relation in self.nested:
+                groups[name] = compiled.render_related(relation, ids)
+
+        fields = []
+        for name, index, convert in self.fields:
+            if isinstance(convert, CompiledSerializer):
+                convert = lambda pk, group=groups.get(name, {}): \
+                    group.get(pk) or []
+            fields.append((name, index, convert))
+
+        data = []
+        for row in rows:
+            item = {}
+            for name, index, convert in fields:
+                value = row[index]
+                if value is not None and convert is not None:
+                    value = convert(value)
+                item[name] = value
+            data.append(item)
+        return data
+
+
+class FastListMixin:
+    """
+    list() через CompiledSerializer. Если сериализатор
+    не компилируется, работает обычный путь DRF.
+    """
+    fast_list = True
+
+    def get_compiled_serializer(self):
+        if not self.fast_list:
+            return None
+        try:
+            return CompiledSerializer(self.get_serializer())
+        except NotCompilable:
+            return None
+
+    def list(self, request, *args, **kwargs):
+        compiled = self.get_compiled_serializer()
+        if compiled is None:
+            return super().list(request, *args, **kwargs)
+        queryset = compiled.values_list(
+            self.filter_queryset(self.get_queryset())
+        )
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(compiled.render(page))
+        return Response(compiled.render(queryset))
@@ -0,0 +1,114 @@
+from collections import OrderedDict
+
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.serializers import ListSerializer
+
+from shop.fastpath import get_ordering_columns
+
+
+def _parse_names(value):
+    return [name.strip() for name in (value or '').split(',') if name.strip()]
+
+
+class DynamicFieldsMixin:
+    """
+    Миксин сериализатора:
+    ?fields=id,price - в ответе только перечисленные поля,
+    ?expand=image - добавить поля из Meta.expandable_fields,
+    которых по умолчанию в ответе нет.
+    """
+    fields_query_param = 'fields'
+    expand_query_param = 'expand'
+
+    def is_root_serializer(self):
+        parent = self.parent
+        return parent is None or \
+            (isinstance(parent, ListSerializer) and parent.parent is None)
+
+    def get_fields(self):
+        fields = super().get_fields()
+        requested, expand = [], []
+        request = self.context.get('request')
+        if request is not None and request.method in SAFE_METHODS and \
+                self.is_root_serializer():
+            requested = _parse_names(
+                request.query_params.get(self.fields_query_param)
+            )
+            expand = _parse_names(
+                request.query_params.get(self.expand_query_param)
+            )
+        for param, names in ((self.fields_query_param, requested),
+                             (self.expand_query_param, expand)):
+            unknown = [name for name in names if name not in fields]
+            if unknown:
+                raise ValidationError(
+                    {param: f'Неизвестные поля: {", ".join(unknown)}'}
+                )
+
+        if requested:
+            keep = set(requested)
+        else:
+            expandable = getattr(self.Meta, 'expandable_fields', ())
+            keep = set(fields).difference(expandable).union(expand)
+        return OrderedDict((name, field) for name, field in fields.items()
+                           if name in keep)
+
+
+def get_serializer_columns(serializer):
+    """
+    Поля модели, которые читает сериализатор, или None,
+    если это нельзя определить (SerializerMethodField, source='*')
+    """
+    if isinstance(serializer, ListSerializer):
+        serializer = serializer.child
+    opts = serializer.Meta.model._meta
+    columns = {opts.pk.name}
+    for field in serializer.fields.values():
+        if field.write_only:
+            continue
+        if field.source == '*' or not field.source_attrs:
+            return None
+        name = field.source_attrs[0]
+        if name == 'pk':
+            continue
+        try:
+            model_field = opts.get_field(name)
+        except FieldDoesNotExist:
+            return None
+        if model_field.concrete and not model_field.many_to_many:
+            columns.add(model_field.name)
+        elif not model_field.is_relation:
+            return None
+        # обратные связи и m2m загружаются отдельными запросами
+    return columns
+
+
+def only_serializer_fields(queryset, serializer):
+    """Загружает из БД только колонки, нужные сериализатору"""
+    columns = get_serializer_columns(serializer)
+    if columns is None:
+        return queryset
+    opts = queryset.model._meta
+    # поля сортировки читает keyset-пагинация
+    for name in get_ordering_columns(queryset):
+        name = name.split('__')[0]
+        try:
+            if opts.get_field(name).concrete:
+                columns.add(name)
+        except FieldDoesNotExist:
+            pass
+    return queryset.only(*columns)
+
+
+class SparseFieldsMixin:
+    """
+    Миксин представления: сужает queryset до колонок, которые
+    остались в сериализаторе после ?fields= / ?expand=
+    """
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if self.request.method in SAFE_METHODS:
+            queryset = only_serializer_fields(queryset, self.get_serializer())
+        return queryset
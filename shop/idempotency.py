@@ -0,0 +1,141 @@
+import hashlib
+import json
+import time
+from datetime import timedelta
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+from rest_framework.response import Response
+
+HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+MAX_KEY_LENGTH = 255
+
+
+class IdempotencyKeyReused(APIException):
+    status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+    default_detail = 'Ключ идемпотентности уже использован с другим запросом'
+    default_code = 'idempotency_key_reused'
+
+
+class IdempotencyKeyInProgress(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'Запрос с этим ключом идемпотентности ещё выполняется'
+    default_code = 'idempotency_key_in_progress'
+
+
+def get_ttl():
+    return getattr(settings, 'IDEMPOTENCY_TTL', 60 * 60 * 24)
+
+
+def get_request_fingerprint(request):
+    data = json.dumps(request.data, sort_keys=True, default=str)
+    value = f'{request.method}:{request.path}:{data}'
+    return hashlib.sha256(value.encode()).hexdigest()
+
+
+def replay(stored_fingerprint, fingerprint, status_code, body):
+    if stored_fingerprint != fingerprint:
+        raise IdempotencyKeyReused()
+    return Response(body, status=status_code,
+                    headers={REPLAYED_HEADER: 'true'})
+
+
+class DatabaseIdempotencyStore:
+    """
+    Ответы в таблице IdempotencyRecord. Строка ключа блокируется
+    select_for_update до конца обработки, поэтому параллельный
+    запрос с тем же ключом ждёт и получает сохранённый ответ.
+    """
+    def run(self, user_id, key, fingerprint, handler):
+        from order.models import IdempotencyRecord
+
+        now = timezone.now()
+        expires_at = now + timedelta(seconds=get_ttl())
+        with transaction.atomic():
+            record, created = IdempotencyRecord.objects.select_for_update() \
+                .get_or_create(user_id=user_id, key=key,
+                               defaults={'fingerprint': fingerprint,
+                                         'expires_at': expires_at})
+            if not created:
+                if record.expires_at > now and record.status_code is not None:
+                    return replay(record.fingerprint, fingerprint,
+                                  record.status_code, record.body)
+                # просроченный ключ можно использовать заново
+                record.fingerprint = fingerprint
+                record.expires_at = expires_at
+            response = handler()
+            record.status_code = response.status_code
+            record.body = response.data
+            record.save()
+        return response
+
+
+class CacheIdempotencyStore:
+    """
+    Ответы в кэше Django с TTL. Параллельные запросы упорядочиваются
+    блокировкой через cache.add(), остальные ждут её снятия.
+    """
+    lock_timeout = 30
+    poll_interval = 0.05
+
+    def run(self, user_id, key, fingerprint, handler):
+        digest = hashlib.sha256(f'{user_id}:{key}'.encode()).hexdigest()
+        result_key = f'idempotency:{digest}'
+        lock_key = f'idempotency:lock:{digest}'
+
+        deadline = time.monotonic() + self.lock_timeout
+        while not cache.add(lock_key, 1, self.lock_timeout):
+            stored = cache.get(result_key)
+            if stored is not None:
+                return replay(fingerprint=fingerprint, **stored)
+            if time.monotonic() > deadline:
+                raise IdempotencyKeyInProgress()
+            time.sleep(self.poll_interval)
+
+        try:
+            stored = cache.get(result_key)
+            if stored is not None:
+                return replay(fingerprint=fingerprint, **stored)
+            response = handler()
+            cache.set(result_key, {'stored_fingerprint': fingerprint,
+                                   'status_code': response.status_code,
+                                   'body': response.data}, get_ttl())
+            return response
+        finally:
+            cache.delete(lock_key)
+
+
+STORES = {
+    'db': DatabaseIdempotencyStore,
+    'cache': CacheIdempotencyStore,
+}
+
+
+def get_idempotency_store():
+    return STORES[getattr(settings, 'IDEMPOTENCY_BACKEND', 'db')]()
+
+
+class IdempotentCreateMixin:
+    """
+    create() с заголовком Idempotency-Key: первый успешный ответ
+    на пару (пользователь, ключ) сохраняется, повторы получают его
+    без повторного создания объекта.
+    """
+    def create(self, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        handler = partial(super().create, request, *args, **kwargs)
+        if not key or not request.user.is_authenticated:
+            return handler()
+        if len(key) > MAX_KEY_LENGTH:
+            raise ValidationError(
+                {HEADER: f'Не длиннее {MAX_KEY_LENGTH} символов'}
+            )
+        return get_idempotency_store().run(request.user.pk, key,
+                                           get_request_fingerprint(request),
+                                           handler)
@@ -0,0 +1,224 @@
+import base64
+import binascii
+import json
+from collections import OrderedDict
+from datetime import date, datetime
+from decimal import Decimal
+
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.db.models import F, OrderBy, Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(PageNumberPagination):
+    """
+    Пагинация по ключу (keyset): вместо OFFSET следующая страница
+    выбирается условием WHERE (title, price, id) > (...) LIMIT n,
+    поэтому стоимость страницы не зависит от её номера.
+
+    Режим включается параметром ?cursor= (пустое значение - первая
+    страница), без него работает обычная PageNumberPagination.
+    ?count=0 отключает запрос COUNT(*).
+    """
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    # всегда использовать курсор, даже без ?cursor=
+    keyset_only = False
+    include_count = True
+    invalid_cursor_message = 'Неверный курсор'
+
+    keyset = False
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if not self.keyset_only and \
+                self.cursor_query_param not in request.query_params:
+            return super().paginate_queryset(queryset, request, view)
+
+        self.keyset = True
+        self.display_page_controls = False
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.ordering = self.get_ordering(queryset)
+        position, reverse = self.decode_cursor(request)
+        if position is not None:
+            position = self.parse_position(queryset, position)
+        self.count = queryset.count() if self.should_count(request) else None
+
+        order_by = []
+        for field, descending in self.ordering:
+            descending = descending != reverse
+            order_by.append(f'-{field}' if descending else field)
+        queryset = queryset.order_by(*order_by)
+        if position is not None:
+            queryset = queryset.filter(
+                self.get_keyset_filter(position, reverse)
+            )
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+            self.has_next = position is not None
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = position is not None
+        self.page = results
+        return results
+
+    def get_paginated_response(self, data):
+        if not self.keyset:
+            return super().get_paginated_response(data)
+        response = OrderedDict()
+        if self.count is not None:
+            response['count'] = self.count
+        response['next'] = self.get_next_link()
+        response['previous'] = self.get_previous_link()
+        response['results'] = data
+        return Response(response)
+
+    def get_next_link(self):
+        if not self.keyset:
+            return super().get_next_link()
+        if not self.has_next or not self.page:
+            return None
+        return self.build_link(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.keyset:
+            return super().get_previous_link()
+        if not self.has_previous or not self.page:
+            return None
+        return self.build_link(self.page[0], reverse=True)
+
+    def should_count(self, request):
+        value = request.query_params.get(self.count_query_param)
+        if value is None:
+            return self.include_count
+        return value.lower() not in ('0', 'false', 'no')
+
+    def get_ordering(self, queryset):
+        """
+        Возвращает список (поле, по убыванию) с id в конце,
+        чтобы порядок был однозначным при одинаковых значениях.
+        """
+        query = queryset.query
+        order_by = query.order_by
+        if not order_by and query.default_ordering:
+            order_by = queryset.model._meta.ordering
+        pk_name = queryset.model._meta.pk.name
+
+        ordering = []
+        for item in order_by:
+            if isinstance(item, str):
+                descending = item.startswith('-')
+                field = item.lstrip('-')
+            elif isinstance(item, OrderBy) and isinstance(item.expression, F):
+                descending = item.descending
+                field = item.expression.name
+            else:
+                raise ImproperlyConfigured(
+                    f'Keyset-пагинация не поддерживает сортировку {item!r}'
+                )
+            if field == 'pk':
+                field = pk_name
+            ordering.append((field, descending))
+            if field == pk_name:
+                return ordering
+
+        descending = ordering[-1][1] if ordering else False
+        ordering.append((pk_name, descending))
+        return ordering
+
+    def get_keyset_filter(self, position, reverse):
+        # (a, b, id) > (x, y, z) раскрывается в
+        # a > x OR (a = x AND b > y) OR (a = x AND b = y AND id > z)
+        condition = Q()
+        equal = Q()
+        for (field, descending), value in zip(self.ordering, position):
+            lookup = 'lt' if descending != reverse else 'gt'
+            condition |= equal & Q(**{f'{field}__{lookup}': value})
+            equal &= Q(**{field: value})
+        # отдельное условие по первому полю помогает планировщику
+        # использовать индекс
+        field, descending = self.ordering[0]
+        lookup = 'lte' if descending != reverse else 'gte'
+        return condition & Q(**{f'{field}__{lookup}': position[0]})
+
+    def parse_position(self, queryset, position):
+        # значения курсора приходят от клиента: приводим к типам полей,
+        # иначе подделанный курсор падает с 500 уже в запросе к БД
+        try:
+            return [self.get_field(queryset, field).to_python(value)
+                    for (field, _), value in zip(self.ordering, position)]
+        except (TypeError, ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    @staticmethod
+    def get_field(queryset, name):
+        annotation = queryset.query.annotations.get(name)
+        if annotation is not None:
+            return annotation.output_field
+        model = queryset.model
+        for attr in name.split('__'):
+            field = model._meta.get_field(attr)
+            model = field.related_model
+        return field
+
+    def get_position(self, item):
+        return [self.encode_value(self.get_value(item, field))
+                for field, _ in self.ordering]
+
+    @staticmethod
+    def get_value(item, field):
+        if isinstance(item, dict):
+            return item[field]
+        if isinstance(item, tuple):
+            # строка values_list(named=True)
+            return getattr(item, field)
+        for attr in field.split('__'):
+            item = getattr(item, attr)
+        return item
+
+    @staticmethod
+    def encode_value(value):
+        if isinstance(value, Decimal):
+            return str(value)
+        if isinstance(value, (datetime, date)):
+            return value.isoformat()
+        return value
+
+    def build_link(self, item, reverse):
+        cursor = self.encode_cursor(self.get_position(item), reverse)
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def encode_cursor(self, position, reverse):
+        payload = {'p': position}
+        if reverse:
+            payload['r'] = 1
+        data = json.dumps(payload, separators=(',', ':')).encode()
+        return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+    def decode_cursor(self, request):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None, False
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            payload = json.loads(base64.urlsafe_b64decode(padded))
+            position = payload['p']
+            reverse = bool(payload.get('r'))
+        except (TypeError, ValueError, KeyError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or \
+                len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return position, reverse
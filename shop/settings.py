@@ -97,6 +97,23 @@ DATABASES = {
 
 AUTH_USER_MODEL = 'account.User'
 
+# первый хэшер - для новых паролей; хэши остальных пересчитываются
+# им при успешном входе. Для argon2:
+# PASSWORD_HASHER=account.hashers.TunedArgon2PasswordHasher
+# и пакет argon2-cffi
+PASSWORD_HASHER = config('PASSWORD_HASHER',
+                         default='django.contrib.auth.hashers.'
+                                 'PBKDF2PasswordHasher')
+PASSWORD_HASHERS = [PASSWORD_HASHER] + [hasher for hasher in (
+    'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+    'account.hashers.TunedArgon2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+) if hasher != PASSWORD_HASHER]
+ARGON2_TIME_COST = 2
+ARGON2_MEMORY_COST = 102400
+ARGON2_PARALLELISM = 8
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -150,21 +167,58 @@ EMAIL_HOST_PASSWORD = config('EMAIL_HOST_PASSWORD')
 EMAIL_USE_TLS = config('EMAIL_USE_TLS', cast=bool)
 
 
+# В проде - Redis, например:
+# CACHE_BACKEND=django_redis.cache.RedisCache
+# CACHE_LOCATION=redis://localhost:6379/1
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND',
+                          default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default=''),
+    }
+}
+
+CATALOG_CACHE_TIMEOUT = 60 * 15
+
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication'
+        'account.authentication.CachedTokenAuthentication'
     ],
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
-    'PAGE_SIZE': 5
+    'DEFAULT_PAGINATION_CLASS': 'shop.pagination.KeysetPagination',
+    'PAGE_SIZE': 5,
+    # shop.throttling: '<throttle_scope>_<ip|user|email>'
+    'DEFAULT_THROTTLE_RATES': {
+        'login_ip': '20/min',
+        'login_email': '5/min',
+        'register_ip': '5/hour',
+        'register_email': '3/hour',
+        'activation_ip': '10/min',
+        'activation_email': '5/min',
+        'forgot_password_ip': '5/hour',
+        'forgot_password_email': '3/hour',
+        'forgot_password_complete_ip': '10/min',
+        'forgot_password_complete_email': '5/15m',
+        'catalog_user': '600/min',
+    }
 }
 
 
-CELERY_BROKER_URL = 'redis://localhost:6379'
-CELERY_RESULT_BACKEND = 'redis://localhost:6379'
+# для тестов без Redis: CELERY_BROKER_URL=memory:// и
+# CELERY_TASK_ALWAYS_EAGER=True
+CELERY_BROKER_URL = config('CELERY_BROKER_URL',
+                           default='redis://localhost:6379')
+CELERY_RESULT_BACKEND = config('CELERY_RESULT_BACKEND',
+                               default='redis://localhost:6379')
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'UTC'
+# задачи выполняются сразу в текущем процессе, без брокера
+CELERY_TASK_ALWAYS_EAGER = config('CELERY_TASK_ALWAYS_EAGER',
+                                  default=False,
+                                  cast=bool)
+CELERY_TASK_EAGER_PROPAGATES = True
 REDIS_HOST = 'localhost'
 REDIS_PORT = '6379'
 CELERYBEAT_SCHEDULE = {
@@ -172,4 +226,55 @@ CELERYBEAT_SCHEDULE = {
         'task': 'account.tasks.notify_user',
         'schedule': crontab()
     }
-}
\ No newline at end of file
+}
+
+# Поиск по продуктам: по умолчанию выбирается по типу БД
+# (PostgreSQL - tsvector/GIN, SQLite - FTS5)
+PRODUCT_SEARCH_BACKEND = config('PRODUCT_SEARCH_BACKEND', default=None)
+PRODUCT_SEARCH_CONFIG = 'simple'
+
+# Idempotency-Key для создания заказов и отзывов:
+# db - таблица с блокировкой строки, cache - кэш Django
+IDEMPOTENCY_BACKEND = config('IDEMPOTENCY_BACKEND', default='db')
+IDEMPOTENCY_TTL = 60 * 60 * 24
+
+# агрегаты продаж учитывают заказы старше этого числа секунд
+SALES_ROLLUP_LAG = 60
+
+# sync - заказ оформляется в запросе, async - POST /orders/ ставит его
+# в очередь (OrderIntake) и отвечает 202, оформляет drain_order_intake
+ORDER_INTAKE_MODE = config('ORDER_INTAKE_MODE', default='sync')
+ORDER_INTAKE_BATCH_SIZE = 100
+# сколько секунд копить заказы перед запуском задачи
+ORDER_INTAKE_DRAIN_DELAY = 1
+# сверх этих лимитов в очереди - 503 с Retry-After
+ORDER_INTAKE_MAX_PENDING = 10000
+ORDER_INTAKE_MAX_PENDING_PER_USER = 20
+ORDER_INTAKE_RETRY_AFTER = 5
+
+# кэш токенов (account.authentication): LRU процесса поверх кэша Django
+AUTH_TOKEN_CACHE_TTL = 60 * 5
+AUTH_TOKEN_LOCAL_CACHE_TTL = 5
+AUTH_TOKEN_LOCAL_CACHE_SIZE = 10000
+
+# счётчики throttling: по умолчанию pipeline Redis при django_redis,
+# иначе API кэша Django
+THROTTLE_BACKEND = config('THROTTLE_BACKEND', default=None)
+
+# очередь писем (account.mail): отправка пачками через одно соединение
+MAIL_OUTBOX_BATCH_SIZE = 100
+MAIL_OUTBOX_DRAIN_DELAY = 1
+MAIL_OUTBOX_MAX_ATTEMPTS = 5
+# отступ после первой ошибки, дальше удваивается (не больше часа)
+MAIL_OUTBOX_RETRY_DELAY = 60
+# на сколько секунд drain берёт пачку; после падения письма вернутся в очередь
+MAIL_OUTBOX_LEASE = 60 * 5
+
+# вечерний дайджест (account.digest): с этого часа по TIME_ZONE,
+# пачками по DIGEST_BATCH_SIZE получателей
+DIGEST_HOUR = 20
+DIGEST_BATCH_SIZE = 500
+# сколько секунд задача держит пачку; потом её подхватит координатор
+DIGEST_BATCH_LEASE = 600
+# столько раз пачку берут задачи, включая повторы, прежде чем бросить
+DIGEST_BATCH_MAX_ATTEMPTS = 10
@@ -0,0 +1,142 @@
+import csv
+import json
+import sys
+import zlib
+from datetime import date, datetime
+
+from django.core.management.base import BaseCommand
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from rest_framework.exceptions import ValidationError
+
+FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+# строки склеиваются в куски примерно такого размера
+BUFFER_SIZE = 64 * 1024
+
+
+class Export:
+    """
+    Выгрузка таблицы: values() вместо объектов модели и
+    iterator(), который в PostgreSQL читает серверным курсором,
+    поэтому память не зависит от размера таблицы.
+    """
+    chunk_size = 2000
+
+    def __init__(self, queryset, fields, name):
+        self.queryset = queryset
+        self.fields = fields
+        self.name = name
+
+    def rows(self):
+        return self.queryset.order_by('pk').values(*self.fields).iterator(
+            chunk_size=self.chunk_size
+        )
+
+
+class _Echo:
+    def write(self, value):
+        return value
+
+
+def _csv_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def iter_csv(rows, fields):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(fields)
+    for row in rows:
+        yield writer.writerow([_csv_value(row[field]) for field in fields])
+
+
+def iter_ndjson(rows, fields):
+    for row in rows:
+        yield json.dumps(row, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
+
+
+def iter_buffered(lines, size=BUFFER_SIZE):
+    buffer = []
+    length = 0
+    for line in lines:
+        buffer.append(line)
+        length += len(line)
+        if length >= size:
+            yield ''.join(buffer).encode()
+            buffer = []
+            length = 0
+    if buffer:
+        yield ''.join(buffer).encode()
+
+
+def iter_gzip(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def iter_export(export, fmt, gzip=False):
+    writer = iter_csv if fmt == 'csv' else iter_ndjson
+    chunks = iter_buffered(writer(export.rows(), export.fields))
+    if gzip:
+        chunks = iter_gzip(chunks)
+    return chunks
+
+
+def export_response(export, fmt, gzip=False):
+    filename = f'{export.name}.{fmt}'
+    content_type = FORMATS[fmt]
+    if gzip:
+        filename += '.gz'
+        content_type = 'application/gzip'
+    response = StreamingHttpResponse(iter_export(export, fmt, gzip),
+                                     content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+def write_export(export, fmt, file, gzip=False):
+    for chunk in iter_export(export, fmt, gzip):
+        file.write(chunk)
+
+
+def export_from_request(request, exports):
+    """
+    ?dataset= - имя выгрузки (по умолчанию первая),
+    ?type=csv|ndjson, ?gzip=1
+    """
+    params = request.query_params
+    name = params.get('dataset', next(iter(exports)))
+    fmt = params.get('type', 'csv')
+    if name not in exports:
+        raise ValidationError({'dataset': f'Доступно: {", ".join(exports)}'})
+    if fmt not in FORMATS:
+        raise ValidationError({'type': f'Доступно: {", ".join(FORMATS)}'})
+    gzip = params.get('gzip', '').lower() in ('1', 'true', 'yes')
+    return export_response(exports[name](), fmt, gzip)
+
+
+class BaseExportCommand(BaseCommand):
+    exports = {}
+
+    def add_arguments(self, parser):
+        parser.add_argument('dataset', choices=list(self.exports))
+        parser.add_argument('--type', choices=list(FORMATS), default='csv')
+        parser.add_argument('--gzip', action='store_true')
+        parser.add_argument('--output', help='по умолчанию stdout')
+
+    def handle(self, *args, **options):
+        export = self.exports[options['dataset']]()
+        if options['output']:
+            with open(options['output'], 'wb') as file:
+                write_export(export, options['type'], file, options['gzip'])
+        else:
+            write_export(export, options['type'], sys.stdout.buffer,
+                         options['gzip'])
@@ -0,0 +1,131 @@
+import socketserver
+import threading
+from contextlib import contextmanager
+
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+
+
+class QueryBudgetMixin:
+    """
+    Миксин для TestCase: проверяет, что число SQL-запросов
+    эндпоинта не зависит от количества строк в ответе
+    """
+    def assertQueryBudget(self, client, url, create, sizes=(1, 5),
+                          max_queries=None, params=None):
+        """
+        create(n) добавляет n строк; перед каждым запросом их
+        становится sizes[i]. Число запросов должно быть одинаковым
+        и не больше max_queries.
+        """
+        # прогрев: кэш токена и т.п. не должен влиять на подсчёт
+        client.get(url, params)
+        counts = {}
+        created = 0
+        for size in sizes:
+            create(size - created)
+            created = size
+            with CaptureQueriesContext(connection) as queries:
+                response = client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            counts[size] = len(queries)
+
+        sql = '\n'.join(query['sql'] for query in queries.captured_queries)
+        self.assertEqual(len(set(counts.values())), 1,
+                         f'Число запросов растёт с числом строк: {counts}\n'
+                         f'{sql}')
+        if max_queries is not None:
+            self.assertLessEqual(counts[created], max_queries,
+                                 f'Превышен бюджет запросов\n{sql}')
+        return counts[created]
+
+
+@contextmanager
+def eager_celery():
+    """
+    Задачи Celery выполняются сразу в текущем процессе, брокер - в памяти:
+    тестам не нужен Redis, что бы ни было в окружении.
+    Настройки CELERY_* из Django читаются приложением Celery раньше
+    app.conf, поэтому меняются и те, и другие.
+    """
+    from shop import celery_app
+
+    options = {'task_always_eager': True, 'task_eager_propagates': True,
+               'broker_url': 'memory://'}
+    previous = {name: getattr(celery_app.conf, name) for name in options}
+    with override_settings(**{f'CELERY_{name.upper()}': value
+                              for name, value in options.items()}):
+        celery_app.conf.update(options)
+        try:
+            yield
+        finally:
+            celery_app.conf.update(previous)
+
+
+class LocalSMTPServer:
+    """
+    Простейший SMTP-сервер для тестов в отдельном потоке.
+    Письма складываются в messages, RCPT на адреса из reject
+    отклоняется временной ошибкой 451.
+
+        with LocalSMTPServer() as smtp:
+            with override_settings(EMAIL_HOST='127.0.0.1',
+                                   EMAIL_PORT=smtp.port, ...):
+    """
+    def __init__(self, reject=()):
+        self.reject = set(reject)
+        self.messages = []
+        self.connections = 0
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def reply(self, line):
+                self.wfile.write(f'{line}\r\n'.encode())
+
+            def handle(self):
+                server.connections += 1
+                self.reply('220 localhost')
+                recipients = []
+                for raw in self.rfile:
+                    command = raw.decode().strip()
+                    verb = command[:4].upper()
+                    if verb == 'RCPT':
+                        address = command.split(':', 1)[1].strip(' <>')
+                        if address in server.reject:
+                            self.reply('451 Try again later')
+                            continue
+                        recipients.append(address)
+                    elif verb == 'DATA':
+                        self.reply('354 End data with <CR><LF>.<CR><LF>')
+                        lines = []
+                        for line in self.rfile:
+                            if line == b'.\r\n':
+                                break
+                            lines.append(line)
+                        server.messages.append(
+                            (recipients, b''.join(lines).decode())
+                        )
+                        recipients = []
+                    elif verb == 'QUIT':
+                        self.reply('221 Bye')
+                        return
+                    elif verb not in ('EHLO', 'HELO', 'MAIL', 'RSET',
+                                      'NOOP'):
+                        self.reply('502 Command not implemented')
+                        continue
+                    self.reply('250 OK')
+
+        self.server = socketserver.ThreadingTCPServer(('127.0.0.1', 0),
+                                                      Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever,
+                         daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,143 @@
+import hashlib
+import math
+import re
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.module_loading import import_string
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+KEY_PREFIX = 'throttle'
+DURATIONS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 60 * 60 * 24}
+
+
+def parse_rate(rate):
+    """'10/min' -> (10, 60), '5/15m' -> (5, 900)"""
+    count, period = rate.split('/')
+    multiplier, unit = re.match(r'(\d*)([smhd])', period).groups()
+    return int(count), int(multiplier or 1) * DURATIONS[unit]
+
+
+class CacheWindowStore:
+    """
+    Счётчики окон через API кэша Django (add + incr + get).
+    Подходит для любого бэкенда, в том числе locmem в тестах.
+    """
+    def hit(self, key, window, ttl):
+        current_key = f'{key}:{window}'
+        cache.add(current_key, 0, ttl)
+        try:
+            current = cache.incr(current_key)
+        except ValueError:
+            # ключ вытеснен между add и incr
+            cache.set(current_key, 1, ttl)
+            current = 1
+        return current, cache.get(f'{key}:{window - 1}', 0)
+
+
+class RedisWindowStore:
+    """
+    INCR, EXPIRE текущего окна и GET предыдущего одним pipeline -
+    один round trip до Redis на проверку. Нужен django_redis.
+    """
+    def hit(self, key, window, ttl):
+        from django_redis import get_redis_connection
+
+        current_key = cache.make_key(f'{key}:{window}')
+        pipe = get_redis_connection('default').pipeline()
+        pipe.incr(current_key)
+        pipe.expire(current_key, ttl)
+        pipe.get(cache.make_key(f'{key}:{window - 1}'))
+        current, _, previous = pipe.execute()
+        return current, int(previous or 0)
+
+
+def get_window_store():
+    path = getattr(settings, 'THROTTLE_BACKEND', None)
+    if path:
+        return import_string(path)()
+    if type(cache).__module__.startswith('django_redis'):
+        return RedisWindowStore()
+    return CacheWindowStore()
+
+
+def check_rate(key, limit, duration, now=None):
+    """
+    Скользящее окно по двум фиксированным: число запросов оценивается
+    как текущее окно + предыдущее, взвешенное по непрошедшей доле.
+    Отклонённые запросы тоже считаются. Возвращает None, если запрос
+    разрешён, иначе сколько секунд ждать.
+    """
+    now = time.time() if now is None else now
+    window, offset = divmod(now, duration)
+    window = int(window)
+    current, previous = get_window_store().hit(key, window, duration * 2)
+    weight = 1 - offset / duration
+    if current + previous * weight <= limit:
+        return None
+    if current > limit:
+        # раньше начала следующего окна не пропустим
+        wait = duration - offset
+    else:
+        # когда вес предыдущего окна упадёт достаточно
+        wait = duration * (1 - (limit - current) / previous) - offset
+    return max(1, math.ceil(wait))
+
+
+class SlidingWindowThrottle(BaseThrottle):
+    """
+    Ограничение по IP. Лимит - DEFAULT_THROTTLE_RATES по ключу
+    '<throttle_scope вьюхи>_<kind>', например 'login_ip': '10/min'.
+    Без лимита в настройках проверка не выполняется.
+    """
+    kind = 'ip'
+
+    def get_ident_value(self, request):
+        return self.get_ident(request)
+
+    def allow_request(self, request, view):
+        self.wait_seconds = None
+        scope = getattr(view, 'throttle_scope', None)
+        rates = api_settings.DEFAULT_THROTTLE_RATES
+        rate = rates.get(f'{scope}_{self.kind}')
+        if not scope or not rate:
+            return True
+        ident = self.get_ident_value(request)
+        if not ident:
+            return True
+        limit, duration = parse_rate(rate)
+        digest = hashlib.sha1(str(ident).encode()).hexdigest()
+        self.wait_seconds = check_rate(
+            f'{KEY_PREFIX}:{scope}_{self.kind}:{digest}', limit, duration
+        )
+        return self.wait_seconds is None
+
+    def wait(self):
+        return self.wait_seconds
+
+
+class UserSlidingWindowThrottle(SlidingWindowThrottle):
+    """По пользователю, для анонимов - по IP"""
+    kind = 'user'
+
+    def get_ident_value(self, request):
+        if request.user and request.user.is_authenticated:
+            return f'user:{request.user.pk}'
+        return f'ip:{self.get_ident(request)}'
+
+
+class EmailSlidingWindowThrottle(SlidingWindowThrottle):
+    """
+    По email из тела запроса: не даёт перебирать пароль или слать
+    письма на один адрес с разных IP
+    """
+    kind = 'email'
+
+    def get_ident_value(self, request):
+        email = request.data.get('email') \
+            if hasattr(request.data, 'get') else None
+        if not isinstance(email, str):
+            return None
+        return email.strip().lower()